@@ -0,0 +1,148 @@
+"""
+Non-blocking database access for the driver-app hot paths.
+
+Route fetch, stop status, location updates, heartbeat and login run on an
+asyncpg pool so a slow query only suspends its own request instead of the
+event loop (and every socket.io client with it). The statements live in
+HOT_QUERIES and are prepared on each new pool connection; asyncpg keeps them
+in the connection's statement cache, so requests skip parse and plan.
+
+Everything else still goes through the psycopg2 pool in api.db_pool.
+"""
+import asyncio
+import asyncpg
+from contextlib import asynccontextmanager
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+from api.db_pool import PoolTimeout
+
+ASYNC_DB_SETTINGS = CONFIG.get("async_database", {})
+
+HOT_QUERIES = {
+    "login_user": "SELECT id, password_hash FROM drivers WHERE username = $1",
+    "touch_driver": "UPDATE drivers SET last_seen = NOW() WHERE id = $1",
+    # $2 is the API's date, the same one the route cache keys on (not the database's CURRENT_DATE)
+    "todays_route": """
+        SELECT id, status, planned_date
+        FROM routes
+        WHERE driver_id = $1 AND planned_date = $2
+        LIMIT 1
+    """,
+    "route_stops": """
+        SELECT rs.id as stop_id, rs.sequence_number, rs.estimated_arrival_time,
+               rs.status as stop_status, rs.fail_reason,
+               o.delivery_address, o.lat, o.lng, o.priority, o.contact_person, o.contact_mobile
+        FROM route_stops rs
+        JOIN orders o ON rs.order_id = o.id
+        WHERE rs.route_id = $1
+        ORDER BY rs.sequence_number
+    """,
+    # Ownership check and update in one round trip; no row means not the driver's stop.
+    # Finishing a stop stamps its departure. Arrival is normally stamped earlier by
+    # mark_arrival; it is only filled in here when no location ping recorded one.
+    "update_stop_status": """
+        UPDATE route_stops rs
+        SET status = $1::order_status,
+            fail_reason = CASE WHEN $1::order_status = 'FAILED' AND $2::text IS NOT NULL THEN $2 ELSE rs.fail_reason END,
+            actual_arrival_time = CASE WHEN $1::order_status IN ('DELIVERED', 'FAILED', 'PICKED_UP')
+                                       THEN COALESCE(rs.actual_arrival_time, NOW())
+                                       ELSE rs.actual_arrival_time END,
+            actual_departure_time = CASE WHEN $1::order_status IN ('DELIVERED', 'FAILED')
+                                         THEN NOW() ELSE rs.actual_departure_time END
+        FROM routes r
+        WHERE rs.id = $3 AND rs.route_id = r.id AND r.driver_id = $4
+        RETURNING rs.id, r.planned_date
+    """,
+    # Location ping within arrival_radius_m of the driver's next stop (see RiskMonitor.driver_position)
+    "mark_arrival": """
+        UPDATE route_stops rs
+        SET actual_arrival_time = NOW()
+        FROM routes r
+        WHERE rs.id = $1 AND rs.route_id = r.id AND r.driver_id = $2
+        AND rs.actual_arrival_time IS NULL
+    """,
+    "update_location": """
+        UPDATE drivers SET last_known_lat = $1, last_known_lng = $2, last_seen = NOW()
+        WHERE id = $3
+        RETURNING full_name
+    """,
+}
+
+
+async def _prepare_hot_queries(conn):
+    for sql in HOT_QUERIES.values():
+        await conn.prepare(sql)
+
+
+class AsyncDatabase:
+    """Owns the asyncpg pool; opened on startup, closed on shutdown."""
+
+    def __init__(self):
+        self.pool = None
+
+    async def open(self):
+        params = get_db_params()
+        self.pool = await asyncpg.create_pool(
+            host=params["host"],
+            port=int(params["port"]),
+            database=params["database"],
+            user=params["user"],
+            password=params["password"],
+            min_size=ASYNC_DB_SETTINGS.get("min_size", 5),
+            max_size=ASYNC_DB_SETTINGS.get("max_size", 50),
+            command_timeout=ASYNC_DB_SETTINGS.get("command_timeout_seconds", 10),
+            statement_cache_size=ASYNC_DB_SETTINGS.get("statement_cache_size", 256),
+            init=_prepare_hot_queries,
+        )
+        logger.info(f"Async database pool ready (max {self.pool.get_max_size()} connections).")
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def stats(self):
+        if self.pool is None:
+            return {"open": False}
+        return {
+            "open": True,
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "max_size": self.pool.get_max_size(),
+        }
+
+    @asynccontextmanager
+    async def acquire(self):
+        """A pool connection; waiting too long raises PoolTimeout like the psycopg2 pool."""
+        if self.pool is None:
+            raise RuntimeError("Async database pool is not open")
+        timeout = ASYNC_DB_SETTINGS.get("acquire_timeout_seconds", 5)
+        try:
+            conn = await self.pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No async database connection available within {timeout}s")
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    async def fetch(self, name, *args):
+        async with self.acquire() as conn:
+            return [dict(r) for r in await conn.fetch(HOT_QUERIES[name], *args)]
+
+    async def fetchrow(self, name, *args):
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(HOT_QUERIES[name], *args)
+            return dict(row) if row else None
+
+    async def execute(self, name, *args):
+        """Runs a statement and returns the number of rows it affected."""
+        async with self.acquire() as conn:
+            result = await conn.execute(HOT_QUERIES[name], *args)
+            # Status tags look like "UPDATE 1"
+            return int(result.split()[-1]) if result.split()[-1].isdigit() else 0
+
+
+# Global instance
+ASYNC_DB = AsyncDatabase()
@@ -0,0 +1,280 @@
+"""
+Pooled PostgreSQL connections for the API.
+
+DB_POOL keeps between min_size and max_size open psycopg2 connections.
+acquire() waits at most acquire_timeout_seconds for a free slot and raises
+PoolTimeout otherwise. Connections come back wrapped in PooledConnection,
+whose close() returns them to the pool (rolling back any open transaction),
+so handlers written against plain psycopg2 connections keep working.
+
+Connections handed out by get_db_conn() during a request are also tracked
+per request; the release_db_connections middleware returns any the handler
+did not close (e.g. on an exception path), so nothing leaks.
+
+get_db_conn() is awaited from async handlers: a connection that is idle is
+handed out directly, anything that may block (waiting for a slot, opening a
+new connection) runs in the threadpool so the event loop keeps serving the
+requests that will release connections.
+"""
+import time
+import threading
+import collections
+from contextlib import contextmanager
+from contextvars import ContextVar
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+from starlette.concurrency import run_in_threadpool
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+
+POOL_SETTINGS = CONFIG.get("database_pool", {})
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the acquisition timeout."""
+
+
+class PooledConnection:
+    """A pool connection whose close() hands it back instead of closing it."""
+
+    def __init__(self, pool, conn):
+        self.__dict__['_pool'] = pool
+        self.__dict__['_conn'] = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__['_conn']
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.__dict__['_conn'], name, value)
+
+    @property
+    def closed(self):
+        conn = self.__dict__['_conn']
+        return 1 if conn is None else conn.closed
+
+    def close(self):
+        conn = self.__dict__['_conn']
+        if conn is not None:
+            self.__dict__['_conn'] = None
+            self.__dict__['_pool'].release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Same transaction semantics as a psycopg2 connection block, plus release
+        conn = self.__dict__['_conn']
+        if conn is not None and not conn.closed:
+            if exc_type is None:
+                conn.commit()
+            else:
+                conn.rollback()
+        self.close()
+        return False
+
+
+class DatabasePool:
+    """Thread-safe bounded pool with acquisition timeouts and usage statistics."""
+
+    def __init__(self, min_size=None, max_size=None, acquire_timeout=None, max_idle_seconds=None, **connect_kwargs):
+        self.min_size = POOL_SETTINGS.get("min_size", 2) if min_size is None else min_size
+        self.max_size = POOL_SETTINGS.get("max_size", 20) if max_size is None else max_size
+        self.acquire_timeout = (
+            POOL_SETTINGS.get("acquire_timeout_seconds", 5) if acquire_timeout is None else acquire_timeout
+        )
+        self.max_idle_seconds = (
+            POOL_SETTINGS.get("max_idle_seconds", 300) if max_idle_seconds is None else max_idle_seconds
+        )
+        self._connect_kwargs = connect_kwargs or {**get_db_params(), "cursor_factory": RealDictCursor}
+        self._idle = collections.deque()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._counters = collections.Counter()
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._lock:
+            self._counters["created"] += 1
+        return conn
+
+    def open(self):
+        """Opens min_size connections up front so the first requests skip connection setup."""
+        opened = []
+        try:
+            while len(self._idle) + len(opened) < self.min_size:
+                opened.append(self._connect())
+        finally:
+            now = time.monotonic()
+            with self._lock:
+                self._idle.extend((conn, now) for conn in opened)
+        logger.info(f"Database pool ready: {len(self._idle)} idle, max {self.max_size}.")
+
+    def acquire(self, timeout=None):
+        """Returns a PooledConnection, waiting up to timeout seconds for a free slot."""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available within {timeout}s")
+        waited_ms = (time.perf_counter() - started) * 1000
+
+        try:
+            conn = None
+            with self._lock:
+                while self._idle:
+                    candidate, _ = self._idle.pop()
+                    if not candidate.closed:
+                        conn = candidate
+                        break
+                    self._counters["discarded"] += 1
+                if conn is not None:
+                    self._counters["reused"] += 1
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._counters["acquired"] += 1
+            self._wait_ms_total += waited_ms
+            self._wait_ms_max = max(self._wait_ms_max, waited_ms)
+        return PooledConnection(self, conn)
+
+    def try_acquire_idle(self):
+        """A PooledConnection if a slot and an idle connection are free right now, else None. Never blocks."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        conn = None
+        with self._lock:
+            while self._idle:
+                candidate, _ = self._idle.pop()
+                if not candidate.closed:
+                    conn = candidate
+                    break
+                self._counters["discarded"] += 1
+            if conn is not None:
+                self._in_use += 1
+                self._counters["acquired"] += 1
+                self._counters["reused"] += 1
+        if conn is None:
+            self._slots.release()
+            return None
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Takes a raw connection back: rolls back open work, drops broken or surplus connections."""
+        keep = not conn.closed
+        if keep and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+                with self._lock:
+                    self._counters["rolled_back"] += 1
+            except psycopg2.Error:
+                keep = False
+        if keep and conn.autocommit:
+            # Hand every borrower the psycopg2 default
+            conn.autocommit = False
+
+        now = time.monotonic()
+        to_close = [] if keep else [conn]
+        with self._lock:
+            self._in_use -= 1
+            self._counters["released"] += 1
+            if keep:
+                self._idle.append((conn, now))
+            # Trim connections idle for too long, keeping min_size warm
+            while len(self._idle) > self.min_size and now - self._idle[0][1] > self.max_idle_seconds:
+                to_close.append(self._idle.popleft()[0])
+        if to_close:
+            with self._lock:
+                self._counters["discarded"] += len(to_close)
+        for stale in to_close:
+            try:
+                stale.close()
+            except psycopg2.Error:
+                pass
+        self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager: a pooled connection that is always released on exit."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def count_leak(self):
+        with self._lock:
+            self._counters["leaked_released"] += 1
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), collections.deque()
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def stats(self):
+        with self._lock:
+            acquired = self._counters["acquired"]
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "acquired": acquired,
+                "created": self._counters["created"],
+                "reused": self._counters["reused"],
+                "rolled_back": self._counters["rolled_back"],
+                "discarded": self._counters["discarded"],
+                "leaked_released": self._counters["leaked_released"],
+                "timeouts": self._counters["timeouts"],
+                "avg_wait_ms": round(self._wait_ms_total / acquired, 2) if acquired else 0.0,
+                "max_wait_ms": round(self._wait_ms_max, 2),
+            }
+
+
+# Global instance
+DB_POOL = DatabasePool()
+
+# Connections handed out during the current request, released by the middleware
+_request_connections = ContextVar("request_connections", default=None)
+
+
+async def get_db_conn():
+    """A pooled RealDictCursor connection; close() returns it to the pool."""
+    conn = DB_POOL.try_acquire_idle()
+    if conn is None:
+        conn = await run_in_threadpool(DB_POOL.acquire)
+    tracked = _request_connections.get()
+    if tracked is not None:
+        tracked.append(conn)
+    return conn
+
+
+async def release_db_connections(request, call_next):
+    """HTTP middleware: returns connections a handler left open to the pool."""
+    tracked = []
+    token = _request_connections.set(tracked)
+    try:
+        return await call_next(request)
+    finally:
+        for conn in tracked:
+            if not conn.closed:
+                DB_POOL.count_leak()
+                conn.close()
+        _request_connections.reset(token)
@@ -1,7 +1,6 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Request
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Request, Response
 from fastapi.responses import StreamingResponse, FileResponse
-import io
-import csv
+import base64
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
@@ -10,16 +9,37 @@ import asyncio
 from jose import JWTError, jwt
 import bcrypt
 import psycopg2
+import asyncpg
 from psycopg2 import errors
 import os
 import uuid
 from psycopg2.extras import RealDictCursor
 from scripts.optimizer_prototype import run_optimization
 from scripts.data_model_loop import run_data_model_loop
+from scripts.performance_metrics import update_performance_metrics
+from scripts.location_history import LOCATION_BUFFER, maintain_partitions
+from scripts.route_resequencer import resequence_route
+from scripts.dispatch_checks import check_moves, invalidate_dispatch_plan
+from scripts.scenarios import run_scenarios
+from scripts.route_geometry import attach_route_geometries
+from scripts.order_import import import_orders, detect_format, FORMATS as ORDER_IMPORT_FORMATS
+from scripts.profiling import RunProfiler, ProfilerBusy, NULL_PROFILER, profiling_requested, profile_dump_path
 from api.logger_config import logger
 from api.db_config import get_db_params
+from api.db_pool import DB_POOL, PoolTimeout, get_db_conn, release_db_connections
+from api.async_db import ASYNC_DB, HOT_QUERIES
+from api.route_cache import cached_route_response, bump_route_version, route_cache_stats
+from api.queries import ORDERS_PAGE_SQL, ROUTES_WITH_STOPS_SQL, FLEET_ROLLUPS_SQL, DRIVER_ROLLUPS_SQL
+from api.realtime import Broadcaster, date_room
+from api.risk_monitor import RiskMonitor
+from api.report_export import stream_report, parquet_available, MEDIA_TYPES as REPORT_MEDIA_TYPES
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+import json
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, List, Dict
+from pydantic import BaseModel
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -64,49 +84,32 @@ async def get_current_driver(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
 
+def driver_from_token(token):
+    """Driver id of a valid access token, else None (socket.io handshakes)."""
+    try:
+        return jwt.decode(token or "", SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
 app = FastAPI(title="Delivery Optimizer API")
 limiter = Limiter(key_func=get_remote_address, default_limits=[CONFIG["rate_limits"]["default"]])
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 app.add_middleware(SlowAPIMiddleware)
+# Returns pooled connections a handler did not close, including on error paths
+app.middleware("http")(release_db_connections)
 
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    logger.warning(f"Database pool exhausted: {exc}")
+    return JSONResponse(status_code=503, content={"detail": "Database busy, please retry"}, headers={"Retry-After": "1"})
 
-# Background Task for Risks
-async def check_delivery_risks():
-    """Periodically checks for late deliveries and capacity issues."""
-    while True:
-        try:
-            conn = get_db_conn()
-            cur = conn.cursor()
-            
-            # 1. Check for Late Deliveries
-            cur.execute("""
-                SELECT rs.id, o.delivery_address, r.driver_id, d.full_name, rs.estimated_arrival_time
-                FROM route_stops rs
-                JOIN orders o ON rs.order_id = o.id
-                JOIN routes r ON rs.route_id = r.id
-                JOIN drivers d ON r.driver_id = d.id
-                WHERE rs.status = 'ASSIGNED' 
-                AND rs.estimated_arrival_time < NOW() + INTERVAL '15 minutes'
-                AND r.planned_date = CURRENT_DATE
-            """)
-            risks = cur.fetchall()
-            
-            for risk in risks:
-                await sio.emit('alert', {
-                    'type': 'LATE_RISK',
-                    'message': f"Late Risk: Delivery to {risk['delivery_address']} for {risk['full_name']}",
-                    'driver_id': str(risk['driver_id']),
-                    'stop_id': str(risk['id'])
-                })
-
-            cur.close()
-            conn.close()
-        except Exception as e:
-            print(f"Risk Monitor Error: {e}")
-        
-        await asyncio.sleep(60) # Check every minute
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+# Rooms per audience; locations and fleet updates go out once per tick
+BROADCASTER = Broadcaster(sio, verify_token=driver_from_token)
+BROADCASTER.register()
+# Late-delivery alerts from an in-memory schedule of today's stop ETAs
+RISK_MONITOR = RiskMonitor(BROADCASTER)
 
 async def data_model_daily_task():
     """Runs the Data Model loop every day at midnight."""
@@ -121,14 +124,53 @@ async def data_model_daily_task():
         
         try:
             logger.info("Starting scheduled daily Data Model run...")
-            run_data_model_loop()
+            await asyncio.to_thread(run_data_model_loop, force=True)
         except Exception as e:
             logger.error(f"Scheduled Data Model Error: {e}")
 
+async def performance_metrics_task():
+    """Folds recent stop changes into performance_metrics every few minutes."""
+    interval = CONFIG.get("performance_metrics", {}).get("interval_minutes", 5) * 60
+    while True:
+        try:
+            await asyncio.to_thread(update_performance_metrics)
+        except Exception as e:
+            logger.error(f"Performance Metrics Task Error: {e}")
+        await asyncio.sleep(interval)
+
+async def location_history_task():
+    """Flushes buffered GPS pings every few seconds and rolls the daily partitions hourly."""
+    settings = CONFIG.get("location_history", {})
+    interval = settings.get("flush_interval_seconds", 5)
+    maintenance_every = settings.get("maintenance_interval_minutes", 60) * 60
+    last_maintenance = None
+    while True:
+        try:
+            now = asyncio.get_running_loop().time()
+            if last_maintenance is None or now - last_maintenance >= maintenance_every:
+                await asyncio.to_thread(maintain_partitions)
+                last_maintenance = now
+            await asyncio.to_thread(LOCATION_BUFFER.flush)
+        except Exception as e:
+            logger.error(f"Location History Task Error: {e}")
+        await asyncio.sleep(interval)
+
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(check_delivery_risks())
+    try:
+        await asyncio.to_thread(DB_POOL.open)
+    except psycopg2.Error as e:
+        logger.error(f"Could not pre-open database connections: {e}")
+    try:
+        await ASYNC_DB.open()
+    except (OSError, asyncpg.PostgresError) as e:
+        logger.error(f"Could not open async database pool: {e}")
+    asyncio.create_task(RISK_MONITOR.run())
     asyncio.create_task(data_model_daily_task())
+    asyncio.create_task(performance_metrics_task())
+    asyncio.create_task(BROADCASTER.run())
+    if LOCATION_HISTORY_ENABLED:
+        asyncio.create_task(location_history_task())
 
 # Add CORS Middleware
 app.add_middleware(
@@ -137,12 +179,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Next-Cursor", "Link"],  # GET /orders paging
 )
 
 DB_PARAMS = get_db_params()
+ROUTE_GEOMETRY_ENABLED = CONFIG.get("route_geometry", {}).get("enabled", True)
+LOCATION_HISTORY_ENABLED = CONFIG.get("location_history", {}).get("enabled", True)
+# Early flushes of a full location buffer; held here so they are not garbage-collected mid-run
+_flush_tasks = set()
 
-def get_db_conn():
-    return psycopg2.connect(**DB_PARAMS, cursor_factory=RealDictCursor)
+def _flush_done(task):
+    _flush_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Location buffer flush failed: {task.exception()}")
 
 # Serve Frontend
 @app.get("/driver")
@@ -169,11 +218,49 @@ def liveness():
 @app.post("/admin/run-data-model")
 async def manual_data_model_trigger():
     """Manually triggers the Data Model loop."""
-    result = run_data_model_loop()
+    result = await asyncio.to_thread(run_data_model_loop, force=True)
     if result["status"] == "error":
         raise HTTPException(status_code=500, detail=result["message"])
     return result
 
+@app.get("/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str):
+    """Downloads the cProfile dump of a profiled optimization run (open with pstats or snakeviz)."""
+    path = profile_dump_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.post("/admin/update-performance-metrics")
+async def manual_performance_metrics_update():
+    """Runs one incremental performance_metrics pass now instead of waiting for the background task."""
+    result = await asyncio.to_thread(update_performance_metrics)
+    if result["status"] == "error":
+        raise HTTPException(status_code=500, detail=result["message"])
+    return result
+
+@app.get("/admin/db-pool")
+async def database_pool_stats():
+    """Connection pool usage: connections in use and idle, reuse counts, acquisition waits and timeouts."""
+    return {**DB_POOL.stats(), "async": ASYNC_DB.stats()}
+
+@app.get("/admin/route-cache")
+async def route_cache_status():
+    """Route poll cache: hits, misses, 304 answers and cached responses."""
+    return route_cache_stats()
+
+@app.get("/admin/risk-monitor")
+async def risk_monitor_status():
+    """Open stops being watched, alerts sent today and the next alert deadline."""
+    return RISK_MONITOR.snapshot()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ASYNC_DB.close()
+    if LOCATION_HISTORY_ENABLED:
+        await asyncio.to_thread(LOCATION_BUFFER.close)
+    DB_POOL.close_all()
+
 # Create uploads directory if it doesn't exist
 UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
@@ -185,14 +272,10 @@ app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 @app.post("/login")
 @limiter.limit(CONFIG["rate_limits"]["login"])
 async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, password_hash FROM drivers WHERE username = %s", (form_data.username,))
-    user = cur.fetchone()
-    
-    if not user or not verify_password(form_data.password, user['password_hash']):
-        cur.close()
-        conn.close()
+    user = await ASYNC_DB.fetchrow("login_user", form_data.username)
+
+    # bcrypt is deliberately slow; keep it off the event loop
+    if not user or not await run_in_threadpool(verify_password, form_data.password, user['password_hash']):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -200,13 +283,10 @@ async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends
         )
     
     # Update last_seen on login
-    cur.execute("UPDATE drivers SET last_seen = NOW() WHERE id = %s", (user['id'],))
-    conn.commit()
-    cur.close()
-    conn.close()
+    await ASYNC_DB.execute("touch_driver", user['id'])
     
     # Emit fleet update for dashboard
-    await sio.emit('fleet_update', {'driver_id': str(user['id']), 'status': 'ONLINE'})
+    BROADCASTER.queue_fleet_update({'driver_id': str(user['id']), 'status': 'ONLINE'})
     
     access_token = create_access_token(data={"sub": str(user['id'])})
     return {"access_token": access_token, "token_type": "bearer", "driver_id": user['id']}
@@ -214,7 +294,7 @@ async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends
 @app.post("/logout")
 async def logout(current_driver: str = Depends(get_current_driver)):
     """Logs out a driver by clearing their last_seen status."""
-    conn = get_db_conn()
+    conn = await get_db_conn()
     cur = conn.cursor()
     cur.execute("UPDATE drivers SET last_seen = NULL WHERE id = %s", (current_driver,))
     conn.commit()
@@ -222,14 +302,14 @@ async def logout(current_driver: str = Depends(get_current_driver)):
     conn.close()
     
     # Emit fleet update for dashboard
-    await sio.emit('fleet_update', {'driver_id': str(current_driver), 'status': 'OFFLINE'})
+    BROADCASTER.queue_fleet_update({'driver_id': str(current_driver), 'status': 'OFFLINE'})
     return {"message": "Logged out successfully"}
 
 @app.post("/drivers/{identifier}/check-in")
 async def driver_check_in(identifier: str):
     """Marks a driver as starting their shift. Supports Driver UUID or Vehicle Plate Number."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         # 1. Try to find by Driver ID (UUID)
@@ -265,7 +345,7 @@ async def driver_check_in(identifier: str):
         conn.close()
 
         # Emit fleet update for dashboard
-        await sio.emit('fleet_update', {'driver_id': str(row['id']), 'status': 'ONLINE'})
+        BROADCASTER.queue_fleet_update({'driver_id': str(row['id']), 'status': 'ONLINE'})
 
         return {
             "message": f"Driver {row['full_name']} checked in",
@@ -280,13 +360,10 @@ async def driver_check_in(identifier: str):
 async def driver_heartbeat(current_driver: str = Depends(get_current_driver)):
     """Keep the driver online by updating last_seen."""
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        cur.execute("UPDATE drivers SET last_seen = NOW() WHERE id = %s", (current_driver,))
-        conn.commit()
-        cur.close()
-        conn.close()
+        await ASYNC_DB.execute("touch_driver", current_driver)
         return {"status": "alive"}
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -295,7 +372,7 @@ async def driver_heartbeat(current_driver: str = Depends(get_current_driver)):
 async def driver_check_out(identifier: str):
     """Marks a driver as ending their shift. Supports Driver UUID or Vehicle Plate Number."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         target_driver_id = None
@@ -326,7 +403,7 @@ async def driver_check_out(identifier: str):
         conn.close()
 
         if target_driver_id:
-            await sio.emit('fleet_update', {'driver_id': str(target_driver_id), 'status': 'OFFLINE'})
+            BROADCASTER.queue_fleet_update({'driver_id': str(target_driver_id), 'status': 'OFFLINE'})
 
         return {"message": "Checked out successfully", "online": False}
     except Exception as e:
@@ -336,7 +413,7 @@ async def driver_check_out(identifier: str):
 async def get_fleet():
     """Fetches all vehicle and driver data, including assignments."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("""
             SELECT d.id, d.full_name, d.contact_number, d.is_active, d.last_seen, v.plate_number as assigned_vehicle
@@ -365,7 +442,7 @@ async def get_fleet():
 async def create_vehicle(plate_number: str, type: str, capacity_weight: float = 0, capacity_volume: float = 0, is_active: bool = True):
     """Creates a new vehicle."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO vehicles (plate_number, type, capacity_weight, capacity_volume, is_active) VALUES (%s, %s, %s, %s, %s) RETURNING id",
@@ -383,7 +460,7 @@ async def create_vehicle(plate_number: str, type: str, capacity_weight: float =
 async def update_vehicle(vehicle_id: str, plate_number: Optional[str] = None, type: Optional[str] = None, capacity_weight: Optional[float] = None, is_active: Optional[bool] = None):
     """Updates vehicle details."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         updates, params = [], []
         if plate_number:
@@ -413,7 +490,7 @@ async def update_vehicle(vehicle_id: str, plate_number: Optional[str] = None, ty
 async def delete_vehicle(vehicle_id: str):
     """Deletes a vehicle."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("DELETE FROM vehicles WHERE id = %s", (vehicle_id,))
         conn.commit()
@@ -428,9 +505,9 @@ async def delete_vehicle(vehicle_id: str):
 async def create_driver(full_name: str, username: str, password: str, contact_number: Optional[str] = None, assigned_vehicle_id: Optional[str] = None):
     """Creates a new driver profile."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
-        pwd_hash = get_password_hash(password)
+        pwd_hash = await run_in_threadpool(get_password_hash, password)
         cur.execute(
             "INSERT INTO drivers (full_name, username, password_hash, contact_number, assigned_vehicle_id) VALUES (%s, %s, %s, %s, %s) RETURNING id",
             (full_name, username, pwd_hash, contact_number, assigned_vehicle_id if assigned_vehicle_id else None)
@@ -447,7 +524,7 @@ async def create_driver(full_name: str, username: str, password: str, contact_nu
 async def update_driver(driver_id: str, full_name: Optional[str] = None, contact_number: Optional[str] = None, assigned_vehicle_id: Optional[str] = "KEEP"):
     """Updates driver details and vehicle assignment."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         updates, params = [], []
         if full_name:
@@ -464,6 +541,8 @@ async def update_driver(driver_id: str, full_name: Optional[str] = None, contact
             params.append(driver_id)
             cur.execute(f"UPDATE drivers SET {', '.join(updates)} WHERE id = %s", params)
             conn.commit()
+            # Driver names appear in every route response
+            bump_route_version()
         cur.close()
         conn.close()
         return {"message": "Driver updated"}
@@ -474,12 +553,13 @@ async def update_driver(driver_id: str, full_name: Optional[str] = None, contact
 async def delete_driver(driver_id: str):
     """Deletes a driver profile."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("DELETE FROM drivers WHERE id = %s", (driver_id,))
         conn.commit()
         cur.close()
         conn.close()
+        bump_route_version()
         return {"message": "Driver deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -489,7 +569,7 @@ async def delete_driver(driver_id: str):
 async def get_periods():
     """Fetches all defined periods."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("SELECT * FROM periods ORDER BY start_date DESC")
         periods = cur.fetchall()
@@ -503,7 +583,7 @@ async def get_periods():
 async def create_period(name: str, start_date: str, end_date: str):
     """Creates a new period (date range)."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO periods (name, start_date, end_date) VALUES (%s, %s, %s) RETURNING id",
@@ -521,7 +601,7 @@ async def create_period(name: str, start_date: str, end_date: str):
 async def update_period(period_id: str, name: Optional[str] = None, start_date: Optional[str] = None, end_date: Optional[str] = None):
     """Updates an existing period."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         updates, params = [], []
         if name:
@@ -548,7 +628,7 @@ async def update_period(period_id: str, name: Optional[str] = None, start_date:
 async def delete_period(period_id: str):
     """Deletes a period."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("DELETE FROM periods WHERE id = %s", (period_id,))
         conn.commit()
@@ -563,7 +643,7 @@ async def delete_period(period_id: str):
 async def get_period_assignments(period_id: str):
     """Fetches all driver assignments for a specific period."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("SELECT driver_id FROM driver_period_assignments WHERE period_id = %s", (period_id,))
         assignments = [r['driver_id'] for r in cur.fetchall()]
@@ -577,7 +657,7 @@ async def get_period_assignments(period_id: str):
 async def assign_driver_to_period(period_id: str, driver_id: str):
     """Assigns a driver to a specific period (Roster)."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO driver_period_assignments (period_id, driver_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
@@ -594,7 +674,7 @@ async def assign_driver_to_period(period_id: str, driver_id: str):
 async def unassign_driver_from_period(period_id: str, driver_id: str):
     """Removes a driver from a specific period (Roster)."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute(
             "DELETE FROM driver_period_assignments WHERE period_id = %s AND driver_id = %s",
@@ -612,7 +692,7 @@ async def unassign_driver_from_period(period_id: str, driver_id: str):
 async def get_warehouses():
     """Fetches all warehouses."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("SELECT * FROM warehouse ORDER BY is_default DESC, created_at DESC")
         warehouses = cur.fetchall()
@@ -626,7 +706,7 @@ async def get_warehouses():
 async def get_default_warehouse():
     """Fetches the default warehouse."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("SELECT * FROM warehouse WHERE is_default = TRUE LIMIT 1")
         warehouse = cur.fetchone()
@@ -642,7 +722,7 @@ async def get_default_warehouse():
 async def create_warehouse(name: str, address: str, lat: float, lng: float, is_default: bool = False):
     """Creates a new warehouse."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         # If setting as default, unset other defaults
@@ -665,7 +745,7 @@ async def create_warehouse(name: str, address: str, lat: float, lng: float, is_d
 async def update_warehouse(warehouse_id: str, name: Optional[str] = None, address: Optional[str] = None, lat: Optional[float] = None, lng: Optional[float] = None, is_default: Optional[bool] = None):
     """Updates warehouse details."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         updates = []
@@ -710,7 +790,7 @@ async def update_warehouse(warehouse_id: str, name: Optional[str] = None, addres
 async def delete_warehouse(warehouse_id: str):
     """Deletes a warehouse."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("DELETE FROM warehouse WHERE id = %s", (warehouse_id,))
         if cur.rowcount == 0:
@@ -722,25 +802,57 @@ async def delete_warehouse(warehouse_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def optimization_cycle(date, profiler):
+    """
+    Data Model refresh, then the optimizer, run in a worker thread. The profiler is
+    started here too, because cProfile only sees the thread that enabled it.
+    Returns: (data model result, optimizer result or None if the data model failed, profile report)
+    """
+    opt_result = None
+    profiler.start()
+    try:
+        # 1. Refresh driver parameters from history (cached until new metrics arrive)
+        with profiler.phase("data model loop"):
+            dm_result = run_data_model_loop()
+        # 2. Run Route Optimizer
+        if dm_result["status"] != "error":
+            opt_result = run_optimization(planned_date=date, profiler=profiler)
+    finally:
+        report = profiler.stop()
+    return dm_result, opt_result, report
+
 @app.post("/optimize")
 @limiter.limit(CONFIG["rate_limits"]["optimize"])
-async def trigger_optimization(request: Request, date: Optional[str] = None):
-    """Triggers the route optimization process for a specific date (Period)."""
+async def trigger_optimization(request: Request, date: Optional[str] = None, profile: Optional[bool] = None, cprofile: bool = False):
+    """
+    Triggers the route optimization process for a specific date (Period).
+    profile=true times every phase and samples memory; the report is returned under "optimizer.profile".
+    cprofile=true also writes a cProfile dump, downloadable from /admin/profiles/{profile_id}.
+    Only one profiled run at a time; a second one gets 409.
+    """
     logger.info(f"Triggering optimization cycle for date: {date or 'Today'}...")
-    
-    # 1. Run Data Model Loop to update driver parameters from history
-    dm_result = run_data_model_loop()
+    if profiling_requested(profile) or cprofile:
+        profiler = RunProfiler(f"optimize {date or 'today'}", cprofile=cprofile or None)
+    else:
+        profiler = NULL_PROFILER
+
+    try:
+        dm_result, opt_result, report = await asyncio.to_thread(optimization_cycle, date, profiler)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if dm_result["status"] == "error":
         logger.error(f"Data Model Error: {dm_result['message']}")
         raise HTTPException(status_code=500, detail=f"Data Model Error: {dm_result['message']}")
-    
-    # 2. Run Route Optimizer
-    opt_result = run_optimization(planned_date=date)
+    invalidate_dispatch_plan()
+    bump_route_version(date or str(datetime.now().date()))
+    if report:
+        opt_result["profile"] = report
     if opt_result["status"] == "error":
         logger.error(f"Optimizer Error: {opt_result['message']}")
         raise HTTPException(status_code=400, detail=f"Optimizer Error: {opt_result['message']}")
     
     logger.info("Optimization cycle completed successfully.")
+    await RISK_MONITOR.refresh()
         
     return {
         "status": "success",
@@ -749,73 +861,234 @@ async def trigger_optimization(request: Request, date: Optional[str] = None):
         "optimizer": opt_result
     }
 
+class VehicleGroup(BaseModel):
+    count: int = 1
+    label: str = "Extra Vehicle"
+    vehicle_type: str = "VAN"
+    # Default to the capacities of vehicle_type in the fleet
+    capacity_weight: Optional[float] = None
+    capacity_volume: Optional[float] = None
+    max_jobs_per_day: int = 20
+
+class DepotOverride(BaseModel):
+    lat: float
+    lng: float
+
+class Scenario(BaseModel):
+    name: str
+    order_ids: Optional[List[str]] = None
+    remove_drivers: Optional[List[str]] = None
+    capacity_overrides: Optional[Dict[str, Dict[str, float]]] = None
+    add_vehicles: Optional[List[VehicleGroup]] = None
+    depot: Optional[DepotOverride] = None
+
+class ScenarioRequest(BaseModel):
+    date: Optional[str] = None
+    time_limit_seconds: Optional[int] = None
+    scenarios: List[Scenario]
+
+@app.post("/scenarios")
+@limiter.limit(CONFIG["rate_limits"]["optimize"])
+async def run_what_if_scenarios(request: Request, body: ScenarioRequest):
+    """
+    Solves what-if scenarios in parallel against the current data, without saving any routes.
+    time_limit_seconds is capped at routing.scenario_max_time_limit_seconds.
+    """
+    logger.info(f"Running {len(body.scenarios)} what-if scenarios for date: {body.date or 'Today'}...")
+    result = await asyncio.to_thread(
+        run_scenarios,
+        body.date,
+        [s.model_dump(exclude_none=True) for s in body.scenarios],
+        body.time_limit_seconds
+    )
+    if result["status"] == "error":
+        raise HTTPException(status_code=400, detail=f"Scenario Error: {result['message']}")
+    return result
+
+ROUTE_STREAM_BATCH = CONFIG.get("route_reads", {}).get("stream_batch_size", 200)
+
+async def fetch_routes_with_stops(where, params):
+    """All matching routes with their stops in a single query, plus road geometry."""
+    conn = await get_db_conn()
+    cur = conn.cursor()
+    cur.execute(ROUTES_WITH_STOPS_SQL.format(where=where), params)
+    results = cur.fetchall()
+    cur.close()
+    conn.close()
+    if ROUTE_GEOMETRY_ENABLED:
+        try:
+            await asyncio.to_thread(attach_route_geometries, results)
+        except Exception as e:
+            logger.warning(f"Route geometry unavailable: {e}")
+    return results
+
+def stream_routes_with_stops(where, params):
+    """
+    Yields a JSON array of routes batch by batch from a server-side cursor, so a
+    multi-week range never sits in memory whole. The connection is taken from the
+    pool directly: the response body outlives the request's tracked connections.
+    """
+    with DB_POOL.connection() as conn:
+        cur = conn.cursor(name="routes_stream")
+        cur.itersize = ROUTE_STREAM_BATCH
+        cur.execute(ROUTES_WITH_STOPS_SQL.format(where=where), params)
+        yield "["
+        first = True
+        while True:
+            batch = cur.fetchmany(ROUTE_STREAM_BATCH)
+            if not batch:
+                break
+            if ROUTE_GEOMETRY_ENABLED:
+                try:
+                    attach_route_geometries(batch)
+                except Exception as e:
+                    logger.warning(f"Route geometry unavailable: {e}")
+            for route in batch:
+                yield ("" if first else ",") + json.dumps(jsonable_encoder(route))
+                first = False
+        yield "]"
+        cur.close()
+
 @app.get("/routes")
-async def get_all_routes(date: Optional[str] = None, start_date: Optional[str] = None, end_date: Optional[str] = None):
-    """Fetches all planned routes and stops for a specific date or date range."""
+async def get_all_routes(request: Request, date: Optional[str] = None, start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """
+    Fetches all planned routes and stops for a specific date or date range.
+    Single dates are cached per route version (ETag / 304); ranges are streamed as the rows are read.
+    """
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        
         if start_date and end_date:
-            cur.execute("""
-                SELECT r.id as route_id, r.driver_id, d.full_name, r.status, r.planned_date
-                FROM routes r
-                JOIN drivers d ON r.driver_id = d.id
-                WHERE r.planned_date BETWEEN %s AND %s
-            """, (start_date, end_date))
-        else:
-            target_date = date if date else str(datetime.now().date())
-            cur.execute("""
-                SELECT r.id as route_id, r.driver_id, d.full_name, r.status, r.planned_date
-                FROM routes r
-                JOIN drivers d ON r.driver_id = d.id
-                WHERE r.planned_date = %s
-            """, (target_date,))
-            
-        routes = cur.fetchall()
-        
-        results = []
-        for route in routes:
-            cur.execute("""
-                SELECT rs.id as stop_id, rs.sequence_number, rs.estimated_arrival_time, 
-                       rs.status as stop_status, o.delivery_address, o.lat, o.lng, o.priority
-                FROM route_stops rs
-                JOIN orders o ON rs.order_id = o.id
-                WHERE rs.route_id = %s
-                ORDER BY rs.sequence_number
-            """, (route['route_id'],))
-            stops = cur.fetchall()
-            results.append({**route, "stops": stops})
-            
-        cur.close()
-        conn.close()
-        return results
+            try:
+                datetime.strptime(start_date, "%Y-%m-%d")
+                datetime.strptime(end_date, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="start_date and end_date must be YYYY-MM-DD")
+            return StreamingResponse(
+                stream_routes_with_stops("r.planned_date BETWEEN %s AND %s", (start_date, end_date)),
+                media_type="application/json"
+            )
+        target_date = date if date else str(datetime.now().date())
+        return await cached_route_response(
+            request, f"routes:{target_date}", target_date,
+            lambda: fetch_routes_with_stops("r.planned_date = %s", (target_date,))
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+ORDER_FIELDS = (
+    "id", "external_order_id", "customer_id", "delivery_address", "lat", "lng", "weight", "volume",
+    "time_window_start", "time_window_end", "priority", "status", "contact_person", "contact_mobile",
+    "created_at", "updated_at",
+)
+ORDER_STATUSES = ("PENDING", "ASSIGNED", "PICKED_UP", "DELIVERED", "CANCELLED", "FAILED")
+ORDER_PAGE_SETTINGS = CONFIG.get("order_pages", {})
+
+def encode_order_cursor(created_at, order_id):
+    raw = json.dumps([created_at.isoformat(), str(order_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_order_cursor(cursor):
+    """(created_at, id) of the last order on the previous page."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(uuid.UUID(order_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_csv_param(value, allowed, name):
+    items = [v.strip() for v in value.split(",") if v.strip()]
+    unknown = [v for v in items if v not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown {name}: {', '.join(unknown)}")
+    return items
+
 @app.get("/orders")
-async def get_orders(status: Optional[str] = None):
-    """Fetches all orders, optionally filtered by status."""
+async def get_orders(
+    request: Request,
+    response: Response,
+    status: Optional[str] = None,
+    fields: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    bbox: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    """
+    Fetches orders newest first, one page at a time.
+    status: one status or a comma-separated list
+    fields: comma-separated subset of ORDER_FIELDS (default: all)
+    created_from / created_to: created_at window, from inclusive, to exclusive
+    bbox: min_lng,min_lat,max_lng,max_lat
+    The body is the page as a JSON array. When more orders follow, the X-Next-Cursor header
+    (and a Link rel="next") carries the cursor to pass back for the next page.
+    """
+    statuses = parse_csv_param(status.upper(), ORDER_STATUSES, "status") if status else []
+    columns = parse_csv_param(fields, ORDER_FIELDS, "fields") if fields else list(ORDER_FIELDS)
+    max_limit = ORDER_PAGE_SETTINGS.get("max_limit", 5000)
+    limit = ORDER_PAGE_SETTINGS.get("default_limit", 500) if limit is None else limit
+    if not 1 <= limit <= max_limit:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {max_limit}")
+
+    where, params = [], []
+    if len(statuses) == 1:
+        # Plain equality keeps idx_orders_status_created's order usable; ANY() would need a sort
+        where.append("status = %s")
+        params.append(statuses[0])
+    elif statuses:
+        where.append("status = ANY(%s::order_status[])")
+        params.append(statuses)
+    if created_from:
+        where.append("created_at >= %s")
+        params.append(created_from)
+    if created_to:
+        where.append("created_at < %s")
+        params.append(created_to)
+    if bbox:
+        try:
+            min_lng, min_lat, max_lng, max_lat = (float(v) for v in bbox.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bbox must be min_lng,min_lat,max_lng,max_lat")
+        where.append("lat BETWEEN %s AND %s AND lng BETWEEN %s AND %s")
+        params.extend([min_lat, max_lat, min_lng, max_lng])
+    if cursor:
+        # Row comparison walks idx_orders_created / idx_orders_status_created from where the last page ended
+        where.append("(created_at, id) < (%s, %s::uuid)")
+        params.extend(decode_order_cursor(cursor))
+
+    # id and created_at are always read for the cursor, and dropped below if not asked for
+    select = list(dict.fromkeys(columns + ["id", "created_at"]))
+    query = ORDERS_PAGE_SQL.format(
+        columns=", ".join(select), where="WHERE " + " AND ".join(where) if where else ""
+    )
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
-        if status:
-            cur.execute("SELECT * FROM orders WHERE status = %s ORDER BY created_at DESC", (status.upper(),))
-        else:
-            cur.execute("SELECT * FROM orders ORDER BY created_at DESC")
+        cur.execute(query, params + [limit + 1])
         orders = cur.fetchall()
         cur.close()
         conn.close()
-        return orders
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_order_cursor(orders[-1]["created_at"], orders[-1]["id"])
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    extra = set(select) - set(columns)
+    if extra:
+        orders = [{k: v for k, v in order.items() if k not in extra} for order in orders]
+    return orders
+
 @app.post("/orders")
 async def create_order(delivery_address: str, lat: float, lng: float, contact_person: Optional[str] = None, contact_mobile: Optional[str] = None, priority: int = 1):
     """Creates a new delivery order."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO orders (delivery_address, lat, lng, contact_person, contact_mobile, priority) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
@@ -829,11 +1102,26 @@ async def create_order(delivery_address: str, lat: float, lng: float, contact_pe
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/orders/import")
+async def import_orders_file(file: UploadFile = File(...), format: Optional[str] = None):
+    """
+    Bulk-imports orders from a CSV or NDJSON upload, upserting on external_order_id.
+    format overrides detection from the file name / content type.
+    Invalid rows are skipped and listed in "errors" with their line numbers.
+    """
+    fmt = (format or detect_format(file.filename, file.content_type) or "").lower()
+    if fmt not in ORDER_IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Upload a .csv or .ndjson file, or pass format=csv|ndjson")
+    result = await run_in_threadpool(import_orders, file.file, fmt)
+    if result["status"] == "error":
+        raise HTTPException(status_code=400 if result["invalid_upload"] else 500, detail=result["message"])
+    return result
+
 @app.patch("/orders/{order_id}")
 async def update_order(order_id: str, delivery_address: Optional[str] = None, lat: Optional[float] = None, lng: Optional[float] = None, contact_person: Optional[str] = None, contact_mobile: Optional[str] = None, status: Optional[str] = None):
     """Updates an existing order's details or status."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         updates = []
@@ -870,6 +1158,8 @@ async def update_order(order_id: str, delivery_address: Optional[str] = None, la
         conn.commit()
         cur.close()
         conn.close()
+        # A routed order's address and position appear in its stop
+        bump_route_version()
         return {"message": "Order updated"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -878,7 +1168,7 @@ async def update_order(order_id: str, delivery_address: Optional[str] = None, la
 async def delete_all_pending_orders():
     """Deletes all PENDING orders that are not assigned to any route."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         # Only delete orders that are PENDING and NOT in route_stops
@@ -903,7 +1193,7 @@ async def delete_all_pending_orders():
 async def delete_order(order_id: str):
     """Deletes an order (only if it's PENDING and not in a route)."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         # Check if order is in a route
@@ -925,35 +1215,15 @@ async def delete_order(order_id: str):
 
 
 @app.get("/routes/today")
-async def get_all_routes_today():
+async def get_all_routes_today(request: Request):
     """Fetches all planned routes and stops for the dashboard."""
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT r.id as route_id, r.driver_id, d.full_name, r.status
-            FROM routes r
-            JOIN drivers d ON r.driver_id = d.id
-            WHERE r.planned_date = CURRENT_DATE
-        """)
-        routes = cur.fetchall()
-        
-        results = []
-        for route in routes:
-            cur.execute("""
-                SELECT rs.id as stop_id, rs.sequence_number, rs.estimated_arrival_time, 
-                       rs.status as stop_status, o.delivery_address, o.lat, o.lng, o.priority
-                FROM route_stops rs
-                JOIN orders o ON rs.order_id = o.id
-                WHERE rs.route_id = %s
-                ORDER BY rs.sequence_number
-            """, (route['route_id'],))
-            stops = cur.fetchall()
-            results.append({**route, "stops": stops})
-            
-        cur.close()
-        conn.close()
-        return results
+        # The query takes the same date as the cache key, not the database's CURRENT_DATE
+        today = str(datetime.now().date())
+        return await cached_route_response(
+            request, f"routes-today:{today}", today,
+            lambda: fetch_routes_with_stops("r.planned_date = %s", (today,))
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -962,7 +1232,7 @@ async def get_all_routes_today():
 async def clear_all_routes(date: Optional[str] = None):
     """Clears all routes for a specific date and resets associated orders to PENDING."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         target_date = date if date else str(datetime.now().date())
@@ -989,8 +1259,11 @@ async def clear_all_routes(date: Optional[str] = None):
         conn.commit()
         cur.close()
         conn.close()
+        invalidate_dispatch_plan()
+        bump_route_version(target_date)
+        await RISK_MONITOR.refresh()
         
-        await sio.emit('fleet_update', {'message': f'Routes for {target_date} cleared'})
+        BROADCASTER.queue_fleet_update({'message': f'Routes for {target_date} cleared'}, room=date_room(target_date))
         
         return {"message": f"All routes for {target_date} have been cleared and orders reset to pending."}
     except Exception as e:
@@ -1000,12 +1273,13 @@ async def clear_all_routes(date: Optional[str] = None):
 async def delete_route(route_id: str):
     """Deletes a specific route and resets associated orders to PENDING."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         # 1. Check if route exists
-        cur.execute("SELECT id FROM routes WHERE id = %s", (route_id,))
-        if not cur.fetchone():
+        cur.execute("SELECT id, planned_date FROM routes WHERE id = %s", (route_id,))
+        route = cur.fetchone()
+        if not route:
             raise HTTPException(status_code=404, detail="Route not found")
         
         # 2. Update orders to PENDING
@@ -1026,56 +1300,82 @@ async def delete_route(route_id: str):
         conn.commit()
         cur.close()
         conn.close()
+        invalidate_dispatch_plan()
+        bump_route_version(route['planned_date'])
+        await RISK_MONITOR.refresh()
         
-        await sio.emit('fleet_update', {'message': f'Route {route_id} deleted'})
+        BROADCASTER.queue_fleet_update({'message': f'Route {route_id} deleted'}, room=date_room(route['planned_date']))
         
         return {"message": f"Route {route_id} deleted and orders reset to pending."}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-async def get_driver_route(driver_id: str, current_driver: str = Depends(get_current_driver)):
-    """Fetches the planned route and stops for a specific driver for today."""
+
+@app.post("/routes/{route_id}/resequence")
+async def resequence_single_route(route_id: str, lat: Optional[float] = None, lng: Optional[float] = None):
+    """Re-optimizes the remaining stops of one route, starting from the driver's current position (or lat/lng)."""
+    start_location = (lat, lng) if lat is not None and lng is not None else None
+    # Matrix fetch and solve run in a worker thread so other requests and sockets keep flowing
+    result = await asyncio.to_thread(resequence_route, route_id, start_location=start_location)
+    if result["status"] == "error":
+        status_code = 404 if result["message"] == "Route not found" else 400
+        raise HTTPException(status_code=status_code, detail=result["message"])
+
+    invalidate_dispatch_plan()
+    bump_route_version(result["planned_date"])
+    await RISK_MONITOR.refresh()
+    BROADCASTER.queue_fleet_update({'message': f'Route {route_id} resequenced'}, room=date_room(result["planned_date"]))
+    return result
+
+class StopMove(BaseModel):
+    stop_id: str
+    route_id: str
+    position: int
+
+class MoveCheckRequest(BaseModel):
+    date: Optional[str] = None
+    moves: List[StopMove]
+
+@app.post("/routes/check-moves")
+async def check_route_moves(body: MoveCheckRequest, refresh: bool = False):
+    """Checks proposed manual stop moves for capacity, time window and shift violations, with ETA changes."""
+    target_date = body.date if body.date else str(datetime.now().date())
+    # A plan reload reads the day and fetches matrix rows; keep it off the event loop
+    result = await asyncio.to_thread(check_moves, target_date, [m.model_dump() for m in body.moves], refresh=refresh)
+    if result["status"] == "error":
+        raise HTTPException(status_code=400, detail=result["message"])
+    return result
+
+async def fetch_driver_route(driver_id, planned_date):
+    # Get the driver's route for the date, then all of its stops
+    async with ASYNC_DB.acquire() as conn:
+        route = await conn.fetchrow(HOT_QUERIES["todays_route"], driver_id, planned_date)
+        if not route:
+            return {"route": None, "stops": []}
+        stops = await conn.fetch(HOT_QUERIES["route_stops"], route['id'])
+
+    return {
+        "route_id": route['id'],
+        "status": route['status'],
+        "stops": [dict(stop) for stop in stops]
+    }
+
+@app.get("/drivers/{driver_id}/route")
+async def get_driver_route(request: Request, driver_id: str, current_driver: str = Depends(get_current_driver)):
+    """Fetches the planned route and stops for a specific driver for today (ETag / 304 aware)."""
     # Security: Ensure driver can only see their own route
     if current_driver != driver_id:
         raise HTTPException(status_code=403, detail="Not authorized to access this route")
         
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        
-        # Get the latest route for the driver
-        cur.execute("""
-            SELECT id, status, planned_date 
-            FROM routes 
-            WHERE driver_id = %s AND planned_date = CURRENT_DATE
-            LIMIT 1
-        """, (driver_id,))
-        route = cur.fetchone()
-        
-        if not route:
-            return {"route": None, "stops": []}
-            
-        # Get all stops for that route
-        cur.execute("""
-            SELECT rs.id as stop_id, rs.sequence_number, rs.estimated_arrival_time, 
-                   rs.status as stop_status, rs.fail_reason,
-                   o.delivery_address, o.lat, o.lng, o.priority, o.contact_person, o.contact_mobile
-            FROM route_stops rs
-            JOIN orders o ON rs.order_id = o.id
-            WHERE rs.route_id = %s
-            ORDER BY rs.sequence_number
-        """, (route['id'],))
-        stops = cur.fetchall()
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            "route_id": route['id'],
-            "status": route['status'],
-            "stops": stops
-        }
+        today = datetime.now().date()
+        return await cached_route_response(
+            request, f"driver-route:{driver_id}:{today}", str(today),
+            lambda: fetch_driver_route(driver_id, today), driver_id=driver_id
+        )
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1087,38 +1387,25 @@ async def update_stop_status(stop_id: str, status: str, reason: Optional[str] =
         raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of {valid_statuses}")
         
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        
-        # Security: Verify the stop belongs to the current driver's route
-        cur.execute("""
-            SELECT d.id FROM drivers d
-            JOIN routes r ON r.driver_id = d.id
-            JOIN route_stops rs ON rs.route_id = r.id
-            WHERE rs.id = %s
-        """, (stop_id,))
-        stop_owner = cur.fetchone()
-        
-        if not stop_owner or str(stop_owner['id']) != current_driver:
-             raise HTTPException(status_code=403, detail="Not authorized to update this stop")
-
-        if status.upper() == 'FAILED' and reason:
-            cur.execute("UPDATE route_stops SET status = %s, fail_reason = %s WHERE id = %s", (status.upper(), reason, stop_id))
-        else:
-            cur.execute("UPDATE route_stops SET status = %s WHERE id = %s", (status.upper(), stop_id))
-        
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Stop not found")
-            
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        await sio.emit('fleet_update', {'driver_id': current_driver, 'status': 'STOP_UPDATE'})
-        return {"message": "Status updated successfully"}
+        # Security: the update only matches stops on the current driver's routes
+        updated = await ASYNC_DB.fetchrow("update_stop_status", status.upper(), reason, stop_id, current_driver)
+    except asyncpg.DataError:
+        raise HTTPException(status_code=400, detail="Invalid stop id")
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if not updated:
+        raise HTTPException(status_code=403, detail="Not authorized to update this stop")
+    bump_route_version(updated['planned_date'], current_driver)
+    RISK_MONITOR.stop_updated(stop_id, status.upper())
+
+    BROADCASTER.queue_fleet_update(
+        {'driver_id': current_driver, 'status': 'STOP_UPDATE'}, room=date_room(updated['planned_date'])
+    )
+    return {"message": "Status updated successfully"}
+
 @app.post("/stops/{stop_id}/pod")
 async def update_stop_pod(
     stop_id: str, 
@@ -1128,7 +1415,7 @@ async def update_stop_pod(
 ):
     """Saves Proof of Delivery (Photo and/or Signature) for a stop."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         
         # Security: Verify ownership
@@ -1182,33 +1469,30 @@ async def update_driver_location(driver_id: str, lat: float, lng: float, current
         raise HTTPException(status_code=403, detail="Not authorized")
         
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE drivers SET last_known_lat = %s, last_known_lng = %s, last_seen = NOW() WHERE id = %s",
-            (lat, lng, driver_id)
-        )
-        if cur.rowcount == 0:
+        # The update returns the driver name for the event
+        driver_row = await ASYNC_DB.fetchrow("update_location", lat, lng, driver_id)
+        if not driver_row:
             raise HTTPException(status_code=404, detail="Driver not found")
-        conn.commit()
-
-        # Get driver name for the event
-        cur.execute("SELECT full_name FROM drivers WHERE id = %s", (driver_id,))
-        driver_row = cur.fetchone()
-        full_name = driver_row['full_name'] if driver_row else f"Driver {driver_id}"
-        
-        cur.close()
-        conn.close()
-
-        # Emit the update via WebSocket
-        await sio.emit('location_update', {
-            'driver_id': driver_id,
-            'full_name': full_name,
-            'lat': lat,
-            'lng': lng
-        })
+        full_name = driver_row['full_name']
+
+        # Keep the breadcrumb; a full buffer is written out right away
+        if LOCATION_HISTORY_ENABLED and LOCATION_BUFFER.add(driver_id, lat, lng) and not _flush_tasks:
+            task = asyncio.create_task(asyncio.to_thread(LOCATION_BUFFER.flush))
+            _flush_tasks.add(task)
+            task.add_done_callback(_flush_done)
+
+        # Sent to dashboards with the next location batch
+        BROADCASTER.queue_location(driver_id, full_name, lat, lng)
+        arrived_stop = RISK_MONITOR.driver_position(driver_id, lat, lng)
+        if arrived_stop:
+            try:
+                await ASYNC_DB.execute("mark_arrival", arrived_stop, driver_id)
+            except Exception as e:
+                logger.warning(f"Arrival at stop {arrived_stop} not recorded: {e}")
 
         return {"message": "Location updated"}
+    except (HTTPException, PoolTimeout):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1217,7 +1501,7 @@ async def update_driver_location(driver_id: str, lat: float, lng: float, current
 async def get_all_driver_locations():
     """Fetches the latest locations of all active drivers."""
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
         cur.execute("SELECT id, full_name, last_known_lat, last_known_lng FROM drivers WHERE is_active = TRUE")
         drivers = cur.fetchall()
@@ -1228,22 +1512,71 @@ async def get_all_driver_locations():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/analytics/summary")
-async def get_analytics_summary():
-    """Fetches aggregated performance metrics for all drivers over time."""
+@app.get("/drivers/{driver_id}/locations/history")
+async def get_driver_location_history(driver_id: str, start: datetime, end: Optional[datetime] = None, limit: int = 5000):
+    """
+    Breadcrumb trail of a driver between start and end (ISO timestamps, end defaults to now).
+    A malformed timestamp is rejected with a validation error before the database is asked.
+    """
+    if end is not None and (start.tzinfo is None) == (end.tzinfo is None) and end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
+        # Bounded by recorded_at so only the partitions of the requested days are scanned
         cur.execute("""
-            SELECT date, 
-                   SUM(total_orders_completed) as total_completed,
-                   AVG(average_service_time) as avg_service_time,
-                   AVG(efficiency_score) as avg_efficiency
-            FROM performance_metrics
-            GROUP BY date
-            ORDER BY date ASC
-            LIMIT 30
-        """)
+            SELECT recorded_at, lat, lng
+            FROM driver_locations
+            WHERE driver_id = %s
+            AND recorded_at >= %s AND recorded_at < COALESCE(%s::timestamptz, NOW())
+            ORDER BY recorded_at
+            LIMIT %s
+        """, (driver_id, start, end, min(limit, 50000)))
+        points = cur.fetchall()
+        cur.close()
+        conn.close()
+        return {"driver_id": driver_id, "points": points}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+ANALYTICS_SETTINGS = CONFIG.get("analytics", {})
+# Periods returned when no start_date is given, ending with the current one
+ANALYTICS_DEFAULT_PERIODS = {"day": 30, "week": 12, "month": 12}
+
+def analytics_window(granularity, start_date, end_date):
+    """Validated (granularity, start, end); defaults to the latest N periods up to today."""
+    if granularity not in ANALYTICS_DEFAULT_PERIODS:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(ANALYTICS_DEFAULT_PERIODS)}")
+    try:
+        end = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else datetime.now().date()
+        start = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if start is None:
+        periods = ANALYTICS_SETTINGS.get("default_periods", {}).get(granularity, ANALYTICS_DEFAULT_PERIODS[granularity])
+        if granularity == "day":
+            start = end - timedelta(days=periods - 1)
+        elif granularity == "week":
+            start = end - timedelta(weeks=periods - 1)
+        else:
+            month_index = end.year * 12 + end.month - 1 - (periods - 1)
+            start = end.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start_date must be on or before end_date")
+    return granularity, start, end
+
+@app.get("/analytics/summary")
+async def get_analytics_summary(granularity: str = "day", start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """
+    Fleet performance per day, week or month, oldest first.
+    Defaults to the latest 30 days / 12 weeks / 12 months; read from pre-computed rollups.
+    """
+    granularity, start, end = analytics_window(granularity, start_date, end_date)
+    try:
+        conn = await get_db_conn()
+        cur = conn.cursor()
+        cur.execute(FLEET_ROLLUPS_SQL, {"granularity": granularity, "start": start, "end": end})
         history = cur.fetchall()
         cur.close()
         conn.close()
@@ -1252,18 +1585,13 @@ async def get_analytics_summary():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/analytics/drivers/{driver_id}")
-async def get_driver_analytics(driver_id: str):
-    """Fetches performance metrics for a specific driver."""
+async def get_driver_analytics(driver_id: str, granularity: str = "day", start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """Performance metrics for a specific driver per day, week or month (same window rules as the summary)."""
+    granularity, start, end = analytics_window(granularity, start_date, end_date)
     try:
-        conn = get_db_conn()
+        conn = await get_db_conn()
         cur = conn.cursor()
-        cur.execute("""
-            SELECT date, total_orders_completed, average_service_time, efficiency_score
-            FROM performance_metrics
-            WHERE driver_id = %s
-            ORDER BY date ASC
-            LIMIT 30
-        """, (driver_id,))
+        cur.execute(DRIVER_ROLLUPS_SQL, {"driver_id": driver_id, "granularity": granularity, "start": start, "end": end})
         stats = cur.fetchall()
         cur.close()
         conn.close()
@@ -1273,57 +1601,45 @@ async def get_driver_analytics(driver_id: str):
 
 
 @app.get("/reports/daily")
-async def get_daily_report(date: Optional[str] = None):
-    """Generates a CSV report for deliveries on a specific date (Period)."""
+async def get_daily_report(
+    request: Request,
+    date: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    format: str = "csv"
+):
+    """
+    Streams the delivery report for one date (default today) or for start_date..end_date.
+    format: csv (default), ndjson or parquet (needs pyarrow).
+    """
+    fmt = format.lower()
+    if fmt not in REPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(REPORT_MEDIA_TYPES)}")
+    if fmt == "parquet" and not parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet export needs pyarrow installed on the server")
+
+    if start_date or end_date:
+        if not (start_date and end_date):
+            raise HTTPException(status_code=400, detail="Pass both start_date and end_date")
+    else:
+        start_date = end_date = date if date else str(datetime.now().date())
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        
-        target_date = date if date else str(datetime.now().date())
-        
-        cur.execute("""
-            SELECT 
-                d.full_name as driver,
-                o.delivery_address,
-                rs.estimated_arrival_time,
-                rs.actual_arrival_time,
-                rs.status,
-                rs.pod_photo_url,
-                rs.feedback_notes
-            FROM route_stops rs
-            JOIN orders o ON rs.order_id = o.id
-            JOIN routes r ON rs.route_id = r.id
-            JOIN drivers d ON r.driver_id = d.id
-            WHERE r.planned_date = %s
-            ORDER BY d.full_name, rs.sequence_number
-        """, (target_date,))
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Driver', 'Address', 'Estimated Arrival', 'Actual Arrival', 'Status', 'POD Photo', 'Notes'])
-        
-        for row in rows:
-            writer.writerow([
-                row['driver'],
-                row['delivery_address'],
-                row['estimated_arrival_time'],
-                row['actual_arrival_time'],
-                row['status'],
-                f"http://localhost:8000{row['pod_photo_url']}" if row['pod_photo_url'] else 'N/A',
-                row['feedback_notes']
-            ])
-
-        output.seek(0)
-        return StreamingResponse(
-            output,
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=daily_report.csv"}
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        first = datetime.strptime(start_date, "%Y-%m-%d").date()
+        last = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    max_days = CONFIG.get("reports", {}).get("max_range_days", 92)
+    if last < first or (last - first).days >= max_days:
+        raise HTTPException(status_code=400, detail=f"end_date must be on or after start_date and within {max_days} days")
+
+    # POD links point at this server as the caller reached it, unless a public URL is configured
+    pod_base_url = CONFIG.get("reports", {}).get("public_base_url") or str(request.base_url)
+    filename = f"report_{first}.{fmt}" if first == last else f"report_{first}_{last}.{fmt}"
+    return StreamingResponse(
+        stream_report(first, last, fmt, pod_base_url.rstrip("/")),
+        media_type=REPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 # Root mount MUST come after all API routes so it doesn't swallow them
 app.mount("/", StaticFiles(directory="frontend", html=True), name="frontend")
@@ -0,0 +1,69 @@
+"""
+SQL shared by the API handlers and the offline scripts (verify_query_plans).
+
+Kept free of imports and side effects so a script can read the statements
+without starting the FastAPI app, its pools and background tasks.
+"""
+
+# One page of orders, newest first; {where} may hold the (created_at, id) keyset predicate
+ORDERS_PAGE_SQL = """
+    SELECT {columns}
+    FROM orders
+    {where}
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+# Routes with their stops aggregated server-side, one row per route
+ROUTES_WITH_STOPS_SQL = """
+    SELECT r.id as route_id, r.driver_id, d.full_name, r.status, r.planned_date,
+           COALESCE(s.stops, '[]'::json) AS stops
+    FROM routes r
+    JOIN drivers d ON r.driver_id = d.id
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'stop_id', rs.id,
+                   'sequence_number', rs.sequence_number,
+                   'estimated_arrival_time', rs.estimated_arrival_time,
+                   'stop_status', rs.status,
+                   'delivery_address', o.delivery_address,
+                   'lat', o.lat,
+                   'lng', o.lng,
+                   'priority', o.priority
+               ) ORDER BY rs.sequence_number) AS stops
+        FROM route_stops rs
+        JOIN orders o ON rs.order_id = o.id
+        WHERE rs.route_id = r.id
+    ) s ON TRUE
+    WHERE {where}
+    ORDER BY r.planned_date, d.full_name
+"""
+
+# Rollup buckets in [start, end]; start is truncated to its bucket so a partial first period is included
+FLEET_ROLLUPS_SQL = """
+    SELECT period_start AS date,
+           days AS driver_days,
+           total_completed,
+           service_time_sum::float / NULLIF(service_time_days, 0) AS avg_service_time,
+           efficiency_sum / NULLIF(efficiency_days, 0) AS avg_efficiency,
+           delay_minutes AS total_delay_minutes
+    FROM fleet_performance_rollups
+    WHERE granularity = %(granularity)s
+    AND period_start >= date_trunc(%(granularity)s, %(start)s::date)::date
+    AND period_start <= %(end)s
+    ORDER BY period_start
+"""
+DRIVER_ROLLUPS_SQL = """
+    SELECT period_start AS date,
+           days,
+           total_completed AS total_orders_completed,
+           service_time_sum::float / NULLIF(service_time_days, 0) AS average_service_time,
+           efficiency_sum / NULLIF(efficiency_days, 0) AS efficiency_score,
+           delay_minutes AS total_delay_minutes
+    FROM driver_performance_rollups
+    WHERE driver_id = %(driver_id)s
+    AND granularity = %(granularity)s
+    AND period_start >= date_trunc(%(granularity)s, %(start)s::date)::date
+    AND period_start <= %(end)s
+    ORDER BY period_start
+"""
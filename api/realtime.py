@@ -0,0 +1,140 @@
+"""
+Socket.io fan-out with audience rooms and per-tick coalescing.
+
+Clients join rooms on connect (socket.io auth payload):
+    dashboards   {"role": "dashboard", "date": "YYYY-MM-DD", "binary": true}
+                 -> "dashboard", "date:<date>" and a location room for their format
+    driver app   {"role": "driver", "token": "<JWT>"} -> "driver:<driver_id>"
+Clients that send no auth are treated as dashboards for today.
+Dashboards move to another date with a "subscribe" event: {"date": "YYYY-MM-DD"}.
+
+Location pings and fleet updates are queued and sent once per tick. Each
+driver's latest position wins, so a dashboard gets one "location_batch" frame
+per tick however many drivers reported. The frame is encoded once per format,
+not once per client. Alerts are sent immediately.
+
+Binary location frames (little-endian):
+    header  B version (1), B reserved, H count, I server time (epoch seconds)
+    record  16s driver UUID bytes, f latitude, f longitude
+float32 keeps positions to within about a metre at 24 bytes per driver,
+against roughly 120 bytes for the JSON object.
+"""
+import time
+import uuid
+import struct
+import asyncio
+from datetime import datetime
+from api.logger_config import logger
+from api.config_loader import CONFIG
+
+REALTIME_SETTINGS = CONFIG.get("realtime", {})
+
+ROOM_DASHBOARD = "dashboard"
+LOCATION_ROOMS = {"json": "locations:json", "binary": "locations:binary"}
+
+LOCATION_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BBHI")
+_RECORD = struct.Struct("<16sff")
+
+
+def date_room(planned_date):
+    return f"date:{planned_date}"
+
+
+def driver_room(driver_id):
+    return f"driver:{driver_id}"
+
+
+def encode_location_batch(updates, server_time=None):
+    """Packs [{driver_id, lat, lng, ...}] into the binary location frame."""
+    server_time = int(server_time or time.time())
+    parts = [_HEADER.pack(LOCATION_FORMAT_VERSION, 0, len(updates), server_time)]
+    for update in updates:
+        parts.append(_RECORD.pack(uuid.UUID(str(update["driver_id"])).bytes, update["lat"], update["lng"]))
+    return b"".join(parts)
+
+
+def decode_location_batch(data):
+    """Inverse of encode_location_batch. Returns (server_time, [{driver_id, lat, lng}])."""
+    version, _, count, server_time = _HEADER.unpack_from(data, 0)
+    if version != LOCATION_FORMAT_VERSION:
+        raise ValueError(f"Unsupported location frame version {version}")
+    updates = []
+    for i in range(count):
+        raw_id, lat, lng = _RECORD.unpack_from(data, _HEADER.size + i * _RECORD.size)
+        updates.append({"driver_id": str(uuid.UUID(bytes=raw_id)), "lat": lat, "lng": lng})
+    return server_time, updates
+
+
+class Broadcaster:
+    """Owns room membership and the coalescing queues for one socket.io server."""
+
+    def __init__(self, sio, verify_token, tick_ms=None):
+        self.sio = sio
+        self.verify_token = verify_token
+        self.tick = (tick_ms or REALTIME_SETTINGS.get("tick_ms", 1000)) / 1000
+        self._locations = {}
+        self._fleet_updates = {}
+        self.stats = {"location_pings": 0, "location_frames": 0, "fleet_updates": 0, "fleet_frames": 0, "alerts": 0}
+
+    def register(self):
+        self.sio.on("connect", self._on_connect)
+        self.sio.on("subscribe", self._on_subscribe)
+
+    async def _on_connect(self, sid, environ, auth=None):
+        auth = auth if isinstance(auth, dict) else {}
+        if auth.get("role") == "driver":
+            driver_id = self.verify_token(auth.get("token"))
+            if driver_id is None:
+                return False  # rejects the connection
+            await self.sio.enter_room(sid, driver_room(driver_id))
+            return
+        await self.sio.enter_room(sid, ROOM_DASHBOARD)
+        await self.sio.enter_room(sid, LOCATION_ROOMS["binary" if auth.get("binary") else "json"])
+        await self.sio.enter_room(sid, date_room(auth.get("date") or datetime.now().date()))
+
+    async def _on_subscribe(self, sid, data):
+        planned_date = (data or {}).get("date")
+        if not planned_date:
+            return
+        for room in self.sio.rooms(sid):
+            if room.startswith("date:"):
+                await self.sio.leave_room(sid, room)
+        await self.sio.enter_room(sid, date_room(planned_date))
+
+    def queue_location(self, driver_id, full_name, lat, lng):
+        """Queues a position; only the latest per driver is sent at the next tick."""
+        self._locations[str(driver_id)] = {"driver_id": str(driver_id), "full_name": full_name, "lat": lat, "lng": lng}
+        self.stats["location_pings"] += 1
+
+    def queue_fleet_update(self, payload, room=ROOM_DASHBOARD):
+        """Queues a fleet_update for room; updates queued in one tick are sent as one event."""
+        self._fleet_updates.setdefault(room, []).append(payload)
+        self.stats["fleet_updates"] += 1
+
+    async def alert(self, payload, driver_id=None):
+        await self.sio.emit("alert", payload, room=ROOM_DASHBOARD)
+        if driver_id is not None:
+            await self.sio.emit("alert", payload, room=driver_room(driver_id))
+        self.stats["alerts"] += 1
+
+    async def flush(self):
+        locations, self._locations = list(self._locations.values()), {}
+        fleet_updates, self._fleet_updates = self._fleet_updates, {}
+
+        if locations:
+            await self.sio.emit("location_batch", locations, room=LOCATION_ROOMS["json"])
+            await self.sio.emit("location_batch", encode_location_batch(locations), room=LOCATION_ROOMS["binary"])
+            self.stats["location_frames"] += 1
+        for room, updates in fleet_updates.items():
+            # Listeners refresh on any fleet_update; the latest payload plus a count is enough
+            await self.sio.emit("fleet_update", {**updates[-1], "count": len(updates)}, room=room)
+            self.stats["fleet_frames"] += 1
+
+    async def run(self):
+        while True:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Realtime flush error: {e}")
+            await asyncio.sleep(self.tick)
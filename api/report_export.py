@@ -0,0 +1,181 @@
+"""
+Streaming delivery report export.
+
+Rows are read from a named (server-side) cursor batch_rows at a time and each
+batch is encoded and sent before the next is fetched, so a month-long export
+uses the same memory as a single day. The connection comes straight from the
+pool rather than the request's tracked connections, because the response body
+is still being read after the handler has returned.
+
+Formats:
+    csv      one header row, then a row per stop
+    ndjson   one JSON object per stop
+    parquet  one row group per batch (needs pyarrow, an optional dependency)
+"""
+import io
+import csv
+import json
+from api.db_pool import DB_POOL
+from api.config_loader import CONFIG
+from api.logger_config import logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for format=parquet
+    pa = None
+    pq = None
+
+REPORT_SETTINGS = CONFIG.get("reports", {})
+
+REPORT_SQL = """
+    SELECT
+        r.planned_date,
+        d.full_name as driver,
+        rs.sequence_number,
+        o.delivery_address,
+        rs.estimated_arrival_time,
+        rs.actual_arrival_time,
+        rs.status::text AS status,
+        rs.pod_photo_url,
+        rs.feedback_notes
+    FROM route_stops rs
+    JOIN orders o ON rs.order_id = o.id
+    JOIN routes r ON rs.route_id = r.id
+    JOIN drivers d ON r.driver_id = d.id
+    WHERE r.planned_date BETWEEN %s AND %s
+    ORDER BY r.planned_date, d.full_name, rs.sequence_number
+"""
+
+# (CSV header, row key)
+CSV_COLUMNS = [
+    ('Date', 'planned_date'),
+    ('Driver', 'driver'),
+    ('Address', 'delivery_address'),
+    ('Estimated Arrival', 'estimated_arrival_time'),
+    ('Actual Arrival', 'actual_arrival_time'),
+    ('Status', 'status'),
+    ('POD Photo', 'pod_photo_url'),
+    ('Notes', 'feedback_notes'),
+]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def parquet_available():
+    return pq is not None
+
+
+def _parquet_schema():
+    return pa.schema([
+        ("planned_date", pa.date32()),
+        ("driver", pa.string()),
+        ("sequence_number", pa.int32()),
+        ("delivery_address", pa.string()),
+        ("estimated_arrival_time", pa.timestamp("us", tz="UTC")),
+        ("actual_arrival_time", pa.timestamp("us", tz="UTC")),
+        ("status", pa.string()),
+        ("pod_photo_url", pa.string()),
+        ("feedback_notes", pa.string()),
+    ])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that keeps what the Parquet writer produced until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _encode_csv(batches, pod_base_url):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([header for header, _ in CSV_COLUMNS])
+    for batch in batches:
+        for row in batch:
+            values = [row[key] for _, key in CSV_COLUMNS]
+            values[-2] = f"{pod_base_url}{row['pod_photo_url']}" if row['pod_photo_url'] else 'N/A'
+            writer.writerow(values)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue()
+
+
+def _json_value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def _encode_ndjson(batches, pod_base_url):
+    for batch in batches:
+        lines = []
+        for row in batch:
+            row = dict(row)
+            if row['pod_photo_url']:
+                row['pod_photo_url'] = f"{pod_base_url}{row['pod_photo_url']}"
+            lines.append(json.dumps(row, default=_json_value))
+        yield "\n".join(lines) + "\n"
+
+
+def _encode_parquet(batches, pod_base_url):
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for batch in batches:
+            columns = {name: [row[name] for row in batch] for name in schema.names}
+            columns['pod_photo_url'] = [f"{pod_base_url}{url}" if url else None for url in columns['pod_photo_url']]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    # The footer is written on close
+    yield sink.drain()
+
+
+ENCODERS = {"csv": _encode_csv, "ndjson": _encode_ndjson, "parquet": _encode_parquet}
+
+
+def _fetch_batches(cur, batch_rows, counter):
+    while True:
+        batch = cur.fetchmany(batch_rows)
+        if not batch:
+            return
+        counter["rows"] += len(batch)
+        yield batch
+
+
+def stream_report(start_date, end_date, fmt, pod_base_url, batch_rows=None):
+    """Yields the report for planned dates start_date..end_date (inclusive) encoded as fmt."""
+    batch_rows = batch_rows or REPORT_SETTINGS.get("batch_rows", 2000)
+    with DB_POOL.connection() as conn:
+        cur = conn.cursor(name="report_export")
+        cur.itersize = batch_rows
+        cur.execute(REPORT_SQL, (start_date, end_date))
+        counter = {"rows": 0}
+        try:
+            yield from ENCODERS[fmt](_fetch_batches(cur, batch_rows, counter), pod_base_url)
+        finally:
+            cur.close()
+        logger.info(f"Report {start_date}..{end_date} exported as {fmt} ({counter['rows']} rows).")
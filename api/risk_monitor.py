@@ -0,0 +1,205 @@
+"""
+Event-driven late-delivery risk monitor.
+
+Today's open stops are loaded once, when a plan is saved or changed, into a
+min-heap keyed by the moment each stop becomes at risk (its ETA minus
+lead_minutes). The monitor sleeps until the earliest deadline and alerts for
+every stop still open when its deadline passes, once per stop per day.
+
+Stop status changes take a stop out of (or back into) the schedule. Location
+pings give an earlier warning: when a driver's straight-line distance to the
+next stop, at avg_speed_kmh with a detour factor, would put them past its
+ETA, that stop is alerted right away. A ping within arrival_radius_m of the
+next stop marks the driver as arrived there, once per stop; the caller stamps
+the stop's actual_arrival_time, which the service-time metric starts from.
+
+Heap entries are never removed in place. A rescheduled stop gets a new
+generation number and older entries for it are skipped when popped.
+"""
+import math
+import time
+import heapq
+import asyncio
+from datetime import datetime, timedelta
+from collections import defaultdict
+from api.logger_config import logger
+from api.config_loader import CONFIG
+from api.async_db import ASYNC_DB
+
+RISK_SETTINGS = CONFIG.get("risk_monitor", {})
+
+OPEN_STOPS_SQL = """
+    SELECT rs.id, rs.sequence_number, rs.estimated_arrival_time,
+           o.delivery_address, o.lat, o.lng, r.driver_id, d.full_name
+    FROM route_stops rs
+    JOIN orders o ON rs.order_id = o.id
+    JOIN routes r ON rs.route_id = r.id
+    JOIN drivers d ON r.driver_id = d.id
+    WHERE rs.status = 'ASSIGNED'
+    AND rs.estimated_arrival_time IS NOT NULL
+    AND r.planned_date = CURRENT_DATE
+"""
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+class RiskMonitor:
+    """Schedules one LATE_RISK alert per open stop and fires it at its deadline."""
+
+    def __init__(self, broadcaster, lead_minutes=None):
+        self.broadcaster = broadcaster
+        self.lead = (lead_minutes or RISK_SETTINGS.get("lead_minutes", 15)) * 60
+        self._heap = []
+        self._stops = {}
+        self._by_driver = defaultdict(list)
+        self._fired = set()
+        self._wake = asyncio.Event()
+        self._loaded_for = None
+        self._pending_alerts = set()
+        self.stats = {"loads": 0, "alerts": 0, "projected_alerts": 0}
+
+    async def reload(self):
+        """Rebuilds the schedule from today's plan (startup, plan saves, route edits, midnight)."""
+        async with ASYNC_DB.acquire() as conn:
+            rows = await conn.fetch(OPEN_STOPS_SQL)
+
+        today = datetime.now().date()
+        if self._loaded_for != today:
+            self._fired.clear()
+        self._heap = []
+        self._stops = {}
+        self._by_driver = defaultdict(list)
+        for row in rows:
+            stop = {
+                "stop_id": str(row["id"]),
+                "driver_id": str(row["driver_id"]),
+                "full_name": row["full_name"],
+                "address": row["delivery_address"],
+                "lat": row["lat"],
+                "lng": row["lng"],
+                "sequence": row["sequence_number"],
+                "eta": row["estimated_arrival_time"].timestamp(),
+                "open": True,
+                "generation": 0,
+            }
+            self._stops[stop["stop_id"]] = stop
+            self._by_driver[stop["driver_id"]].append(stop)
+            self._schedule(stop)
+        for stops in self._by_driver.values():
+            stops.sort(key=lambda s: s["sequence"])
+
+        self._loaded_for = today
+        self.stats["loads"] += 1
+        logger.info(f"Risk monitor tracking {len(self._stops)} open stops.")
+        self._wake.set()
+
+    async def refresh(self):
+        """reload() for request handlers: a failure is logged, never raised."""
+        try:
+            await self.reload()
+        except Exception as e:
+            logger.error(f"Risk monitor reload failed: {e}")
+
+    def _schedule(self, stop):
+        if stop["stop_id"] in self._fired:
+            return
+        stop["generation"] += 1
+        heapq.heappush(self._heap, (stop["eta"] - self.lead, stop["stop_id"], stop["generation"]))
+        if self._heap[0][1] == stop["stop_id"]:
+            # New earliest deadline; let the sleeping loop recompute its timeout
+            self._wake.set()
+
+    def stop_updated(self, stop_id, status):
+        """A finished stop needs no alert; one set back to ASSIGNED is watched again."""
+        stop = self._stops.get(str(stop_id))
+        if stop is None:
+            return
+        stop["open"] = status == "ASSIGNED"
+        if stop["open"]:
+            self._schedule(stop)
+
+    def driver_position(self, driver_id, lat, lng):
+        """
+        Alerts early when the driver cannot reach their next open stop by its ETA.
+        Returns the stop id when this ping is the driver's arrival at that stop, else None.
+        """
+        stop = next((s for s in self._by_driver.get(str(driver_id), ()) if s["open"]), None)
+        if stop is None:
+            return None
+        straight_km = haversine_km(lat, lng, stop["lat"], stop["lng"])
+        if straight_km * 1000 <= RISK_SETTINGS.get("arrival_radius_m", 75):
+            if stop.get("arrived"):
+                return None
+            stop["arrived"] = True
+            return stop["stop_id"]
+        if stop["stop_id"] in self._fired:
+            return None
+        distance_km = straight_km * RISK_SETTINGS.get("detour_factor", 1.3)
+        projected = time.time() + distance_km / RISK_SETTINGS.get("avg_speed_kmh", 25) * 3600
+        if projected > stop["eta"]:
+            self.stats["projected_alerts"] += 1
+            task = asyncio.create_task(self._fire(stop, projected))
+            self._pending_alerts.add(task)
+            task.add_done_callback(self._pending_alerts.discard)
+        return None
+
+    async def _fire(self, stop, projected=None):
+        if stop["stop_id"] in self._fired:
+            return
+        self._fired.add(stop["stop_id"])
+        self.stats["alerts"] += 1
+        payload = {
+            'type': 'LATE_RISK',
+            'message': f"Late Risk: Delivery to {stop['address']} for {stop['full_name']}",
+            'driver_id': stop['driver_id'],
+            'stop_id': stop['stop_id'],
+            'eta': datetime.fromtimestamp(stop['eta']).isoformat(),
+        }
+        if projected is not None:
+            payload['projected_arrival'] = datetime.fromtimestamp(projected).isoformat()
+        await self.broadcaster.alert(payload, driver_id=stop['driver_id'])
+
+    async def _fire_due(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, stop_id, generation = heapq.heappop(self._heap)
+            stop = self._stops.get(stop_id)
+            if stop is None or not stop["open"] or stop["generation"] != generation:
+                continue
+            await self._fire(stop)
+
+    async def run(self):
+        while True:
+            try:
+                if self._loaded_for != datetime.now().date():
+                    await self.reload()
+                self._wake.clear()
+                await self._fire_due()
+
+                now = datetime.now()
+                next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+                timeout = (next_midnight - now).total_seconds()
+                if self._heap:
+                    timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                logger.error(f"Risk Monitor Error: {e}")
+                await asyncio.sleep(RISK_SETTINGS.get("retry_seconds", 30))
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "open_stops": sum(1 for s in self._stops.values() if s["open"]),
+            "alerted": len(self._fired),
+            "next_deadline": (
+                datetime.fromtimestamp(self._heap[0][0]).isoformat() if self._heap else None
+            ),
+        }
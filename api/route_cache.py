@@ -0,0 +1,110 @@
+"""
+Versioned in-memory cache for the polled route endpoints.
+
+Every write that changes what /routes, /routes/today or /drivers/{id}/route
+return bumps a version counter: per planned date, per driver, or globally
+for edits that can touch any route (order or driver changes). A cached
+response is reused while the versions it was built under are unchanged, and
+is served with an ETag of its body. A poll whose If-None-Match matches gets
+a 304 without touching the database.
+
+Writes made outside this process (scripts, another worker) are not seen, so
+entries also expire after max_age_seconds.
+"""
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from api.config_loader import CONFIG
+
+ROUTE_CACHE_SETTINGS = CONFIG.get("route_reads", {})
+
+_versions = {}
+_global_version = 0
+_entries = OrderedDict()
+_stats = {"hits": 0, "not_modified": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+def _scopes(planned_date, driver_id):
+    scopes = [f"date:{planned_date}"]
+    if driver_id is not None:
+        scopes.append(f"driver:{driver_id}")
+    return scopes
+
+
+def route_version(planned_date, driver_id=None):
+    """Current version of a date's routes, or of one driver's route on that date."""
+    with _lock:
+        return (_global_version,) + tuple(_versions.get(s, 0) for s in _scopes(planned_date, driver_id))
+
+
+def bump_route_version(planned_date=None, driver_id=None):
+    """
+    Invalidates cached route responses after a write. With no planned_date every
+    cached response is invalidated; a date alone covers that date's drivers too.
+    """
+    global _global_version
+    with _lock:
+        if planned_date is None:
+            _global_version += 1
+            return
+        for scope in _scopes(str(planned_date), driver_id):
+            _versions[scope] = _versions.get(scope, 0) + 1
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
+
+async def cached_route_response(request, key, planned_date, build, driver_id=None):
+    """
+    Serves key from the cache when its versions are unchanged, otherwise awaits
+    build() for the payload and caches it. Answers 304 when the client already
+    holds the current body.
+    """
+    version = route_version(planned_date, driver_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry and (entry["version"] != version
+                      or now - entry["built_at"] > ROUTE_CACHE_SETTINGS.get("max_age_seconds", 300)):
+            entry = None
+        if entry:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+
+    if entry is None:
+        # The version is read before building, so a write landing mid-build leaves this entry stale
+        body = json.dumps(jsonable_encoder(await build())).encode()
+        entry = {
+            "version": version,
+            "built_at": now,
+            "body": body,
+            "etag": f'W/"{hashlib.sha1(body).hexdigest()[:20]}"',
+        }
+        with _lock:
+            _stats["misses"] += 1
+            _entries[key] = entry
+            _entries.move_to_end(key)
+            while len(_entries) > ROUTE_CACHE_SETTINGS.get("max_entries", 1000):
+                _entries.popitem(last=False)
+
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        with _lock:
+            _stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+def route_cache_stats():
+    """Hit, 304 and miss counts since start, and the number of cached responses."""
+    with _lock:
+        return {**_stats, "entries": len(_entries)}
@@ -62,6 +62,7 @@ CREATE TABLE routes (
     start_time TIMESTAMP WITH TIME ZONE,
     end_time TIMESTAMP WITH TIME ZONE,
     status VARCHAR(20) DEFAULT 'PLANNED', -- PLANNED, IN_PROGRESS, COMPLETED
+    geometry JSONB, -- {"key": stop coordinate digest, "legs": [encoded polyline per leg]}
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -75,6 +76,7 @@ CREATE TABLE route_stops (
     actual_departure_time TIMESTAMP WITH TIME ZONE,
     status order_status DEFAULT 'ASSIGNED',
     feedback_notes TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- bumped by trigger, drives the metrics pipeline
     UNIQUE(route_id, sequence_number)
 );
 
@@ -96,7 +98,8 @@ CREATE TABLE performance_metrics (
     total_orders_completed INTEGER,
     average_service_time INTEGER, -- minutes spent at stop
     total_delay_minutes INTEGER,
-    efficiency_score FLOAT -- custom metric for the data model
+    efficiency_score FLOAT, -- custom metric for the data model
+    UNIQUE(driver_id, date)
 );
 
 -- Triggers for updated_at
@@ -141,3 +144,86 @@ CREATE TABLE IF NOT EXISTS warehouse (
     is_default BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Road geometry per leg, fetched once from OSRM and shared across routes.
+-- A leg OSRM failed on has no polyline and is not asked for again before retry_after.
+CREATE TABLE IF NOT EXISTS route_leg_geometries (
+    from_lat FLOAT NOT NULL,
+    from_lng FLOAT NOT NULL,
+    to_lat FLOAT NOT NULL,
+    to_lng FLOAT NOT NULL,
+    polyline TEXT,
+    distance_m FLOAT,
+    duration_s FLOAT,
+    retry_after TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (from_lat, from_lng, to_lat, to_lng)
+);
+
+-- Change tracking for incremental pipelines (performance_metrics)
+CREATE TRIGGER route_stops_set_updated_at
+BEFORE UPDATE ON route_stops
+FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_route_stops_updated_at ON route_stops(updated_at);
+
+CREATE TABLE IF NOT EXISTS pipeline_watermarks (
+    name VARCHAR(50) PRIMARY KEY,
+    high_water TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- GPS breadcrumbs, one partition per UTC day (driver_locations_YYYYMMDD).
+-- Partitions are created ahead and dropped after retention by scripts/location_history.py
+CREATE TABLE IF NOT EXISTS driver_locations (
+    driver_id UUID NOT NULL,
+    recorded_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    lat FLOAT NOT NULL,
+    lng FLOAT NOT NULL
+) PARTITION BY RANGE (recorded_at);
+
+CREATE INDEX IF NOT EXISTS idx_driver_locations_driver_time ON driver_locations(driver_id, recorded_at);
+
+-- Secondary indexes for the hot API and optimizer queries (scripts/migrate_indexes.py adds them to
+-- existing databases; scripts/verify_query_plans.py checks the planner uses them)
+CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_pending_created ON orders(created_at DESC) WHERE status = 'PENDING';
+CREATE INDEX IF NOT EXISTS idx_routes_planned_date_driver ON routes(planned_date, driver_id);
+CREATE INDEX IF NOT EXISTS idx_route_stops_order ON route_stops(order_id);
+CREATE INDEX IF NOT EXISTS idx_route_stops_open ON route_stops(route_id, sequence_number) WHERE status = 'ASSIGNED';
+CREATE INDEX IF NOT EXISTS idx_periods_dates ON periods(start_date, end_date);
+CREATE INDEX IF NOT EXISTS idx_performance_metrics_date ON performance_metrics(date);
+CREATE INDEX IF NOT EXISTS idx_drivers_assigned_vehicle ON drivers(assigned_vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_driver_period_assignments_driver ON driver_period_assignments(driver_id);
+
+-- Analytics rollups: sums and counts of performance_metrics per day / week / month bucket
+-- (period_start is the bucket's first day), kept current by scripts/performance_metrics.py
+CREATE TABLE IF NOT EXISTS driver_performance_rollups (
+    driver_id UUID NOT NULL REFERENCES drivers(id) ON DELETE CASCADE,
+    granularity VARCHAR(5) NOT NULL CHECK (granularity IN ('day', 'week', 'month')),
+    period_start DATE NOT NULL,
+    days INTEGER NOT NULL,
+    total_completed INTEGER,
+    service_time_sum BIGINT,
+    service_time_days INTEGER NOT NULL,
+    delay_minutes BIGINT,
+    efficiency_sum FLOAT,
+    efficiency_days INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (driver_id, granularity, period_start)
+);
+
+CREATE TABLE IF NOT EXISTS fleet_performance_rollups (
+    granularity VARCHAR(5) NOT NULL CHECK (granularity IN ('day', 'week', 'month')),
+    period_start DATE NOT NULL,
+    days INTEGER NOT NULL,
+    total_completed INTEGER,
+    service_time_sum BIGINT,
+    service_time_days INTEGER NOT NULL,
+    delay_minutes BIGINT,
+    efficiency_sum FLOAT,
+    efficiency_days INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (granularity, period_start)
+);
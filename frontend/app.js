@@ -20,7 +20,8 @@ async function init() {
 
 function initSocket() {
     socket = io(API_BASE, {
-        path: '/ws/socket.io'
+        path: '/ws/socket.io',
+        auth: { role: 'dashboard' }
     });
 
     socket.on('connect', () => {
@@ -28,8 +29,9 @@ function initSocket() {
         updateActivityFeed('SYSTEM', 'Real-time tracking activated.');
     });
 
-    socket.on('location_update', (data) => {
-        handleLocationUpdate(data);
+    // One frame per server tick with the latest position of every driver that moved
+    socket.on('location_batch', (updates) => {
+        updates.forEach(handleLocationUpdate);
     });
 
     socket.on('disconnect', () => {
@@ -121,10 +123,22 @@ async function loadInitialData(isFirstLoad = false) {
     }
 }
 
+// GET /orders is paged; follow X-Next-Cursor until the last page
+async function fetchOrderPages(query) {
+    const orders = [];
+    let cursor = null;
+    do {
+        const res = await fetch(`${API_BASE}/orders?${query}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`);
+        if (!res.ok) throw new Error(`Orders fetch failed: ${res.status}`);
+        orders.push(...await res.json());
+        cursor = res.headers.get('X-Next-Cursor');
+    } while (cursor);
+    return orders;
+}
+
 async function loadPendingOrders() {
     try {
-        const res = await fetch(`${API_BASE}/orders?status=PENDING`);
-        const orders = await res.json();
+        const orders = await fetchOrderPages('status=PENDING');
 
         // Clear old pending markers
         pendingMarkers.forEach(m => map.removeLayer(m));
@@ -163,6 +177,37 @@ async function loadPendingOrders() {
     }
 }
 
+// Decodes an OSRM/Google encoded polyline (precision 5) into [lat, lng] pairs
+function decodePolyline(encoded) {
+    const points = [];
+    let index = 0, lat = 0, lng = 0;
+    while (index < encoded.length) {
+        for (const axis of [0, 1]) {
+            let shift = 0, result = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            const delta = (result & 1) ? ~(result >> 1) : (result >> 1);
+            if (axis === 0) lat += delta; else lng += delta;
+        }
+        points.push([lat / 1e5, lng / 1e5]);
+    }
+    return points;
+}
+
+// Road path for a route from its cached leg geometries; legs without one are drawn straight
+function routePath(route, stopCoords) {
+    if (!route.geometry || route.geometry.length !== stopCoords.length - 1) return null;
+    const path = [stopCoords[0]];
+    route.geometry.forEach((leg, i) => {
+        if (leg) path.push(...decodePolyline(leg));
+        else path.push(stopCoords[i + 1]);
+    });
+    return path;
+}
+
 async function visualizeRoutes() {
     // Clear existing stop markers
     markers.forEach(m => map.removeLayer(m));
@@ -219,11 +264,12 @@ async function visualizeRoutes() {
                     markers.push(marker);
                 });
 
-                const poly = L.polyline(routeCoords, {
+                const roadPath = routePath(route, routeCoords);
+                const poly = L.polyline(roadPath || routeCoords, {
                     color: colors[i % colors.length],
                     weight: 3,
-                    opacity: 0.5,
-                    dashArray: '5, 10'
+                    opacity: roadPath ? 0.8 : 0.5,
+                    dashArray: roadPath ? null : '5, 10'
                 }).addTo(map);
                 polylines.push(poly);
             }
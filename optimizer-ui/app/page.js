@@ -35,6 +35,36 @@ const Map = dynamic(() => import('@/components/Map'), {
 
 const API_BASE = process.env.NEXT_PUBLIC_API_BASE || 'http://localhost:8000';
 
+// Binary location frame (see api/realtime.py): 8-byte header, then 24 bytes per driver
+function decodeLocationBatch(buffer) {
+  const view = new DataView(buffer);
+  const count = view.getUint16(2, true);
+  const updates = [];
+  for (let i = 0; i < count; i++) {
+    const offset = 8 + i * 24;
+    const hex = Array.from(new Uint8Array(buffer, offset, 16), b => b.toString(16).padStart(2, '0')).join('');
+    updates.push({
+      driver_id: `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`,
+      lat: view.getFloat32(offset + 16, true),
+      lng: view.getFloat32(offset + 20, true)
+    });
+  }
+  return updates;
+}
+
+// GET /orders is paged; follow X-Next-Cursor until the last page
+async function fetchOrderPages(query) {
+  const orders = [];
+  let cursor = null;
+  do {
+    const res = await fetch(`${API_BASE}/orders?${query}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`);
+    if (!res.ok) throw new Error(`Orders fetch failed: ${res.status}`);
+    orders.push(...await res.json());
+    cursor = res.headers.get('X-Next-Cursor');
+  } while (cursor);
+  return orders;
+}
+
 export default function Dashboard() {
   const [activeView, setActiveView] = useState('dashboard');
   const [routes, setRoutes] = useState([]);
@@ -79,6 +109,7 @@ export default function Dashboard() {
   const [showDriverEditor, setShowDriverEditor] = useState(false);
   const [editingDriver, setEditingDriver] = useState(null);
   const socketRef = useRef(null);
+  const driverNamesRef = useRef({});
 
   useEffect(() => {
     const handleMouseMove = (e) => {
@@ -180,13 +211,12 @@ export default function Dashboard() {
         setPeriodAssignments([]);
       }
 
-      const ordersRes = await fetch(`${API_BASE}/orders?status=PENDING`);
-      if (ordersRes.ok) {
-        const ordersData = await ordersRes.json();
+      try {
+        const ordersData = await fetchOrderPages('status=PENDING');
         console.log('📦 Pending orders fetched:', ordersData.length, 'orders', ordersData);
         setPendingOrders(ordersData);
-      } else {
-        console.warn('⚠️ Orders fetch failed:', ordersRes.status);
+      } catch (err) {
+        console.warn('⚠️', err.message);
       }
 
       const fleetRes = await fetch(`${API_BASE}/fleet`);
@@ -204,6 +234,7 @@ export default function Dashboard() {
 
         setDrivers(uniqueDrivers);
         setVehicles(uniqueVehicles);
+        driverNamesRef.current = Object.fromEntries(uniqueDrivers.map(d => [d.id, d.full_name]));
 
         const locs = {};
         (data.drivers || []).forEach(d => {
@@ -241,7 +272,8 @@ export default function Dashboard() {
     const interval = setInterval(fetchData, 60000);
 
     const socket = io(API_BASE, {
-      path: '/ws/socket.io'
+      path: '/ws/socket.io',
+      auth: { role: 'dashboard', binary: true, date: selectedDate }
     });
     socketRef.current = socket;
 
@@ -249,11 +281,16 @@ export default function Dashboard() {
       addActivity('SYSTEM', 'Real-time tracking activated.');
     });
 
-    socket.on('location_update', (data) => {
-      setDriverLocations(prev => ({
-        ...prev,
-        [data.driver_id]: data
-      }));
+    // One binary frame per server tick with the latest position of every driver that moved
+    socket.on('location_batch', (data) => {
+      const updates = data instanceof ArrayBuffer ? decodeLocationBatch(data) : data;
+      setDriverLocations(prev => {
+        const next = { ...prev };
+        updates.forEach(u => {
+          next[u.driver_id] = { ...u, full_name: u.full_name || driverNamesRef.current[u.driver_id] || prev[u.driver_id]?.full_name };
+        });
+        return next;
+      });
     });
 
     socket.on('alert', (data) => {
@@ -268,7 +305,7 @@ export default function Dashboard() {
       clearInterval(interval);
       socket.disconnect();
     };
-  }, [fetchData, addActivity]);
+  }, [fetchData, addActivity, selectedDate]);
 
   const handleOptimize = async () => {
     setIsOptimizing(true);
@@ -5,6 +5,37 @@ import { MapContainer, TileLayer, CircleMarker, Polyline, Tooltip, ZoomControl,
 import { Home } from 'lucide-react';
 import L from 'leaflet';
 
+// Decodes an OSRM/Google encoded polyline (precision 5) into [lat, lng] pairs
+const decodePolyline = (encoded) => {
+    const points = [];
+    let index = 0, lat = 0, lng = 0;
+    while (index < encoded.length) {
+        for (const axis of [0, 1]) {
+            let shift = 0, result = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            const delta = (result & 1) ? ~(result >> 1) : (result >> 1);
+            if (axis === 0) lat += delta; else lng += delta;
+        }
+        points.push([lat / 1e5, lng / 1e5]);
+    }
+    return points;
+};
+
+// Road path for a route from its cached leg geometries; legs without one are drawn straight
+const routePath = (route, stopCoords) => {
+    if (!route.geometry || route.geometry.length !== stopCoords.length - 1) return null;
+    const path = [stopCoords[0]];
+    route.geometry.forEach((leg, i) => {
+        if (leg) path.push(...decodePolyline(leg));
+        else path.push(stopCoords[i + 1]);
+    });
+    return path;
+};
+
 // Fix Leaflet default icon issue
 const fixLeafletIcons = () => {
     delete L.Icon.Default.prototype._getIconUrl;
@@ -109,7 +140,9 @@ export default function Map({ routes = [], pendingOrders = [], driverLocations =
 
                 {/* Routes & Stops */}
                 {routes.map((route, idx) => {
-                    const routeCoords = [depotCenter, ...route.stops.map(s => [s.lat, s.lng])];
+                    const stopCoords = [depotCenter, ...route.stops.map(s => [s.lat, s.lng])];
+                    const roadPath = routePath(route, stopCoords);
+                    const routeCoords = roadPath || stopCoords;
                     const routeColor = colors[idx % colors.length];
 
                     return (
@@ -119,8 +152,8 @@ export default function Map({ routes = [], pendingOrders = [], driverLocations =
                                 pathOptions={{
                                     color: routeColor,
                                     weight: 3,
-                                    opacity: 0.5,
-                                    dashArray: '5, 10'
+                                    opacity: roadPath ? 0.8 : 0.5,
+                                    dashArray: roadPath ? null : '5, 10'
                                 }}
                             />
                             {route.stops.map(stop => (
@@ -0,0 +1,130 @@
+"""
+Geohash-cell travel-time cache.
+
+Every OSRM table the matrix cache fetches is folded into a running mean of
+travel minutes between geohash cells (precision 6 is roughly 1.2 x 0.6 km).
+New customer coordinates rarely repeat, but their cells do, so approximate
+matrices for previews and what-if runs can be served from this table without
+touching OSRM. Cells are kept as integer geohashes so recording and lookup are
+vectorized; a sorted snapshot of the table is rebuilt lazily after writes.
+
+A pair of cells is packed into one int64 key, 32 bits per cell, which limits
+geohash_precision to 6 (30 bits); a higher setting is rejected at import.
+"""
+import threading
+import numpy as np
+from api.config_loader import CONFIG
+
+CELL_SETTINGS = CONFIG.get("cell_cache", {})
+# 5 bits per character; pair_keys has 32 bits per cell
+MAX_GEOHASH_PRECISION = 6
+
+
+def check_precision(precision):
+    if not 1 <= precision <= MAX_GEOHASH_PRECISION:
+        raise ValueError(f"geohash_precision must be between 1 and {MAX_GEOHASH_PRECISION}, got {precision}")
+    return precision
+
+
+GEOHASH_PRECISION = check_precision(CELL_SETTINGS.get("geohash_precision", 6))
+
+
+def geohash_cells(lat, lng, precision=None):
+    """
+    Integer geohash of each coordinate (the base32 string's 5 * precision bits).
+    Works element-wise on NumPy arrays.
+    """
+    precision = GEOHASH_PRECISION if precision is None else check_precision(precision)
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    lat_lo, lat_hi = np.full(lat.shape, -90.0), np.full(lat.shape, 90.0)
+    lng_lo, lng_hi = np.full(lng.shape, -180.0), np.full(lng.shape, 180.0)
+    cells = np.zeros(lat.shape, dtype=np.int64)
+    for bit in range(5 * precision):
+        # Geohash interleaves bits starting with longitude
+        if bit % 2 == 0:
+            value, lo, hi = lng, lng_lo, lng_hi
+        else:
+            value, lo, hi = lat, lat_lo, lat_hi
+        mid = (lo + hi) / 2
+        upper = value >= mid
+        cells = (cells << 1) | upper
+        np.copyto(lo, mid, where=upper)
+        np.copyto(hi, mid, where=~upper)
+    return cells
+
+
+def pair_keys(origin_cells, destination_cells):
+    """Packs (origin cell, destination cell) into one int64 key; broadcasts like NumPy."""
+    return (np.asarray(origin_cells, dtype=np.int64) << 32) | np.asarray(destination_cells, dtype=np.int64)
+
+
+class CellTravelCache:
+    """Running mean of travel minutes between geohash cells, one table per profile."""
+
+    def __init__(self):
+        self._sums = {}
+        self._counts = {}
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def record(self, origins, destinations, matrix, profile):
+        """Folds an OSRM table (len(origins) x len(destinations) minutes) into the cell means."""
+        if not origins or not destinations:
+            return
+        o = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        d = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        minutes = np.asarray(matrix, dtype=np.float64)
+        keys = pair_keys(geohash_cells(o[:, 0], o[:, 1])[:, None], geohash_cells(d[:, 0], d[:, 1])[None, :])
+
+        # Unreachable pairs come back as 9999 s; they would poison the mean
+        usable = minutes < 9999 // 60
+        unique, inverse = np.unique(keys[usable], return_inverse=True)
+        sums = np.bincount(inverse, weights=minutes[usable])
+        counts = np.bincount(inverse)
+
+        max_pairs = CELL_SETTINGS.get("max_pairs", 2000000)
+        with self._lock:
+            table_sums = self._sums.setdefault(profile, {})
+            table_counts = self._counts.setdefault(profile, {})
+            for key, total, count in zip(unique.tolist(), sums.tolist(), counts.tolist()):
+                if key not in table_sums:
+                    # A full table keeps refining the cell pairs it already has
+                    if len(table_sums) >= max_pairs:
+                        continue
+                    table_sums[key], table_counts[key] = 0.0, 0
+                table_sums[key] += total
+                table_counts[key] += count
+            self._snapshots.pop(profile, None)
+
+    def _snapshot(self, profile):
+        with self._lock:
+            snapshot = self._snapshots.get(profile)
+            if snapshot is None:
+                sums = self._sums.get(profile, {})
+                counts = self._counts.get(profile, {})
+                min_count = CELL_SETTINGS.get("min_samples", 1)
+                keys = np.fromiter((k for k in sums if counts[k] >= min_count), dtype=np.int64)
+                keys.sort()
+                means = np.fromiter((sums[k] / counts[k] for k in keys.tolist()), dtype=np.float64, count=len(keys))
+                snapshot = self._snapshots[profile] = (keys, means)
+        return snapshot
+
+    def lookup(self, origin_cells, destination_cells, profile):
+        """
+        Mean minutes for each (origin cell, destination cell) pair, broadcast together.
+        Returns: (means, found) arrays; means is undefined where found is False
+        """
+        keys, means = self._snapshot(profile)
+        wanted = pair_keys(origin_cells, destination_cells)
+        if len(keys) == 0:
+            return np.zeros(wanted.shape), np.zeros(wanted.shape, dtype=bool)
+        pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        return means[pos], keys[pos] == wanted
+
+    def stats(self):
+        return {profile: len(sums) for profile, sums in self._sums.items()}
+
+
+# Global instance
+CELL_CACHE = CellTravelCache()
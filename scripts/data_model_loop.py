@@ -1,60 +1,130 @@
 import psycopg2
-import pandas as pd
-import math
+import threading
 from api.logger_config import logger
 from api.db_config import get_db_params
+from api.config_loader import CONFIG
 
 DB_PARAMS = get_db_params()
 
-def run_data_model_loop():
+DATA_MODEL_SETTINGS = CONFIG.get("data_model", {})
+DEFAULT_EFFICIENCY_TIERS = [{"min_efficiency": 0.85, "multiplier": 1.1}]
+
+# Last computed result and the metrics watermark it was derived from
+_last_run = {"watermark": None, "result": None}
+_last_run_lock = threading.Lock()
+
+def metrics_watermark(cur):
+    """
+    Cheap fingerprint of the performance_metrics rows the loop reads. It changes when
+    the history window moves (new day), a row is added or deleted, or a row is updated
+    (xmin is the id of the transaction that last wrote the row).
+    """
+    cur.execute("""
+        SELECT CURRENT_DATE, COUNT(*), MAX(date), MAX(xmin::text::bigint)
+        FROM performance_metrics
+        WHERE date >= CURRENT_DATE - %s * INTERVAL '1 day'
+    """, (DATA_MODEL_SETTINGS.get("history_days", 7),))
+    return tuple(str(v) for v in cur.fetchone())
+
+def build_update_query():
+    """
+    One statement that derives max_jobs_per_day for every driver with recent metrics
+    and writes only the values that change. Rules come from data_model in global_config.json:
+    average completed orders over history_days, times the multiplier of the highest
+    efficiency tier reached, rounded up. With the defaults this is the old per-driver
+    rule (ceil(avg * 1.1) above 0.85 efficiency). min_jobs / max_jobs, when set, clamp
+    the result; they are unset by default, so no clamp applies.
+    """
+    tiers = sorted(
+        DATA_MODEL_SETTINGS.get("efficiency_tiers", DEFAULT_EFFICIENCY_TIERS),
+        key=lambda t: t["min_efficiency"], reverse=True
+    )
+    case_sql = " ".join("WHEN s.avg_efficiency > %s THEN %s" for _ in tiers)
+    multiplier_sql = f"CASE {case_sql} ELSE 1.0 END" if tiers else "1.0"
+    multiplier_params = [v for t in tiers for v in (t["min_efficiency"], t["multiplier"])]
+
+    jobs_sql = f"CEIL(s.avg_orders * {multiplier_sql})"
+    clamp_params = []
+    if DATA_MODEL_SETTINGS.get("min_jobs") is not None:
+        jobs_sql = f"GREATEST({jobs_sql}, %s)"
+        clamp_params.append(DATA_MODEL_SETTINGS["min_jobs"])
+    if DATA_MODEL_SETTINGS.get("max_jobs") is not None:
+        jobs_sql = f"LEAST({jobs_sql}, %s)"
+        clamp_params.append(DATA_MODEL_SETTINGS["max_jobs"])
+
+    query = f"""
+        WITH stats AS (
+            SELECT driver_id,
+                   AVG(total_orders_completed) AS avg_orders,
+                   AVG(efficiency_score) AS avg_efficiency
+            FROM performance_metrics
+            WHERE date >= CURRENT_DATE - %s * INTERVAL '1 day'
+            GROUP BY driver_id
+        ),
+        derived AS (
+            SELECT s.driver_id,
+                   ({jobs_sql})::int AS new_max_jobs
+            FROM stats s
+            WHERE s.avg_orders IS NOT NULL
+        ),
+        updated AS (
+            UPDATE drivers d
+            SET max_jobs_per_day = derived.new_max_jobs
+            FROM derived
+            WHERE d.id = derived.driver_id
+            AND d.max_jobs_per_day IS DISTINCT FROM derived.new_max_jobs
+            RETURNING d.id
+        )
+        SELECT (SELECT COUNT(*) FROM derived), (SELECT COUNT(*) FROM updated)
+    """
+    params = [DATA_MODEL_SETTINGS.get("history_days", 7)] + multiplier_params + clamp_params
+    return query, params
+
+def run_data_model_loop(force=False):
     """
     Analyzes historical performance to derive current-day parameters for the optimizer.
     This fulfills the requirement of the 'Data Model' in the system architecture.
+    Unless force is set, the work is skipped when no metrics have changed since the last run.
     """
     try:
         conn = psycopg2.connect(**DB_PARAMS)
-        
-        # 1. Fetch aggregate stats for the last 7 days
-        query = """
-            SELECT 
-                driver_id,
-                AVG(total_orders_completed) as avg_orders,
-                AVG(average_service_time) as avg_service,
-                AVG(efficiency_score) as avg_efficiency
-            FROM performance_metrics
-            WHERE date >= CURRENT_DATE - INTERVAL '7 days'
-            GROUP BY driver_id
-        """
-        stats = pd.read_sql(query, conn)
-        
-        if stats.empty:
-            logger.warning("No recent performance data found. Skipping Data Model update.")
-            return {"status": "success", "drivers_updated": 0}
-
         cur = conn.cursor()
-        logger.info(f"Running Data Model Loop for {len(stats)} drivers...")
-        
-        updated_count = 0
-        for _, row in stats.iterrows():
-            base_capacity = row['avg_orders']
-            efficiency_boost = 1.1 if row['avg_efficiency'] > 0.85 else 1.0
-            new_max_jobs = math.ceil(base_capacity * efficiency_boost)
-            
-            cur.execute(
-                "UPDATE drivers SET max_jobs_per_day = %s WHERE id = %s",
-                (new_max_jobs, row['driver_id'])
-            )
-            updated_count += 1
 
+        watermark = metrics_watermark(cur)
+        with _last_run_lock:
+            if not force and _last_run["watermark"] == watermark:
+                cur.close()
+                conn.close()
+                logger.info("Data Model parameters are up to date, skipping recompute.")
+                return {**_last_run["result"], "cached": True}
+
+        # Derive and write every driver's parameters in a single round trip
+        query, params = build_update_query()
+        cur.execute(query, params)
+        evaluated, changed = cur.fetchone()
         conn.commit()
         cur.close()
         conn.close()
-        logger.info(f"Data Model Loop complete. Updated {updated_count} drivers.")
-        return {"status": "success", "drivers_updated": updated_count}
-        
+
+        if evaluated == 0:
+            logger.warning("No recent performance data found. Skipping Data Model update.")
+        else:
+            logger.info(f"Data Model Loop complete. Evaluated {evaluated} drivers, {changed} changed.")
+        return remember_result(watermark, {
+            "status": "success",
+            "drivers_updated": evaluated,
+            "drivers_changed": changed
+        })
+
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def remember_result(watermark, result):
+    with _last_run_lock:
+        _last_run["watermark"] = watermark
+        _last_run["result"] = result
+    return {**result, "cached": False}
+
 
 if __name__ == "__main__":
-    run_data_model_loop()
+    run_data_model_loop(force=True)
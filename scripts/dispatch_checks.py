@@ -0,0 +1,365 @@
+"""
+Constraint checks for manual dispatcher edits.
+
+A day's plan is loaded once into memory with, per route, prefix sums of load
+and a forward pass of arrival times plus the backward "forward slack" (the
+largest delay each position can absorb without breaking a later time window
+or the shift end). Moving stop X to route Y at position k is then judged in
+O(1) per route; only the touched routes are re-walked to report ETA changes.
+
+Every stop not yet delivered, failed or cancelled is part of the plan. On the
+current day the routes start now, each from the driver's last known position
+(or, without one, the last stop it completed); other days start at 08:00 from
+the depot. The shift end is counted from 08:00 either way.
+
+The depot x stop matrix is kept between reloads while the day's stops stay at
+the same coordinates. Driver positions move with every GPS ping, so they are
+never part of it: each reload fetches only their rows (start -> every stop)
+and appends them below the square matrix. No stop ever travels to a start.
+"""
+import copy
+import time
+import threading
+from datetime import date, datetime, timedelta
+import psycopg2
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+from scripts.matrix_cache import MATRIX_CACHE, DEFAULT_PROFILE, vehicle_profile
+
+DB_PARAMS = get_db_params()
+
+ROUTING_SETTINGS = CONFIG.get("routing", {})
+SERVICE_TIME = 10
+CLOSED_STATUSES = ('DELIVERED', 'FAILED', 'CANCELLED')
+
+
+class RoutePlan:
+    """One route's open stops with the prefix/suffix arrays used for move checks."""
+
+    def __init__(self, route_id, capacity_weight, capacity_volume, stops, profile=DEFAULT_PROFILE, start_node=0):
+        self.route_id = route_id
+        self.profile = profile
+        # A vehicle without a recorded capacity is not limited
+        self.capacity_weight = float("inf") if capacity_weight is None else capacity_weight
+        self.capacity_volume = float("inf") if capacity_volume is None else capacity_volume
+        self.stops = stops
+        self.start_node = start_node
+
+    def rebuild(self, matrix, shift_end):
+        """Recomputes arrivals, waits, forward slack and load prefix sums."""
+        nodes = [self.start_node] + [s['node'] for s in self.stops] + [0]
+        windows = [(0, shift_end)] + [(s['tw_start'], s['tw_end']) for s in self.stops] + [(0, shift_end)]
+        n = len(nodes)
+
+        raw, arrival, wait = [0] * n, [0] * n, [0] * n
+        departure = 0
+        for i in range(1, n):
+            raw[i] = departure + matrix[nodes[i - 1]][nodes[i]]
+            arrival[i] = max(raw[i], windows[i][0])
+            wait[i] = arrival[i] - raw[i]
+            departure = arrival[i] + (SERVICE_TIME if i < n - 1 else 0)
+
+        # slack[i]: largest delay of raw[i] that keeps positions i..end feasible
+        slack = [0] * n
+        slack[n - 1] = windows[n - 1][1] - arrival[n - 1]
+        for i in range(n - 2, 0, -1):
+            slack[i] = wait[i] + min(windows[i][1] - arrival[i], slack[i + 1])
+
+        load_weight, load_volume = [0.0], [0.0]
+        for s in self.stops:
+            load_weight.append(load_weight[-1] + s['weight'])
+            load_volume.append(load_volume[-1] + s['volume'])
+
+        self.nodes, self.windows = nodes, windows
+        self.raw, self.arrival, self.slack = raw, arrival, slack
+        self.load_weight, self.load_volume = load_weight, load_volume
+        self.shift_end = shift_end
+
+    def departure(self, i):
+        """Departure minute from position i (0 is the route's start)."""
+        if i == 0:
+            return 0
+        return self.arrival[i] + SERVICE_TIME
+
+    def removal_feasible(self, matrix, j):
+        """O(1): can stops[j] be removed without pushing a later stop past its window?"""
+        pos = j + 1
+        new_raw = self.departure(pos - 1) + matrix[self.nodes[pos - 1]][self.nodes[pos + 1]]
+        return new_raw - self.raw[pos + 1] <= self.slack[pos + 1]
+
+    def insertion_check(self, matrix, stop, k):
+        """O(1): violations caused by inserting stop before stops[k]."""
+        violations = []
+        if self.load_weight[-1] + stop['weight'] > self.capacity_weight:
+            violations.append("capacity_weight")
+        if self.load_volume[-1] + stop['volume'] > self.capacity_volume:
+            violations.append("capacity_volume")
+
+        prev_node, next_node = self.nodes[k], self.nodes[k + 1]
+        arrival = max(self.departure(k) + matrix[prev_node][stop['node']], stop['tw_start'])
+        if arrival > stop['tw_end']:
+            violations.append("time_window")
+        new_raw = arrival + SERVICE_TIME + matrix[stop['node']][next_node]
+        if new_raw - self.raw[k + 1] > self.slack[k + 1]:
+            violations.append("downstream_time")
+        return violations
+
+    def late_stops(self):
+        """Stops arriving after their window closes, plus the shift end if exceeded."""
+        late = [
+            self.stops[i - 1]['stop_id'] for i in range(1, len(self.nodes) - 1)
+            if self.arrival[i] > self.windows[i][1]
+        ]
+        shift_exceeded = self.arrival[-1] > self.shift_end
+        return late, shift_exceeded
+
+    def etas(self):
+        return {s['stop_id']: self.arrival[i + 1] for i, s in enumerate(self.stops)}
+
+
+class DispatchPlan:
+    """In-memory snapshot of one planned date, shared by all move checks."""
+
+    def __init__(self, planned_date, base_time, matrices, routes, shift_end):
+        self.planned_date = planned_date
+        self.base_time = base_time
+        self.matrices = matrices
+        self.routes = routes
+        self.shift_end = shift_end
+        self.route_of_stop = {s['stop_id']: r.route_id for r in routes.values() for s in r.stops}
+        self.loaded_at = time.monotonic()
+
+
+def load_dispatch_plan(planned_date):
+    """Reads a date's open stops and each route's start position, and builds the per-route arrays."""
+    conn = psycopg2.connect(**DB_PARAMS)
+    cur = conn.cursor()
+
+    cur.execute("SELECT lat, lng FROM warehouse WHERE is_default = TRUE LIMIT 1")
+    depot = cur.fetchone() or (1.2897, 103.8501)
+
+    cur.execute("""
+        SELECT r.id, v.capacity_weight, v.capacity_volume, v.type,
+               d.last_known_lat, d.last_known_lng, last_stop.lat, last_stop.lng
+        FROM routes r
+        JOIN drivers d ON r.driver_id = d.id
+        LEFT JOIN vehicles v ON v.id = COALESCE(r.vehicle_id, d.assigned_vehicle_id)
+        LEFT JOIN LATERAL (
+            SELECT o.lat, o.lng
+            FROM route_stops rs
+            JOIN orders o ON rs.order_id = o.id
+            WHERE rs.route_id = r.id AND rs.status IN ('DELIVERED', 'FAILED')
+            ORDER BY rs.sequence_number DESC
+            LIMIT 1
+        ) last_stop ON TRUE
+        WHERE r.planned_date = %s
+    """, (planned_date,))
+    route_rows = cur.fetchall()
+    cur.execute("""
+        SELECT rs.route_id, rs.id, o.lat, o.lng, o.weight, o.volume, o.time_window_start, o.time_window_end
+        FROM route_stops rs
+        JOIN routes r ON rs.route_id = r.id
+        JOIN orders o ON rs.order_id = o.id
+        WHERE r.planned_date = %s AND rs.status NOT IN %s
+        ORDER BY rs.route_id, rs.sequence_number
+    """, (planned_date, CLOSED_STATUSES))
+    stop_rows = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    day_start = datetime.combine(planned_date, datetime.min.time()).replace(hour=8)
+    live = planned_date == date.today()
+    base_time = max(datetime.now().replace(second=0, microsecond=0), day_start) if live else day_start
+    max_shift = ROUTING_SETTINGS.get("max_shift_minutes", 720)
+    shift_end = max(0, max_shift - int((base_time - day_start).total_seconds() / 60))
+
+    locations = [(depot[0], depot[1])]
+    routes, starts = {}, {}
+    for route_id, cap_w, cap_v, vehicle_type, driver_lat, driver_lng, last_lat, last_lng in route_rows:
+        routes[route_id] = RoutePlan(route_id, cap_w, cap_v, [], vehicle_profile(vehicle_type))
+        if live:
+            start = (driver_lat, driver_lng) if driver_lat is not None and driver_lng is not None else (last_lat, last_lng)
+            if start[0] is not None and start[1] is not None:
+                starts[route_id] = start
+
+    for route_id, stop_id, lat, lng, weight, volume, tw_start, tw_end in stop_rows:
+        try:
+            start_min = int((tw_start.replace(tzinfo=None) - base_time).total_seconds() / 60)
+            end_min = int((tw_end.replace(tzinfo=None) - base_time).total_seconds() / 60)
+        except (AttributeError, TypeError):
+            start_min, end_min = 0, shift_end
+        locations.append((lat, lng))
+        routes[route_id].stops.append({
+            'stop_id': stop_id,
+            'node': len(locations) - 1,
+            'weight': weight or 0.0,
+            'volume': volume or 0.0,
+            'tw_start': max(0, start_min),
+            'tw_end': max(start_min + 30, end_min),
+        })
+
+    # Each vehicle profile gets its own matrix: the square over depot and stops, then one row per driver start
+    matrices = {}
+    for profile in {r.profile for r in routes.values()}:
+        matrix = square_matrix(planned_date, profile, locations)
+        started = [r for r in routes.values() if r.profile == profile and r.route_id in starts]
+        start_rows = []
+        if started:
+            start_rows = MATRIX_CACHE.get_matrix([starts[r.route_id] for r in started], locations, profile=profile)
+            if start_rows is None:
+                raise RuntimeError("Travel time matrix unavailable")
+        for i, route in enumerate(started):
+            route.start_node = len(locations) + i
+        matrices[profile] = matrix + start_rows
+
+    for route in routes.values():
+        route.rebuild(matrices[route.profile], shift_end)
+
+    logger.info(f"Loaded dispatch plan for {planned_date}: {len(routes)} routes, {len(stop_rows)} stops.")
+    return DispatchPlan(planned_date, base_time, matrices, routes, shift_end)
+
+
+_plans = {}
+_plans_lock = threading.Lock()
+# (planned_date, profile) -> (locations, matrix) of the last load
+_square_matrices = {}
+
+
+def square_matrix(planned_date, profile, locations):
+    """The locations x locations matrix, reused from the last load of the date while the locations match."""
+    key, locations = (planned_date, profile), tuple(locations)
+    with _plans_lock:
+        cached = _square_matrices.get(key)
+    if cached and cached[0] == locations:
+        return cached[1]
+    matrix = MATRIX_CACHE.get_matrix(list(locations), profile=profile)
+    if matrix is None:
+        raise RuntimeError("Travel time matrix unavailable")
+    with _plans_lock:
+        for old in [k for k in _square_matrices if k[0] < date.today()]:
+            del _square_matrices[old]
+        _square_matrices[key] = (locations, matrix)
+    return matrix
+
+
+def get_dispatch_plan(planned_date, refresh=False):
+    """Returns the cached plan for a date, reloading it when stale or on request."""
+    ttl = ROUTING_SETTINGS.get("dispatch_plan_ttl_seconds", 30)
+    with _plans_lock:
+        plan = _plans.get(planned_date)
+    if refresh or plan is None or time.monotonic() - plan.loaded_at > ttl:
+        plan = load_dispatch_plan(planned_date)
+        with _plans_lock:
+            _plans[planned_date] = plan
+    return plan
+
+
+def invalidate_dispatch_plan(planned_date=None):
+    """Drops a cached plan (or all plans) after routes are rewritten."""
+    with _plans_lock:
+        if planned_date is None:
+            _plans.clear()
+            _square_matrices.clear()
+        else:
+            _plans.pop(planned_date, None)
+
+
+def check_moves(planned_date, moves, refresh=False):
+    """
+    Evaluates a sequence of proposed moves against the day's plan.
+    moves: list of dicts with stop_id, route_id (target) and position (0-based)
+    Moves are applied in order on a scratch copy, so later moves see earlier ones.
+    The cached plan itself is never modified.
+    """
+    started = time.perf_counter()
+    try:
+        if isinstance(planned_date, str):
+            planned_date = datetime.strptime(planned_date, "%Y-%m-%d").date()
+    except ValueError:
+        return {"status": "error", "message": f"Invalid date {planned_date!r}; use YYYY-MM-DD"}
+
+    try:
+        plan = get_dispatch_plan(planned_date, refresh=refresh)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+    matrices = plan.matrices
+    working = {}
+    route_of_stop = dict(plan.route_of_stop)
+
+    def route_copy(route_id):
+        if route_id not in working:
+            working[route_id] = copy.copy(plan.routes[route_id])
+            working[route_id].stops = list(plan.routes[route_id].stops)
+        return working[route_id]
+
+    results = []
+    for move in moves:
+        stop_id, target_id, k = str(move['stop_id']), str(move['route_id']), int(move['position'])
+        result = {"stop_id": stop_id, "route_id": target_id, "position": k}
+
+        source_id = route_of_stop.get(stop_id)
+        if source_id is None:
+            results.append({**result, "feasible": False, "violations": ["unknown_stop"], "eta_changes": []})
+            continue
+        if target_id not in plan.routes:
+            results.append({**result, "feasible": False, "violations": ["unknown_route"], "eta_changes": []})
+            continue
+
+        source = route_copy(source_id)
+        target = route_copy(target_id)
+        old_etas = {**source.etas(), **target.etas()}
+        old_ends = {source.route_id: source.arrival[-1], target.route_id: target.arrival[-1]}
+
+        j = next(i for i, s in enumerate(source.stops) if s['stop_id'] == stop_id)
+        source_matrix, target_matrix = matrices[source.profile], matrices[target.profile]
+        violations = [] if source.removal_feasible(source_matrix, j) else ["source_time"]
+        stop = source.stops.pop(j)
+        source.rebuild(source_matrix, plan.shift_end)
+
+        if not 0 <= k <= len(target.stops):
+            source.stops.insert(j, stop)
+            source.rebuild(source_matrix, plan.shift_end)
+            results.append({**result, "feasible": False, "violations": ["invalid_position"], "eta_changes": []})
+            continue
+
+        violations += target.insertion_check(target_matrix, stop, k)
+        target.stops.insert(k, stop)
+        target.rebuild(target_matrix, plan.shift_end)
+        route_of_stop[stop_id] = target_id
+
+        late_stops = []
+        time_violation = any(v in violations for v in ("source_time", "time_window", "downstream_time"))
+        for route in {source.route_id: source, target.route_id: target}.values():
+            late, shift_exceeded = route.late_stops()
+            if time_violation:
+                late_stops += late
+            # A route already past its shift end only counts against the move if it got longer
+            if shift_exceeded and route.arrival[-1] > old_ends[route.route_id] and "shift_length" not in violations:
+                violations.append("shift_length")
+
+        new_etas = {**source.etas(), **target.etas()}
+        eta_changes = [
+            {
+                "stop_id": sid,
+                "old_eta": plan.base_time + timedelta(minutes=old_etas[sid]),
+                "new_eta": plan.base_time + timedelta(minutes=eta),
+            }
+            for sid, eta in new_etas.items() if old_etas.get(sid) != eta
+        ]
+        results.append({
+            **result,
+            "feasible": not violations,
+            "violations": violations,
+            "late_stops": late_stops,
+            "eta_changes": eta_changes
+        })
+
+    return {
+        "status": "success",
+        "date": str(planned_date),
+        "feasible": all(r["feasible"] for r in results),
+        "moves": results,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
@@ -0,0 +1,180 @@
+"""
+GPS breadcrumb history.
+
+Every location ping is kept in driver_locations, a table range-partitioned by
+UTC day (driver_locations_YYYYMMDD). Pings are buffered in memory and written
+in batches with COPY, one round trip per flush instead of one INSERT per ping.
+Partitions are created ahead of time and whole days past the retention window
+are dropped, which is far cheaper than DELETE on a table of this size.
+
+The buffer is bounded: if the database is unreachable for long enough the
+oldest pings are discarded rather than growing memory without limit.
+"""
+import io
+import re
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import psycopg2
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+
+DB_PARAMS = get_db_params()
+
+HISTORY_SETTINGS = CONFIG.get("location_history", {})
+PARTITION_PATTERN = re.compile(r"^driver_locations_(\d{8})$")
+
+
+def partition_name(day):
+    return f"driver_locations_{day:%Y%m%d}"
+
+
+def ensure_partitions(cur, days):
+    """Creates the daily partitions for the given UTC dates if they do not exist yet."""
+    for day in sorted(set(days)):
+        start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(day)}
+            PARTITION OF driver_locations
+            FOR VALUES FROM (%s) TO (%s)
+        """, (start, start + timedelta(days=1)))
+
+
+def list_partitions(cur):
+    """Existing daily partitions as {date: table name}."""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'driver_locations'
+    """)
+    partitions = {}
+    for (name,) in cur.fetchall():
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            partitions[datetime.strptime(match.group(1), "%Y%m%d").date()] = name
+    return partitions
+
+
+class LocationBuffer:
+    """Collects pings and writes them to driver_locations in COPY batches."""
+
+    def __init__(self, max_buffered=None, max_batch=None):
+        self.max_buffered = max_buffered or HISTORY_SETTINGS.get("max_buffered", 200000)
+        self.max_batch = max_batch or HISTORY_SETTINGS.get("max_batch", 5000)
+        self._pending = deque(maxlen=self.max_buffered)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._conn = None
+        self._known_days = set()
+        self.stats = {"buffered": 0, "written": 0, "dropped": 0, "flushes": 0, "failures": 0}
+
+    def add(self, driver_id, lat, lng, recorded_at=None):
+        recorded_at = recorded_at or datetime.now(timezone.utc)
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.stats["dropped"] += 1
+            self._pending.append((str(driver_id), recorded_at, lat, lng))
+            self.stats["buffered"] += 1
+            return len(self._pending) >= self.max_batch
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**DB_PARAMS)
+            self._known_days = set()
+        return self._conn
+
+    def flush(self):
+        """Writes everything buffered so far. Returns the number of pings written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+            if not batch:
+                return 0
+
+            try:
+                conn = self._connection()
+                cur = conn.cursor()
+                days = {row[1].astimezone(timezone.utc).date() for row in batch}
+                if not days <= self._known_days:
+                    ensure_partitions(cur, days - self._known_days)
+
+                data = io.StringIO()
+                for driver_id, recorded_at, lat, lng in batch:
+                    data.write(f"{driver_id}\t{recorded_at.isoformat()}\t{lat!r}\t{lng!r}\n")
+                data.seek(0)
+                cur.copy_expert("COPY driver_locations (driver_id, recorded_at, lat, lng) FROM STDIN", data)
+                conn.commit()
+                cur.close()
+                self._known_days |= days
+            except Exception as e:
+                logger.error(f"Location history flush failed ({len(batch)} pings kept for retry): {e}")
+                self.stats["failures"] += 1
+                try:
+                    self._conn.rollback()
+                except Exception:
+                    self._conn = None
+                # Put the batch back ahead of newer pings, dropping its oldest if there is no room
+                with self._lock:
+                    room = self.max_buffered - len(self._pending)
+                    if len(batch) > room:
+                        self.stats["dropped"] += len(batch) - room
+                        batch = batch[len(batch) - room:]
+                    self._pending.extendleft(reversed(batch))
+                return 0
+
+            self.stats["written"] += len(batch)
+            self.stats["flushes"] += 1
+            return len(batch)
+
+    def close(self):
+        self.flush()
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+
+
+# Global instance
+LOCATION_BUFFER = LocationBuffer()
+
+
+def maintain_partitions(retention_days=None, precreate_days=None):
+    """
+    Creates partitions for today and the next precreate_days, and drops
+    partitions older than retention_days.
+    Returns: status dict with created and dropped partitions.
+    """
+    retention_days = retention_days or HISTORY_SETTINGS.get("retention_days", 30)
+    precreate_days = HISTORY_SETTINGS.get("precreate_days", 2) if precreate_days is None else precreate_days
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        today = datetime.now(timezone.utc).date()
+
+        existing = list_partitions(cur)
+        upcoming = [today + timedelta(days=i) for i in range(precreate_days + 1)]
+        created = [partition_name(d) for d in upcoming if d not in existing]
+        ensure_partitions(cur, upcoming)
+
+        cutoff = today - timedelta(days=retention_days)
+        dropped = []
+        for day, name in sorted(existing.items()):
+            if day < cutoff:
+                cur.execute(f"DROP TABLE IF EXISTS {name}")
+                dropped.append(name)
+
+        conn.commit()
+        cur.close()
+        conn.close()
+        if created or dropped:
+            logger.info(f"Location history partitions: created {created}, dropped {dropped}.")
+        return {"status": "success", "created": created, "dropped": dropped}
+    except Exception as e:
+        logger.error(f"Location history maintenance failed: {e}")
+        return {"status": "error", "message": str(e)}
+
+
+if __name__ == "__main__":
+    print(maintain_partitions())
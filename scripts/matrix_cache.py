@@ -0,0 +1,250 @@
+"""
+Process-wide cache of OSRM travel times.
+
+Every coordinate is interned once into a shared index and durations are kept
+as sparse rows (origin index -> {destination index: minutes}), one row store
+per routing profile. Repeated solves over the same depot and orders, and small
+re-plans of a single route, only ask OSRM for the rows they have never seen.
+
+Profiles without their own OSRM server (see vehicle_profiles in
+global_config.json) are derived from their fallback profile's rows times a
+factor, so they add no fetches and no storage. Every fetched table is also
+folded into the geohash-cell cache used for approximate matrices.
+"""
+import os
+import threading
+import requests
+from api.logger_config import logger
+from api.config_loader import CONFIG
+from scripts.cell_cache import CELL_CACHE
+
+CACHE_SETTINGS = CONFIG.get("matrix_cache", {})
+PROFILE_SETTINGS = CONFIG.get("vehicle_profiles", {})
+DEFAULT_PROFILE = "car"
+
+
+def coord_key(lat, lng, precision=None):
+    """Rounds a coordinate so that the same address always maps to the same cache slot."""
+    if precision is None:
+        precision = CACHE_SETTINGS.get("coord_precision", 5)
+    return (round(float(lat), precision), round(float(lng), precision))
+
+
+def vehicle_profile(vehicle_type):
+    """Maps a vehicle_type (BIKE, VAN, TRUCK) to its routing profile."""
+    types = PROFILE_SETTINGS.get("vehicle_types", {})
+    return types.get(str(vehicle_type).upper(), DEFAULT_PROFILE) if vehicle_type else DEFAULT_PROFILE
+
+
+def profile_server(profile):
+    """(host, port, osrm profile name) for a profile, or None if it has no OSRM server of its own."""
+    settings = PROFILE_SETTINGS.get("profiles", {}).get(profile, {})
+    if profile == DEFAULT_PROFILE:
+        host = os.getenv(settings.get("osrm_host_env", "OSRM_HOST"), "localhost")
+    else:
+        host = os.getenv(settings.get("osrm_host_env", f"OSRM_{profile.upper()}_HOST"))
+    if not host:
+        return None
+    return host, settings.get("osrm_port", 5000), settings.get("osrm_profile", "driving")
+
+
+def profile_fallback(profile):
+    """(fallback profile, factor) used when a profile has no server or its server fails."""
+    settings = PROFILE_SETTINGS.get("profiles", {}).get(profile, {})
+    if profile == DEFAULT_PROFILE:
+        return None, 1.0
+    return settings.get("fallback_profile", DEFAULT_PROFILE), settings.get("fallback_factor", 1.0)
+
+
+def _fetch_table_block(session, server, locations, sources, destinations, profile):
+    """One OSRM /table request. Returns len(sources) x len(destinations) minutes, or None."""
+    osrm_host, osrm_port, osrm_profile = server
+    # OSRM expects {lng},{lat}
+    coords = ";".join([f"{lng},{lat}" for lat, lng in locations])
+    url = f"http://{osrm_host}:{osrm_port}/table/v1/{osrm_profile}/{coords}?annotations=duration"
+    if sources is not None:
+        url += "&sources=" + ";".join(str(i) for i in sources)
+    if destinations is not None:
+        url += "&destinations=" + ";".join(str(i) for i in destinations)
+
+    try:
+        response = session.get(url, timeout=30)
+        data = response.json()
+        if data['code'] != 'Ok':
+            logger.error(f"OSRM Error: {data.get('message', 'Unknown error')}")
+            return None
+
+        # OSRM returns durations in seconds. Convert to minutes.
+        durations = data['durations']
+        matrix = []
+        for row in durations:
+            matrix.append([int((d or 9999) / 60) for d in row])
+        return matrix
+    except Exception as e:
+        logger.error(f"Failed to fetch OSRM matrix ({profile}): {e}")
+        return None
+
+
+def fetch_osrm_table(locations, sources=None, destinations=None, profile=DEFAULT_PROFILE):
+    """
+    Fetches a travel time table from OSRM.
+    locations: List of (lat, lng) tuples
+    sources / destinations: Optional index lists into locations (defaults to all)
+    Returns: 2D list of durations in minutes (rounded), len(sources) x len(destinations)
+
+    osrm-routed rejects tables over --max-table-size (100 by default) sources x
+    destinations, so a larger table is fetched as blocks of at most
+    osrm_max_table_size sources and destinations each, and stitched together.
+    """
+    server = profile_server(profile)
+    if server is None:
+        return None
+
+    block = CACHE_SETTINGS.get("osrm_max_table_size", 100)
+    src = list(range(len(locations))) if sources is None else list(sources)
+    dst = list(range(len(locations))) if destinations is None else list(destinations)
+    with requests.Session() as session:
+        if len(src) * len(dst) <= block * block:
+            return _fetch_table_block(session, server, locations, sources, destinations, profile)
+
+        matrix = [[0] * len(dst) for _ in src]
+        for s0 in range(0, len(src), block):
+            for d0 in range(0, len(dst), block):
+                src_block, dst_block = src[s0:s0 + block], dst[d0:d0 + block]
+                # Only the block's own coordinates go in the request
+                block_locations = list(dict.fromkeys(src_block + dst_block))
+                position = {i: pos for pos, i in enumerate(block_locations)}
+                rows = _fetch_table_block(
+                    session, server, [locations[i] for i in block_locations],
+                    [position[i] for i in src_block], [position[i] for i in dst_block], profile
+                )
+                if rows is None:
+                    return None
+                for r, row in enumerate(rows):
+                    matrix[s0 + r][d0:d0 + len(row)] = row
+    logger.info(f"Fetched a {len(src)}x{len(dst)} OSRM table in blocks of {block}.")
+    return matrix
+
+
+class MatrixCache:
+    """Thread-safe, coordinate-indexed store of OSRM duration rows, one row store per profile."""
+
+    def __init__(self, max_locations=None):
+        self.max_locations = max_locations or CACHE_SETTINGS.get("max_locations", 20000)
+        self._index = {}
+        self._coords = []
+        self._rows = {}
+        self._lock = threading.Lock()
+        self.row_hits = 0
+        self.row_misses = 0
+
+    def _intern(self, index, key):
+        idx = index.get(key)
+        if idx is None:
+            idx = len(index)
+            index[key] = idx
+            self._coords.append(key)
+        return idx
+
+    def get_matrix(self, origins, destinations=None, profile=DEFAULT_PROFILE):
+        """
+        Returns the len(origins) x len(destinations) matrix of travel minutes for a
+        profile, fetching only the origin rows that are missing from the cache.
+        Returns None if OSRM is unreachable and the cache cannot answer.
+        """
+        if destinations is None:
+            destinations = origins
+
+        if profile_server(profile) is None:
+            return self._derived_matrix(origins, destinations, profile)
+
+        with self._lock:
+            if len(self._index) + len(origins) + len(destinations) > self.max_locations:
+                logger.info(f"Matrix cache reached {len(self._index)} locations, starting a fresh cache.")
+                self._index, self._coords, self._rows = {}, [], {}
+            # Keep references so a concurrent reset cannot pull the rows out from under us
+            index, rows = self._index, self._rows.setdefault(profile, {})
+            src = [self._intern(index, coord_key(lat, lng)) for lat, lng in origins]
+            dst = [self._intern(index, coord_key(lat, lng)) for lat, lng in destinations]
+            missing = [
+                pos for pos, i in enumerate(src)
+                if i not in rows or any(j not in rows[i] for j in dst)
+            ]
+
+        self.row_hits += len(origins) - len(missing)
+        self.row_misses += len(missing)
+
+        if missing:
+            # Deduplicate origins that share a coordinate before asking OSRM
+            missing_src = list(dict.fromkeys(src[pos] for pos in missing))
+            first_pos = {}
+            for pos in missing:
+                first_pos.setdefault(src[pos], pos)
+            # Origins that are also destinations reuse that coordinate instead of sending it twice
+            table_locations = list(destinations)
+            dst_pos = {j: pos for pos, j in enumerate(dst)}
+            sources = []
+            for i in missing_src:
+                if i not in dst_pos:
+                    dst_pos[i] = len(table_locations)
+                    table_locations.append(origins[first_pos[i]])
+                sources.append(dst_pos[i])
+            fetched = fetch_osrm_table(
+                table_locations,
+                sources=sources,
+                destinations=range(len(destinations)),
+                profile=profile
+            )
+            if fetched is None:
+                return self._derived_matrix(origins, destinations, profile)
+            CELL_CACHE.record([origins[first_pos[i]] for i in missing_src], destinations, fetched, profile)
+            with self._lock:
+                for i, row in zip(missing_src, fetched):
+                    rows.setdefault(i, {}).update(zip(dst, row))
+
+        with self._lock:
+            return [[rows[i][j] for j in dst] for i in src]
+
+    def _derived_matrix(self, origins, destinations, profile):
+        """Fallback profile's matrix scaled by the configured factor, or None for the default profile."""
+        fallback, factor = profile_fallback(profile)
+        if fallback is None or fallback == profile:
+            return None
+        matrix = self.get_matrix(origins, destinations, profile=fallback)
+        if matrix is None or factor == 1.0:
+            return matrix
+        return [[int(round(d * factor)) for d in row] for row in matrix]
+
+    def samples(self, profile=DEFAULT_PROFILE, max_samples=200000):
+        """
+        Cached OSRM durations as flat arrays for fitting estimators.
+        Returns: (origin coords, destination coords, minutes) as lists, at most max_samples long
+        """
+        origins, destinations, minutes = [], [], []
+        with self._lock:
+            coords = self._coords
+            for i, row in self._rows.get(profile, {}).items():
+                for j, duration in row.items():
+                    if i == j:
+                        continue
+                    origins.append(coords[i])
+                    destinations.append(coords[j])
+                    minutes.append(duration)
+                if len(minutes) >= max_samples:
+                    break
+        return origins, destinations, minutes
+
+    def cached_row_count(self, profile=DEFAULT_PROFILE):
+        return len(self._rows.get(profile, {}))
+
+    def stats(self):
+        return {
+            "locations": len(self._index),
+            "cached_rows": {profile: len(rows) for profile, rows in self._rows.items()},
+            "row_hits": self.row_hits,
+            "row_misses": self.row_misses,
+        }
+
+
+# Global instance
+MATRIX_CACHE = MatrixCache()
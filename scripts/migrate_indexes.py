@@ -0,0 +1,63 @@
+"""
+Migration script adding secondary indexes for the hot API and optimizer
+queries. Indexes are built CONCURRENTLY so a live database keeps taking
+writes; scripts/verify_query_plans.py checks the planner actually uses them.
+"""
+import psycopg2
+from api.db_config import get_db_params
+
+INDEXES = [
+    # GET /orders (optionally by status), newest first; id breaks created_at ties
+    ("idx_orders_status_created", "orders(status, created_at DESC, id DESC)"),
+    ("idx_orders_created", "orders(created_at DESC, id DESC)"),
+    # Optimizer pending-order fetch and the pending purge touch only a small slice
+    ("idx_orders_pending_created", "orders(created_at DESC) WHERE status = 'PENDING'"),
+    # Routes of a date, and a driver's route of the day
+    ("idx_routes_planned_date_driver", "routes(planned_date, driver_id)"),
+    # (route_id, sequence_number) is already covered by its UNIQUE constraint
+    ("idx_route_stops_order", "route_stops(order_id)"),
+    # Risk monitor and resequencer only look at stops still to be served
+    ("idx_route_stops_open", "route_stops(route_id, sequence_number) WHERE status = 'ASSIGNED'"),
+    # Period containing a date
+    ("idx_periods_dates", "periods(start_date, end_date)"),
+    # (driver_id, date) is unique already; history windows and daily rollups scan by date
+    ("idx_performance_metrics_date", "performance_metrics(date)"),
+    # Check-in / check-out by vehicle plate
+    ("idx_drivers_assigned_vehicle", "drivers(assigned_vehicle_id)"),
+    ("idx_driver_period_assignments_driver", "driver_period_assignments(driver_id)"),
+]
+
+def migrate():
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    # IF NOT EXISTS would keep an INVALID index left by an earlier interrupted build
+    cur.execute("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relname = ANY(%s)
+    """, ([name for name, _ in INDEXES],))
+    for (name,) in cur.fetchall():
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+
+    failed = 0
+    for name, definition in INDEXES:
+        try:
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition};")
+            print(f"✅ {name}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {name} failed: {e}")
+
+    cur.execute("ANALYZE orders, routes, route_stops, periods, performance_metrics, drivers;")
+    cur.close()
+    conn.close()
+    if failed:
+        print(f"❌ {failed} index(es) failed; rerun the migration")
+    else:
+        print("✅ Indexes created and statistics refreshed successfully!")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,46 @@
+"""
+Migration script for the GPS breadcrumb store: driver_locations, range
+partitioned by UTC day, plus partitions for today and the next few days.
+"""
+import psycopg2
+from api.db_config import get_db_params
+from scripts.location_history import maintain_partitions
+
+def migrate():
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS driver_locations (
+                driver_id UUID NOT NULL,
+                recorded_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                lat FLOAT NOT NULL,
+                lng FLOAT NOT NULL
+            ) PARTITION BY RANGE (recorded_at);
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_driver_locations_driver_time
+            ON driver_locations(driver_id, recorded_at);
+        """)
+
+        conn.commit()
+        print("✅ driver_locations partitioned table created successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+        return
+    finally:
+        cur.close()
+        conn.close()
+
+    result = maintain_partitions()
+    if result["status"] == "success":
+        print(f"✅ Daily partitions ready: {', '.join(result['created']) or 'already present'}")
+    else:
+        print(f"❌ Partition setup failed: {result['message']}")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,63 @@
+"""
+Migration script for the incremental performance_metrics pipeline:
+route_stops.updated_at (kept current by a trigger), one metrics row per
+driver and day, and the pipeline_watermarks table.
+"""
+import psycopg2
+from api.db_config import get_db_params
+
+def migrate():
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    cur = conn.cursor()
+    
+    try:
+        # Change tracking on route_stops
+        cur.execute("""
+            ALTER TABLE route_stops
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+        """)
+        # Same trigger function as orders (update_updated_at_column from schema.sql)
+        cur.execute("DROP TRIGGER IF EXISTS route_stops_set_updated_at ON route_stops;")
+        cur.execute("""
+            CREATE TRIGGER route_stops_set_updated_at
+            BEFORE UPDATE ON route_stops
+            FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
+        """)
+        # Left behind by earlier runs of this migration
+        cur.execute("DROP FUNCTION IF EXISTS set_updated_at();")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_route_stops_updated_at ON route_stops(updated_at);")
+        
+        # One metrics row per driver and day (keep the newest of any duplicates first)
+        cur.execute("""
+            DELETE FROM performance_metrics a
+            USING performance_metrics b
+            WHERE a.driver_id = b.driver_id AND a.date = b.date AND a.ctid < b.ctid;
+        """)
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS performance_metrics_driver_date
+            ON performance_metrics(driver_id, date);
+        """)
+        
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_watermarks (
+                name VARCHAR(50) PRIMARY KEY,
+                high_water TIMESTAMP WITH TIME ZONE NOT NULL,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        
+        conn.commit()
+        print("✅ route_stops.updated_at column and trigger added")
+        print("✅ performance_metrics unique (driver_id, date) index created")
+        print("✅ pipeline_watermarks table created successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
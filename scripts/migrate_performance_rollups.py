@@ -0,0 +1,58 @@
+"""
+Migration script for the analytics rollups: day / week / month buckets of
+performance_metrics per driver and fleet-wide, backfilled from existing metrics.
+scripts/performance_metrics.py keeps them current afterwards.
+"""
+import psycopg2
+from api.db_config import get_db_params
+from scripts.performance_metrics import rebuild_rollups
+
+ROLLUP_MEASURES = """
+    days INTEGER NOT NULL,
+    total_completed INTEGER,
+    service_time_sum BIGINT,
+    service_time_days INTEGER NOT NULL,
+    delay_minutes BIGINT,
+    efficiency_sum FLOAT,
+    efficiency_days INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+"""
+
+def migrate():
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    cur = conn.cursor()
+
+    try:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS driver_performance_rollups (
+                driver_id UUID NOT NULL REFERENCES drivers(id) ON DELETE CASCADE,
+                granularity VARCHAR(5) NOT NULL CHECK (granularity IN ('day', 'week', 'month')),
+                period_start DATE NOT NULL,
+                {ROLLUP_MEASURES},
+                PRIMARY KEY (driver_id, granularity, period_start)
+            );
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS fleet_performance_rollups (
+                granularity VARCHAR(5) NOT NULL CHECK (granularity IN ('day', 'week', 'month')),
+                period_start DATE NOT NULL,
+                {ROLLUP_MEASURES},
+                PRIMARY KEY (granularity, period_start)
+            );
+        """)
+        driver_buckets, fleet_buckets = rebuild_rollups(cur)
+
+        conn.commit()
+        print("✅ driver_performance_rollups and fleet_performance_rollups tables created")
+        print(f"✅ Backfilled {driver_buckets} driver and {fleet_buckets} fleet buckets successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,48 @@
+"""
+Migration script to add the leg geometry cache and the routes.geometry column.
+"""
+import psycopg2
+from api.db_config import get_db_params
+
+def migrate():
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    cur = conn.cursor()
+    
+    try:
+        # One OSRM polyline per coordinate pair, shared by every route that uses the leg
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS route_leg_geometries (
+                from_lat FLOAT NOT NULL,
+                from_lng FLOAT NOT NULL,
+                to_lat FLOAT NOT NULL,
+                to_lng FLOAT NOT NULL,
+                polyline TEXT,
+                distance_m FLOAT,
+                duration_s FLOAT,
+                retry_after TIMESTAMP WITH TIME ZONE,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (from_lat, from_lng, to_lat, to_lng)
+            );
+        """)
+        
+        # Legs OSRM could not route are kept without a polyline until retry_after
+        cur.execute("ALTER TABLE route_leg_geometries ALTER COLUMN polyline DROP NOT NULL;")
+        cur.execute("ALTER TABLE route_leg_geometries ADD COLUMN IF NOT EXISTS retry_after TIMESTAMP WITH TIME ZONE;")
+        
+        # Leg polylines stored with the route, keyed by its stop coordinates
+        cur.execute("ALTER TABLE routes ADD COLUMN IF NOT EXISTS geometry JSONB;")
+        
+        conn.commit()
+        print("✅ route_leg_geometries table created successfully!")
+        print("✅ routes.geometry column added")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -1,5 +1,3 @@
-import requests
-import os
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -7,12 +5,41 @@ from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 from api.logger_config import logger
 from api.db_config import get_db_params
+from api.config_loader import CONFIG
+from scripts.matrix_cache import MATRIX_CACHE, DEFAULT_PROFILE, vehicle_profile
+from scripts.travel_profiles import get_slice_multipliers, departure_profile_matrix, route_arrivals
+from scripts.travel_estimator import estimate_matrix, approximate_matrix
+from scripts.profiling import NULL_PROFILER
 import psycopg2
 
 # Database Connection
 DB_PARAMS = get_db_params()
 
-def get_data_from_db(planned_date=None):
+ROUTING_SETTINGS = CONFIG.get("routing", {})
+LARGE_DAY_SETTINGS = ROUTING_SETTINGS.get("large_days", {})
+
+# Served by idx_orders_pending_created (see scripts/verify_query_plans.py).
+# The newest run_limits()[0] pending orders; days over approximate_matrix_above use approximate matrices
+PENDING_ORDERS_SQL = """
+    SELECT id, lat, lng, time_window_start, time_window_end, weight, volume
+    FROM orders 
+    WHERE status = 'PENDING'
+    ORDER BY created_at DESC 
+    LIMIT %s
+"""
+PERIOD_LOOKUP_SQL = "SELECT id FROM periods WHERE %s BETWEEN start_date AND end_date LIMIT 1"
+
+def run_limits():
+    """
+    (pending orders per run, solve time limit in seconds). Runs take the newest
+    max_orders_per_run orders (100) and solve for 5 s; routing.large_days, when
+    enabled, raises both so a day can reach the approximate-matrix path.
+    """
+    if LARGE_DAY_SETTINGS.get("enabled"):
+        return LARGE_DAY_SETTINGS.get("max_orders_per_run", 5000), LARGE_DAY_SETTINGS.get("time_limit_seconds", 60)
+    return ROUTING_SETTINGS.get("max_orders_per_run", 100), 5
+
+def get_data_from_db(planned_date=None, profiler=NULL_PROFILER):
     conn = psycopg2.connect(**DB_PARAMS)
     
     # Fetch warehouse/depot location
@@ -29,51 +56,53 @@ def get_data_from_db(planned_date=None):
     cur.close()
     
     # Fetch orders with demands
-    query_orders = """
-        SELECT id, lat, lng, time_window_start, time_window_end, weight, volume
-        FROM orders 
-        WHERE status = 'PENDING'
-        ORDER BY created_at DESC 
-        LIMIT 100
-    """
-    orders = pd.read_sql(query_orders, conn)
+    with profiler.phase("order fetch"):
+        orders = pd.read_sql(PENDING_ORDERS_SQL, conn, params=(run_limits()[0],))
     
     # 1. Identify if this date belongs to a managed Period
     period_id = None
     if planned_date:
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM periods WHERE %s BETWEEN start_date AND end_date LIMIT 1", (planned_date,))
-        row = cur.fetchone()
-        if row:
-            period_id = row[0]
-        cur.close()
+        with profiler.phase("period lookup"):
+            cur = conn.cursor()
+            cur.execute(PERIOD_LOOKUP_SQL, (planned_date,))
+            row = cur.fetchone()
+            if row:
+                period_id = row[0]
+            cur.close()
 
     # 2. Fetch drivers. If assigned to a period, only those. Else all active with vehicles.
     if period_id:
         query_drivers = """
             SELECT d.id, d.full_name, d.max_jobs_per_day,
-                   v.capacity_weight, v.capacity_volume
+                   v.capacity_weight, v.capacity_volume, v.type AS vehicle_type
             FROM drivers d
             JOIN driver_period_assignments dpa ON d.id = dpa.driver_id
             JOIN vehicles v ON d.assigned_vehicle_id = v.id
             WHERE dpa.period_id = %s AND d.is_active = TRUE AND v.is_active = TRUE
         """
-        drivers = pd.read_sql(query_drivers, conn, params=(period_id,))
+        with profiler.phase("driver fetch"):
+            drivers = pd.read_sql(query_drivers, conn, params=(period_id,))
     else:
         # Fallback to all active drivers with assigned in-service vehicles
         query_drivers = """
             SELECT d.id, d.full_name, d.max_jobs_per_day,
-                   v.capacity_weight, v.capacity_volume
+                   v.capacity_weight, v.capacity_volume, v.type AS vehicle_type
             FROM drivers d
             JOIN vehicles v ON d.assigned_vehicle_id = v.id
             WHERE d.is_active = TRUE AND v.is_active = TRUE
         """
-        drivers = pd.read_sql(query_drivers, conn)
+        with profiler.phase("driver fetch"):
+            drivers = pd.read_sql(query_drivers, conn)
         
     conn.close()
     return orders, drivers, (depot_lat, depot_lng)
 
-def create_data_model(orders, drivers, depot_location):
+def create_data_model(orders, drivers, depot_location, approximate=False, profiler=NULL_PROFILER):
+    """
+    Builds the solver inputs. With approximate=True the matrices come from the
+    geohash-cell cache and estimator instead of OSRM; save_solution then
+    fetches exact durations for the arcs the routes actually use.
+    """
     data = {}
     depot_lat, depot_lng = depot_location
     
@@ -112,58 +141,198 @@ def create_data_model(orders, drivers, depot_location):
     data['time_windows'] = time_windows
     data['service_time'] = 10
     
-    # Replace Euclidean math with OSRM
-    logger.info(f"Fetching {data['num_locations']}x{data['num_locations']} matrix from OSRM...")
-    matrix = get_osrm_matrix(locations)
-    
-    if matrix is None:
-        logger.warning("OSRM Matrix failed. Falling back to Euclidean (Simplified).")
-        def travel_time(i, j):
-            if i == j: return 0
-            dist = np.sqrt((locations[i][0] - locations[j][0])**2 + 
-                           (locations[i][1] - locations[j][1])**2)
-            return int(dist * 500)
-
-        matrix = []
-        for i in range(data['num_locations']):
-            row = []
-            for j in range(data['num_locations']):
-                row.append(travel_time(i, j))
-            matrix.append(row)
-    
-    data['time_matrix'] = matrix
+    # Time-dependent travel: each arc is scaled by the slice of its estimated departure
+    # (window midpoint plus service), the static matrices are kept for ETA re-timing
+    data['day_start_minute'] = 8 * 60
+    data['slice_multipliers'] = get_slice_multipliers()
+    departures = [data['day_start_minute']] + [
+        data['day_start_minute'] + (start + end) // 2 + data['service_time'] for start, end in time_windows[1:]
+    ]
+
+    # One matrix per routing profile present in the fleet (BIKE / VAN / TRUCK)
+    if 'vehicle_type' in drivers:
+        data['vehicle_profiles'] = [vehicle_profile(t) for t in drivers['vehicle_type'].tolist()]
+    else:
+        data['vehicle_profiles'] = [DEFAULT_PROFILE] * data['num_vehicles']
+
+    data['approximate'] = approximate
+    data['base_time_matrices'] = {}
+    data['time_matrices'] = {}
+    with profiler.phase("matrix"):
+        build_time_matrices(data, locations, departures, approximate)
     return data
 
-def get_osrm_matrix(locations):
+def build_time_matrices(data, locations, departures, approximate):
+    """Fills base_time_matrices / time_matrices for every profile in the fleet."""
+    for profile in dict.fromkeys(data['vehicle_profiles']):
+        if approximate:
+            data['base_time_matrices'][profile] = matrix = approximate_matrix(locations, profile)
+            data['time_matrices'][profile] = departure_profile_matrix(matrix, departures, data['slice_multipliers'])
+            continue
+
+        logger.info(f"Fetching {data['num_locations']}x{data['num_locations']} {profile} matrix from OSRM...")
+        matrix = get_osrm_matrix(locations, profile)
+        
+        if matrix is None:
+            logger.warning(f"OSRM Matrix failed. Falling back to the fitted {profile} travel estimator.")
+            matrix = estimate_matrix(locations, profile)
+
+        data['base_time_matrices'][profile] = matrix
+        data['time_matrices'][profile] = departure_profile_matrix(matrix, departures, data['slice_multipliers'])
+    return data
+
+def get_osrm_matrix(locations, profile=DEFAULT_PROFILE):
     """
-    Fetches the travel time matrix from OSRM.
+    Fetches the travel time matrix from OSRM, reusing cached rows where possible.
     locations: List of (lat, lng) tuples
+    profile: Routing profile (car, bike, truck)
     Returns: 2D list of durations in minutes (rounded)
     """
-    # OSRM expects {lng},{lat}
-    coords = ";".join([f"{lng},{lat}" for lat, lng in locations])
-    osrm_host = os.getenv("OSRM_HOST", "localhost")
-    url = f"http://{osrm_host}:5000/table/v1/driving/{coords}?annotations=duration"
+    return MATRIX_CACHE.get_matrix(locations, profile=profile)
+
+def find_infeasible_arcs(data):
+    """
+    Vectorized time-window pruning: arc i -> j can never be used when the earliest
+    departure from i (window start plus service) plus travel time misses j's window end.
+    NextVar is shared by all vehicles, so an arc is only pruned if it fails for every profile.
+    Returns a boolean matrix; depot rows/columns and the diagonal are always left open.
+    """
+    windows = np.asarray(data['time_windows'], dtype=np.int64)
+    matrix = np.min([np.asarray(m, dtype=np.int64) for m in data['time_matrices'].values()], axis=0)
+    earliest_departure = windows[:, 0] + data['service_time']
+    infeasible = earliest_departure[:, None] + matrix > windows[None, :, 1]
+    infeasible[data['depot'], :] = False
+    infeasible[:, data['depot']] = False
+    np.fill_diagonal(infeasible, False)
+    return infeasible
+
+def build_routing_model(data, profiler=NULL_PROFILER):
+    """Builds the OR-Tools routing model (time, capacity and drop penalties) for a data model."""
+    manager = pywrapcp.RoutingIndexManager(data['num_locations'], data['num_vehicles'], data['depot'])
+    routing = pywrapcp.RoutingModel(manager)
+
+    # One transit evaluator per profile, each vehicle uses its own
+    with profiler.phase("callback registration"):
+        profile_callbacks = {}
+        for profile, time_matrix in data['time_matrices'].items():
+            def time_callback(from_index, to_index, time_matrix=time_matrix):
+                from_node = manager.IndexToNode(from_index)
+                to_node = manager.IndexToNode(to_index)
+                travel_time = time_matrix[from_node][to_node]
+                if from_node == 0:
+                    return int(travel_time)
+                return int(travel_time + data['service_time'])
+
+            profile_callbacks[profile] = routing.RegisterTransitCallback(time_callback)
+
+        vehicle_callbacks = [profile_callbacks[p] for p in data['vehicle_profiles']]
+        for vehicle_id, transit_callback_index in enumerate(vehicle_callbacks):
+            routing.SetArcCostEvaluatorOfVehicle(transit_callback_index, vehicle_id)
+
+    routing.AddDimensionWithVehicleTransits(
+        vehicle_callbacks,
+        30,  # allow waiting time
+        1440, # maximum time per vehicle
+        False, # start cumul to zero
+        'Time'
+    )
+    time_dimension = routing.GetDimensionOrDie('Time')
+    for location_idx, time_window in enumerate(data['time_windows']):
+        if location_idx == 0: continue
+        index = manager.NodeToIndex(location_idx)
+        time_dimension.CumulVar(index).SetRange(int(time_window[0]), int(time_window[1]))
+
+    # Forbid arcs the time windows make unusable, shrinking local-search neighbourhoods
+    if ROUTING_SETTINGS.get("prune_time_window_arcs", True):
+        with profiler.phase("arc pruning"):
+            infeasible = find_infeasible_arcs(data)
+            for from_node in np.flatnonzero(infeasible.any(axis=1)):
+                to_indices = [manager.NodeToIndex(int(j)) for j in np.flatnonzero(infeasible[from_node])]
+                routing.NextVar(manager.NodeToIndex(int(from_node))).RemoveValues(to_indices)
+        logger.info(f"Pruned {int(infeasible.sum())} time-window-infeasible arcs.")
+
+    # 1. Capacity Constraints (Weight)
+    def weight_callback(from_index):
+        node = manager.IndexToNode(from_index)
+        return int(data['demands_weight'][node])
     
-    try:
-        response = requests.get(url, timeout=30)
-        data = response.json()
-        if data['code'] != 'Ok':
-            logger.error(f"OSRM Error: {data.get('message', 'Unknown error')}")
-            return None
-        
-        # OSRM returns durations in seconds. Convert to minutes.
-        durations = data['durations']
-        matrix = []
-        for row in durations:
-            matrix.append([int((d or 9999) / 60) for d in row])
-        return matrix
-    except Exception as e:
-        logger.error(f"Failed to fetch OSRM matrix: {e}")
-        return None
+    weight_callback_index = routing.RegisterUnaryTransitCallback(weight_callback)
+    routing.AddDimensionWithVehicleCapacity(
+        weight_callback_index, 0, data['vehicle_capacities_weight'], True, 'Weight'
+    )
+
+    # 2. Capacity Constraints (Volume)
+    def volume_callback(from_index):
+        node = manager.IndexToNode(from_index)
+        return int(data['demands_volume'][node])
+    
+    volume_callback_index = routing.RegisterUnaryTransitCallback(volume_callback)
+    routing.AddDimensionWithVehicleCapacity(
+        volume_callback_index, 0, data['vehicle_capacities_volume'], True, 'Volume'
+    )
 
-def run_optimization(planned_date=None):
-    """Main function to fetch data, build model, and solve the routing problem."""
+    penalty = 10000
+    for node in range(1, data['num_locations']):
+        routing.AddDisjunction([int(manager.NodeToIndex(node))], int(penalty))
+
+    return manager, routing
+
+def solve_routing_model(routing, time_limit_seconds=5):
+    """Solves a built model with the standard search strategy. Returns the solution or None."""
+    # Setting first solution heuristic.
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+    search_parameters.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+    search_parameters.time_limit.seconds = time_limit_seconds
+
+    return routing.SolveWithParameters(search_parameters)
+
+def summarize_solution(data, manager, routing, solution):
+    """Computes plan KPIs from a solution without persisting anything."""
+    time_dimension = routing.GetDimensionOrDie('Time')
+    vehicles_used = 0
+    orders_assigned = 0
+    travel_minutes = 0
+    route_minutes = 0
+    latest_return = 0
+
+    for vehicle_id in range(data['num_vehicles']):
+        index = routing.Start(vehicle_id)
+        if routing.IsEnd(solution.Value(routing.NextVar(index))):
+            continue
+        vehicles_used += 1
+        time_matrix = data['time_matrices'][data['vehicle_profiles'][vehicle_id]]
+        start_min = solution.Min(time_dimension.CumulVar(index))
+        while not routing.IsEnd(index):
+            next_index = solution.Value(routing.NextVar(index))
+            travel_minutes += time_matrix[manager.IndexToNode(index)][manager.IndexToNode(next_index)]
+            if manager.IndexToNode(index) != 0:
+                orders_assigned += 1
+            index = next_index
+        end_min = solution.Min(time_dimension.CumulVar(index))
+        route_minutes += end_min - start_min
+        latest_return = max(latest_return, end_min)
+
+    orders_total = data['num_locations'] - 1
+    return {
+        "orders_total": orders_total,
+        "orders_assigned": orders_assigned,
+        "orders_dropped": orders_total - orders_assigned,
+        "vehicles_available": data['num_vehicles'],
+        "vehicles_used": vehicles_used,
+        "total_travel_minutes": int(travel_minutes),
+        "total_route_minutes": int(route_minutes),
+        "latest_return_minutes": int(latest_return),
+        "objective": solution.ObjectiveValue()
+    }
+
+def run_optimization(planned_date=None, profiler=NULL_PROFILER):
+    """
+    Main function to fetch data, build model, and solve the routing problem.
+    profiler: optional RunProfiler; each phase is timed inside it
+    """
     import traceback
     try:
         if planned_date is None:
@@ -171,7 +340,7 @@ def run_optimization(planned_date=None):
         elif isinstance(planned_date, str):
             planned_date = datetime.strptime(planned_date, "%Y-%m-%d").date()
 
-        orders, drivers, depot_location = get_data_from_db(planned_date=planned_date)
+        orders, drivers, depot_location = get_data_from_db(planned_date=planned_date, profiler=profiler)
         if orders.empty:
             logger.warning("No pending orders found for optimization.")
             return {"status": "error", "message": "No pending orders found"}
@@ -181,76 +350,42 @@ def run_optimization(planned_date=None):
 
         logger.info(f"Starting optimization for {len(orders)} orders and {len(drivers)} drivers for date {planned_date}.")
 
-        data = create_data_model(orders, drivers, depot_location)
-        manager = pywrapcp.RoutingIndexManager(data['num_locations'], data['num_vehicles'], data['depot'])
-        routing = pywrapcp.RoutingModel(manager)
-
-        def time_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            travel_time = data['time_matrix'][from_node][to_node]
-            if from_node == 0:
-                return int(travel_time)
-            return int(travel_time + data['service_time'])
-
-        transit_callback_index = routing.RegisterTransitCallback(time_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-        routing.AddDimension(
-            transit_callback_index,
-            30,  # allow waiting time
-            1440, # maximum time per vehicle
-            False, # start cumul to zero
-            'Time'
-        )
-        time_dimension = routing.GetDimensionOrDie('Time')
-        for location_idx, time_window in enumerate(data['time_windows']):
-            if location_idx == 0: continue
-            index = manager.NodeToIndex(location_idx)
-            time_dimension.CumulVar(index).SetRange(int(time_window[0]), int(time_window[1]))
-
-        # 1. Capacity Constraints (Weight)
-        def weight_callback(from_index):
-            node = manager.IndexToNode(from_index)
-            return int(data['demands_weight'][node])
-        
-        weight_callback_index = routing.RegisterUnaryTransitCallback(weight_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            weight_callback_index, 0, data['vehicle_capacities_weight'], True, 'Weight'
-        )
-
-        # 2. Capacity Constraints (Volume)
-        def volume_callback(from_index):
-            node = manager.IndexToNode(from_index)
-            return int(data['demands_volume'][node])
-        
-        volume_callback_index = routing.RegisterUnaryTransitCallback(volume_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            volume_callback_index, 0, data['vehicle_capacities_volume'], True, 'Volume'
-        )
-
-        penalty = 10000
-        for node in range(1, data['num_locations']):
-            routing.AddDisjunction([int(manager.NodeToIndex(node))], int(penalty))
-
-        # Setting first solution heuristic.
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-        search_parameters.time_limit.seconds = 5
-
-        solution = routing.SolveWithParameters(search_parameters)
+        # Large days are solved on approximate matrices; only the used arcs go to OSRM
+        approximate = len(orders) + 1 > ROUTING_SETTINGS.get("approximate_matrix_above", 3000)
+        data = create_data_model(orders, drivers, depot_location, approximate=approximate, profiler=profiler)
+        with profiler.phase("model build"):
+            manager, routing = build_routing_model(data, profiler=profiler)
+        with profiler.phase("solve"):
+            solution = solve_routing_model(routing, run_limits()[1])
 
         if solution:
-            return save_solution(data, manager, routing, solution, drivers, orders, planned_date)
+            with profiler.phase("persist"):
+                return save_solution(data, manager, routing, solution, drivers, orders, planned_date)
         else:
             return {"status": "error", "message": "No solution found"}
     except Exception as e:
         traceback.print_exc()
         return {"status": "error", "message": str(e)}
 
+def route_arrivals_for(data, vehicle_id, nodes, start_min):
+    """
+    Arrival minutes for nodes[1:] of one vehicle's route. Routes solved on an
+    approximate matrix are re-timed with exact OSRM durations between their own stops.
+    """
+    profile = data['vehicle_profiles'][vehicle_id]
+    if data.get('approximate'):
+        exact = MATRIX_CACHE.get_matrix([data['locations'][n] for n in nodes], profile=profile)
+        if exact is not None:
+            return route_arrivals(
+                list(range(len(nodes))), exact, [data['time_windows'][n] for n in nodes], start_min,
+                data['day_start_minute'], data['service_time'], data['slice_multipliers']
+            )
+        logger.warning("Exact route legs unavailable, keeping approximate ETAs.")
+    return route_arrivals(
+        nodes, data['base_time_matrices'][profile], data['time_windows'], start_min,
+        data['day_start_minute'], data['service_time'], data['slice_multipliers']
+    )
+
 def save_solution(data, manager, routing, solution, drivers, orders, planned_date):
     time_dimension = routing.GetDimensionOrDie('Time')
     base_time = datetime.combine(planned_date, datetime.min.time()).replace(hour=8, minute=0, second=0, microsecond=0)
@@ -278,12 +413,18 @@ def save_solution(data, manager, routing, solution, drivers, orders, planned_dat
         routes_created += 1
         logger.info(f"Created route {route_id} for driver {driver['full_name']}")
         
-        seq = 0
+        nodes = []
         while not routing.IsEnd(index):
-            node = manager.IndexToNode(index)
+            nodes.append(manager.IndexToNode(index))
+            index = solution.Value(routing.NextVar(index))
+
+        # Re-time the fixed sequence with the travel profile of every actual departure
+        start_min = solution.Min(time_dimension.CumulVar(routing.Start(vehicle_id)))
+        arrivals = route_arrivals_for(data, vehicle_id, nodes, start_min)
+
+        for seq, node in enumerate(nodes):
             if node != 0:
-                arr_min = solution.Min(time_dimension.CumulVar(index))
-                est_arrival = base_time + timedelta(minutes=arr_min)
+                est_arrival = base_time + timedelta(minutes=arrivals[seq - 1])
                 order = orders.iloc[node-1]
                 
                 cur.execute(
@@ -294,9 +435,6 @@ def save_solution(data, manager, routing, solution, drivers, orders, planned_dat
                 cur.execute("UPDATE orders SET status = 'ASSIGNED' WHERE id = %s", (order['id'],))
                 stops_created += 1
 
-            index = solution.Value(routing.NextVar(index))
-            seq += 1
-
     conn.commit()
     cur.close()
     conn.close()
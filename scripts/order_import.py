@@ -0,0 +1,292 @@
+"""
+Bulk order import from CSV or NDJSON.
+
+Rows are parsed and validated one at a time as the upload is read, and valid
+rows are written with COPY into a temporary staging table in batches, so
+memory stays flat however large the feed is. One INSERT ... ON CONFLICT then
+moves the staged rows into orders, keyed on external_order_id:
+  - new ids are inserted as PENDING orders,
+  - existing PENDING orders are updated where a field changed,
+  - orders already routed or finished are left alone and counted as locked.
+Re-importing the same file is therefore a no-op. When an id appears more than
+once in a file, its last row wins.
+
+Invalid rows are skipped and reported by line number; they never abort the
+rows around them.
+
+Accepted fields (CSV header or NDJSON keys; others are ignored):
+    external_order_id, delivery_address, lat, lng              required
+    customer_id, weight, volume, priority, contact_person,
+    contact_mobile, time_window_start, time_window_end          optional (ISO 8601 times)
+"""
+import io
+import csv
+import json
+import math
+import time
+from datetime import datetime
+import psycopg2
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+
+DB_PARAMS = get_db_params()
+
+IMPORT_SETTINGS = CONFIG.get("order_import", {})
+FORMATS = ("csv", "ndjson")
+
+REQUIRED_FIELDS = ("external_order_id", "delivery_address", "lat", "lng")
+# Column order of the staging table and the COPY stream
+COLUMNS = (
+    "external_order_id", "customer_id", "delivery_address", "lat", "lng", "weight", "volume",
+    "time_window_start", "time_window_end", "priority", "contact_person", "contact_mobile",
+)
+TEXT_LIMITS = {
+    "external_order_id": 50, "customer_id": 50, "delivery_address": None,
+    "contact_person": 100, "contact_mobile": 20,
+}
+
+STAGING_SQL = """
+    CREATE TEMP TABLE order_import_staging (
+        line_no INTEGER NOT NULL,
+        external_order_id VARCHAR(50) NOT NULL,
+        customer_id VARCHAR(50),
+        delivery_address TEXT NOT NULL,
+        lat FLOAT NOT NULL,
+        lng FLOAT NOT NULL,
+        weight FLOAT,
+        volume FLOAT,
+        time_window_start TIMESTAMP WITH TIME ZONE,
+        time_window_end TIMESTAMP WITH TIME ZONE,
+        priority INTEGER,
+        contact_person VARCHAR(100),
+        contact_mobile VARCHAR(20)
+    ) ON COMMIT DROP
+"""
+
+UPSERT_SQL = f"""
+    WITH upserted AS (
+        INSERT INTO orders ({', '.join(COLUMNS)})
+        SELECT DISTINCT ON (external_order_id) {', '.join(COLUMNS)}
+        FROM order_import_staging
+        ORDER BY external_order_id, line_no DESC
+        ON CONFLICT (external_order_id) DO UPDATE
+        SET {', '.join(f"{c} = EXCLUDED.{c}" for c in COLUMNS[1:])}
+        WHERE orders.status = 'PENDING'
+        AND ({', '.join(f"orders.{c}" for c in COLUMNS[1:])})
+            IS DISTINCT FROM ({', '.join(f"EXCLUDED.{c}" for c in COLUMNS[1:])})
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT COUNT(*) FILTER (WHERE inserted) AS inserted,
+           COUNT(*) FILTER (WHERE NOT inserted) AS updated
+    FROM upserted
+"""
+
+
+def detect_format(filename=None, content_type=None):
+    """csv or ndjson from the upload's name or content type, None if neither says."""
+    name = (filename or "").lower()
+    content_type = (content_type or "").lower()
+    if name.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    return None
+
+
+def iter_rows(stream, fmt):
+    """Yields (line number, raw dict or parse error message) from a binary upload stream."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        missing = [f for f in REQUIRED_FIELDS if f not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, f"invalid JSON: {e}"
+            continue
+        yield line_no, row if isinstance(row, dict) else "expected a JSON object"
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _text(raw, field):
+    value = raw.get(field)
+    if _blank(value):
+        return None
+    value = str(value).strip()
+    if "\x00" in value:
+        raise ValueError(f"{field} contains a NUL character")
+    limit = TEXT_LIMITS[field]
+    if limit and len(value) > limit:
+        raise ValueError(f"{field} is longer than {limit} characters")
+    return value
+
+
+def _number(raw, field, cast=float, default=None, low=None, high=None):
+    value = raw.get(field)
+    if _blank(value):
+        return default
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} is not a valid number: {value!r}")
+    if cast is float and not math.isfinite(number):
+        raise ValueError(f"{field} must be finite")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise ValueError(f"{field} must be between {low} and {high}")
+    return number
+
+
+def _timestamp(raw, field):
+    value = raw.get(field)
+    if _blank(value):
+        return None
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{field} is not an ISO 8601 timestamp: {value!r}")
+
+
+def validate_row(raw):
+    """Returns the row as a tuple in COLUMNS order. Raises ValueError naming the first problem."""
+    for field in REQUIRED_FIELDS:
+        if _blank(raw.get(field)):
+            raise ValueError(f"{field} is required")
+    row = {
+        "external_order_id": _text(raw, "external_order_id"),
+        "customer_id": _text(raw, "customer_id"),
+        "delivery_address": _text(raw, "delivery_address"),
+        "lat": _number(raw, "lat", low=-90, high=90),
+        "lng": _number(raw, "lng", low=-180, high=180),
+        "weight": _number(raw, "weight", default=0.0, low=0),
+        "volume": _number(raw, "volume", default=0.0, low=0),
+        "time_window_start": _timestamp(raw, "time_window_start"),
+        "time_window_end": _timestamp(raw, "time_window_end"),
+        "priority": _number(raw, "priority", cast=int, default=1),
+        "contact_person": _text(raw, "contact_person"),
+        "contact_mobile": _text(raw, "contact_mobile"),
+    }
+    start, end = row["time_window_start"], row["time_window_end"]
+    if start and end:
+        if (start.tzinfo is None) != (end.tzinfo is None):
+            raise ValueError("time_window_start and time_window_end must both have or both lack a UTC offset")
+        if end <= start:
+            raise ValueError("time_window_end must be after time_window_start")
+    return tuple(row[c] for c in COLUMNS)
+
+
+def _copy_value(value):
+    """One field in COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, float):
+        value = repr(value)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_batch(cur, batch):
+    data = io.StringIO()
+    for line_no, row in batch:
+        data.write(f"{line_no}\t" + "\t".join(_copy_value(v) for v in row) + "\n")
+    data.seek(0)
+    cur.copy_expert(f"COPY order_import_staging (line_no, {', '.join(COLUMNS)}) FROM STDIN", data)
+
+
+def import_orders(stream, fmt, batch_rows=None, max_reported_errors=None):
+    """
+    Validates and upserts every order in a CSV or NDJSON stream in one transaction.
+    Returns: status dict with counts and the first max_reported_errors row errors.
+    """
+    if fmt not in FORMATS:
+        return {
+            "status": "error", "message": f"Unsupported format {fmt!r}; use one of {', '.join(FORMATS)}",
+            "rows": 0, "invalid_upload": True
+        }
+    batch_rows = batch_rows or IMPORT_SETTINGS.get("copy_batch_rows", 5000)
+    max_reported_errors = max_reported_errors or IMPORT_SETTINGS.get("max_reported_errors", 1000)
+
+    started = time.perf_counter()
+    rows = staged = error_count = 0
+    errors = []
+    conn = None
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        cur.execute(STAGING_SQL)
+
+        batch = []
+        for line_no, raw in iter_rows(stream, fmt):
+            rows += 1
+            try:
+                if isinstance(raw, str):
+                    raise ValueError(raw)
+                batch.append((line_no, validate_row(raw)))
+            except ValueError as e:
+                error_count += 1
+                if len(errors) < max_reported_errors:
+                    external_id = raw.get("external_order_id") if isinstance(raw, dict) else None
+                    errors.append({"line": line_no, "external_order_id": external_id, "error": str(e)})
+                continue
+            if len(batch) >= batch_rows:
+                _copy_batch(cur, batch)
+                staged += len(batch)
+                batch = []
+        if batch:
+            _copy_batch(cur, batch)
+            staged += len(batch)
+
+        cur.execute("ANALYZE order_import_staging")
+        cur.execute("SELECT COUNT(DISTINCT external_order_id) FROM order_import_staging")
+        distinct_ids = cur.fetchone()[0]
+        cur.execute("""
+            SELECT COUNT(*) FROM orders o
+            WHERE o.status <> 'PENDING'
+            AND o.external_order_id IN (SELECT external_order_id FROM order_import_staging)
+        """)
+        locked = cur.fetchone()[0]
+        cur.execute(UPSERT_SQL)
+        inserted, updated = cur.fetchone()
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        if conn is not None:
+            conn.rollback()
+        logger.error(f"Order import failed after {rows} rows: {e}")
+        # ValueError here is the file itself (missing CSV header, not UTF-8), not the database
+        return {"status": "error", "message": str(e), "rows": rows, "invalid_upload": isinstance(e, ValueError)}
+    finally:
+        if conn is not None:
+            conn.close()
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(
+        f"Imported {rows} {fmt} rows in {elapsed_ms:.0f} ms: "
+        f"{inserted} inserted, {updated} updated, {error_count} rejected."
+    )
+    return {
+        "status": "success",
+        "rows": rows,
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": distinct_ids - inserted - updated - locked,
+        "locked": locked,
+        "duplicates": staged - distinct_ids,
+        "rejected": error_count,
+        "errors": errors,
+        "errors_truncated": error_count > len(errors),
+        "elapsed_ms": round(elapsed_ms, 1),
+    }
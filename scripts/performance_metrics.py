@@ -0,0 +1,224 @@
+"""
+Incremental performance_metrics from delivery events.
+
+route_stops.updated_at is bumped by a trigger on every write. Each pass reads
+the high-water mark from pipeline_watermarks, finds the (driver, planned date)
+pairs whose stops changed since then, recomputes just those days from
+route_stops and upserts them into performance_metrics. A day is always
+recomputed whole, so re-processing it is harmless; the pass therefore starts a
+few minutes before the mark to pick up transactions that committed late.
+
+The same pass keeps the analytics rollups current: every day, week and month
+bucket that contains a rewritten driver-day is recomputed from
+performance_metrics, per driver and fleet-wide. Buckets hold sums and counts
+rather than averages, so they can be recomputed or combined exactly and the
+analytics endpoints read a handful of rows whatever the history length.
+"""
+import psycopg2
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+
+DB_PARAMS = get_db_params()
+
+METRICS_SETTINGS = CONFIG.get("performance_metrics", {})
+WATERMARK_NAME = "performance_metrics"
+
+UPSERT_METRICS_SQL = """
+    WITH changed AS (
+        SELECT DISTINCT r.driver_id, r.planned_date
+        FROM route_stops rs
+        JOIN routes r ON rs.route_id = r.id
+        WHERE rs.updated_at > %(since)s AND rs.updated_at <= %(cutoff)s
+        AND r.driver_id IS NOT NULL
+        AND r.planned_date <= CURRENT_DATE
+    ),
+    day_stops AS (
+        SELECT c.driver_id, c.planned_date, rs.status,
+               rs.estimated_arrival_time, rs.actual_arrival_time, rs.actual_departure_time
+        FROM changed c
+        JOIN routes r ON r.driver_id = c.driver_id AND r.planned_date = c.planned_date
+        JOIN route_stops rs ON rs.route_id = r.id
+    ),
+    days AS (
+        SELECT driver_id, planned_date,
+               COUNT(*) FILTER (WHERE status = 'DELIVERED') AS completed,
+               COUNT(*) FILTER (WHERE status IN ('DELIVERED', 'FAILED')) AS finished,
+               -- Arrival comes from the location geofence; a stop without one has arrival = departure
+               AVG(EXTRACT(EPOCH FROM actual_departure_time - actual_arrival_time) / 60)
+                   FILTER (WHERE actual_departure_time > actual_arrival_time) AS avg_service,
+               SUM(GREATEST(0, EXTRACT(EPOCH FROM actual_arrival_time - estimated_arrival_time) / 60))
+                   FILTER (WHERE actual_arrival_time IS NOT NULL AND estimated_arrival_time IS NOT NULL) AS delay,
+               AVG(CASE WHEN actual_arrival_time <= estimated_arrival_time + %(grace)s * INTERVAL '1 minute'
+                        THEN 1.0 ELSE 0.0 END)
+                   FILTER (WHERE actual_arrival_time IS NOT NULL AND estimated_arrival_time IS NOT NULL) AS on_time
+        FROM day_stops
+        GROUP BY driver_id, planned_date
+    )
+    INSERT INTO performance_metrics
+        (driver_id, date, total_orders_completed, average_service_time, total_delay_minutes, efficiency_score)
+    SELECT driver_id, planned_date, completed,
+           ROUND(avg_service)::int,
+           ROUND(COALESCE(delay, 0))::int,
+           -- share of finished stops delivered, weighted by on-time arrival
+           completed::float / finished * COALESCE(on_time, 1.0)
+    FROM days
+    WHERE finished > 0
+    ON CONFLICT (driver_id, date) DO UPDATE SET
+        total_orders_completed = EXCLUDED.total_orders_completed,
+        average_service_time = EXCLUDED.average_service_time,
+        total_delay_minutes = EXCLUDED.total_delay_minutes,
+        efficiency_score = EXCLUDED.efficiency_score
+    RETURNING driver_id, date
+"""
+
+ROLLUP_GRANULARITIES = ("day", "week", "month")
+
+ROLLUP_COLUMNS_SQL = """
+    COUNT(*), SUM(pm.total_orders_completed),
+    SUM(pm.average_service_time), COUNT(pm.average_service_time),
+    SUM(pm.total_delay_minutes),
+    SUM(pm.efficiency_score), COUNT(pm.efficiency_score)
+"""
+ROLLUP_UPDATE_SQL = """
+    days = EXCLUDED.days,
+    total_completed = EXCLUDED.total_completed,
+    service_time_sum = EXCLUDED.service_time_sum,
+    service_time_days = EXCLUDED.service_time_days,
+    delay_minutes = EXCLUDED.delay_minutes,
+    efficiency_sum = EXCLUDED.efficiency_sum,
+    efficiency_days = EXCLUDED.efficiency_days,
+    updated_at = NOW()
+"""
+
+# {source} yields the (driver_id, day) pairs whose buckets are recomputed
+REFRESH_ROLLUPS_SQL = f"""
+    WITH changed AS (
+        SELECT DISTINCT c.driver_id, g.granularity, date_trunc(g.granularity, c.day)::date AS period_start
+        FROM ({{source}}) AS c(driver_id, day)
+        CROSS JOIN unnest(%(granularities)s::text[]) AS g(granularity)
+    ),
+    driver_rows AS (
+        INSERT INTO driver_performance_rollups
+            (driver_id, granularity, period_start, days, total_completed, service_time_sum,
+             service_time_days, delay_minutes, efficiency_sum, efficiency_days)
+        SELECT ch.driver_id, ch.granularity, ch.period_start, {ROLLUP_COLUMNS_SQL}
+        FROM changed ch
+        JOIN performance_metrics pm ON pm.driver_id = ch.driver_id
+            AND pm.date >= ch.period_start
+            AND pm.date < ch.period_start + ('1 ' || ch.granularity)::interval
+        GROUP BY ch.driver_id, ch.granularity, ch.period_start
+        ON CONFLICT (driver_id, granularity, period_start) DO UPDATE SET {ROLLUP_UPDATE_SQL}
+        RETURNING 1
+    ),
+    fleet_rows AS (
+        INSERT INTO fleet_performance_rollups
+            (granularity, period_start, days, total_completed, service_time_sum,
+             service_time_days, delay_minutes, efficiency_sum, efficiency_days)
+        SELECT p.granularity, p.period_start, {ROLLUP_COLUMNS_SQL}
+        FROM (SELECT DISTINCT granularity, period_start FROM changed) p
+        JOIN performance_metrics pm ON pm.date >= p.period_start
+            AND pm.date < p.period_start + ('1 ' || p.granularity)::interval
+        GROUP BY p.granularity, p.period_start
+        ON CONFLICT (granularity, period_start) DO UPDATE SET {ROLLUP_UPDATE_SQL}
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM driver_rows), (SELECT COUNT(*) FROM fleet_rows)
+"""
+
+
+def refresh_rollups(cur, driver_days):
+    """
+    Recomputes every rollup bucket containing one of the (driver_id, date) pairs.
+    Returns: (driver buckets written, fleet buckets written)
+    """
+    if not driver_days:
+        return 0, 0
+    cur.execute(
+        REFRESH_ROLLUPS_SQL.format(source="SELECT * FROM unnest(%(drivers)s::uuid[], %(days)s::date[])"),
+        {
+            "drivers": [str(driver_id) for driver_id, _ in driver_days],
+            "days": [day for _, day in driver_days],
+            "granularities": list(ROLLUP_GRANULARITIES),
+        }
+    )
+    return cur.fetchone()
+
+
+def rebuild_rollups(cur):
+    """Recomputes all rollups from performance_metrics (migration, or after writing metrics directly)."""
+    cur.execute("DELETE FROM driver_performance_rollups")
+    cur.execute("DELETE FROM fleet_performance_rollups")
+    cur.execute(
+        REFRESH_ROLLUPS_SQL.format(source="SELECT driver_id, date FROM performance_metrics"),
+        {"granularities": list(ROLLUP_GRANULARITIES)}
+    )
+    return cur.fetchone()
+
+
+def update_performance_metrics():
+    """
+    Processes route_stops changed since the last pass and upserts the affected days.
+    Returns: status dict with the number of driver-days written.
+    """
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+
+        # Serialize passes; a concurrent run simply waits and then finds nothing new
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (WATERMARK_NAME,))
+        cur.execute("SELECT high_water FROM pipeline_watermarks WHERE name = %s", (WATERMARK_NAME,))
+        row = cur.fetchone()
+        cur.execute("SELECT NOW()")
+        cutoff = cur.fetchone()[0]
+
+        if row:
+            cur.execute(
+                "SELECT %s::timestamptz - %s * INTERVAL '1 minute'",
+                (row[0], METRICS_SETTINGS.get("overlap_minutes", 10))
+            )
+        else:
+            # First pass backfills a bounded slice of history
+            cur.execute(
+                "SELECT NOW() - %s * INTERVAL '1 day'",
+                (METRICS_SETTINGS.get("backfill_days", 30),)
+            )
+        since = cur.fetchone()[0]
+
+        cur.execute(UPSERT_METRICS_SQL, {
+            "since": since,
+            "cutoff": cutoff,
+            "grace": METRICS_SETTINGS.get("on_time_grace_minutes", 15),
+        })
+        driver_days = cur.fetchall()
+        days_written = len(driver_days)
+        refresh_rollups(cur, driver_days)
+
+        cur.execute("""
+            INSERT INTO pipeline_watermarks (name, high_water, updated_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT (name) DO UPDATE SET high_water = EXCLUDED.high_water, updated_at = NOW()
+        """, (WATERMARK_NAME, cutoff))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+        if days_written:
+            logger.info(f"Performance metrics updated for {days_written} driver-days (changes since {since}).")
+        return {"status": "success", "driver_days_updated": days_written, "high_water": str(cutoff)}
+    except Exception as e:
+        logger.error(f"Performance metrics update failed: {e}")
+        return {"status": "error", "message": str(e)}
+
+
+if __name__ == "__main__":
+    import sys
+    if "--rebuild-rollups" in sys.argv:
+        # After metrics were written outside this pipeline (e.g. scripts/seed_performance.py)
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        print(rebuild_rollups(cur))
+        conn.commit()
+        conn.close()
+    else:
+        print(update_performance_metrics())
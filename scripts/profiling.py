@@ -0,0 +1,208 @@
+"""
+Phase timing and memory instrumentation for optimizer runs.
+
+A RunProfiler is passed through run_optimization and opened around each phase
+(period lookup, order/driver fetch, matrix, model build, callback registration,
+solve, persist). Every phase records wall time, the tracemalloc peak of Python
+allocations and the process RSS, which also covers OR-Tools' native memory.
+Finished phases are handed to the registered hooks (the logger by default);
+the full report goes into the run result. A cProfile dump of the whole run can
+be written for download from /admin/profiles/{profile_id}.
+
+Profiling is opt-in per run: tracemalloc slows allocation-heavy Python code,
+so runs without it get NULL_PROFILER, whose phases cost nothing.
+"""
+import os
+import re
+import time
+import uuid
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from api.logger_config import logger
+from api.config_loader import CONFIG
+
+try:
+    import psutil
+except ImportError:  # optional, falls back to the resource module
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PROFILING_SETTINGS = CONFIG.get("profiling", {})
+PROFILE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    PROFILING_SETTINGS.get("dump_dir", "api/logs/profiles")
+)
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_hooks = []
+# tracemalloc and cProfile are process-wide, so only one profiled run at a time
+_active_run = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profiled run is in progress."""
+
+
+def add_profiling_hook(callback):
+    """Registers callback(run_name, phase_record), called as each phase finishes."""
+    _hooks.append(callback)
+
+
+def remove_profiling_hook(callback):
+    if callback in _hooks:
+        _hooks.remove(callback)
+
+
+def log_phase(run_name, record):
+    peak = f", peak {record['peak_kb']} KB" if record.get('peak_kb') is not None else ""
+    rss = f", rss {record['rss_mb']} MB" if record.get('rss_mb') is not None else ""
+    logger.info(f"[{run_name}] {record['name']}: {record['ms']} ms{peak}{rss}")
+
+
+add_profiling_hook(log_phase)
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB, or None if it cannot be read."""
+    if psutil is not None:
+        return round(psutil.Process().memory_info().rss / 1048576, 1)
+    if resource is not None:
+        # ru_maxrss is the high-water mark (KB on Linux), the best the stdlib offers
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return None
+
+
+class RunProfiler:
+    """Collects per-phase timings and memory for one run. Phases may nest."""
+
+    def __init__(self, run_name, memory=None, cprofile=None):
+        self.run_name = run_name
+        self.profile_id = uuid.uuid4().hex
+        self.memory = PROFILING_SETTINGS.get("memory", True) if memory is None else memory
+        self.cprofile = PROFILING_SETTINGS.get("cprofile", False) if cprofile is None else cprofile
+        self.phases = []
+        self._stack = []
+        self._started = None
+        self._owns_tracemalloc = False
+        self._profile = None
+        self.dump_path = None
+
+    def start(self):
+        if not _active_run.acquire(blocking=False):
+            raise ProfilerBusy("Another profiled run is in progress")
+        self._started = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    @contextmanager
+    def phase(self, name):
+        if self._stack:
+            name = f"{self._stack[-1]['name']}/{name}"
+        if self.memory and tracemalloc.is_tracing():
+            if self._stack:
+                # Keep the enclosing phase's peak before resetting it for this one
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        entry = {'name': name, 'peak': 0, 'started': time.perf_counter()}
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            record = {'name': name, 'ms': round((time.perf_counter() - entry['started']) * 1000, 1)}
+            if self.memory and tracemalloc.is_tracing():
+                peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_kb'] = round(peak / 1024)
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            record['rss_mb'] = current_rss_mb()
+            self.phases.append(record)
+            for hook in list(_hooks):
+                try:
+                    hook(self.run_name, record)
+                except Exception as e:
+                    logger.warning(f"Profiling hook failed: {e}")
+
+    def stop(self):
+        """Ends the run and returns its report."""
+        try:
+            if self._profile is not None:
+                self._profile.disable()
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                self.dump_path = os.path.join(PROFILE_DIR, f"{self.profile_id}.prof")
+                self._profile.dump_stats(self.dump_path)
+                self._profile = None
+                prune_profile_dumps()
+            peaks = [p['peak_kb'] for p in self.phases if 'peak_kb' in p]
+            peak_kb = max(peaks) if peaks else None
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+                self._owns_tracemalloc = False
+        finally:
+            _active_run.release()
+        report = {
+            "run": self.run_name,
+            "total_ms": round((time.perf_counter() - self._started) * 1000, 1),
+            "peak_kb": peak_kb,
+            "rss_mb": current_rss_mb(),
+            "phases": self.phases,
+        }
+        if self.dump_path:
+            report["profile_id"] = self.profile_id
+            report["download"] = f"/admin/profiles/{self.profile_id}"
+        logger.info(f"[{self.run_name}] finished in {report['total_ms']} ms")
+        return report
+
+
+class NullProfiler:
+    """Stand-in used when a run is not profiled."""
+
+    def start(self):
+        return self
+
+    def phase(self, name):
+        return nullcontext()
+
+    def stop(self):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def profiling_requested(flag=None):
+    """A per-run query flag wins over the configured default."""
+    return PROFILING_SETTINGS.get("enabled", False) if flag is None else flag
+
+
+def profile_dump_path(profile_id):
+    """Path of a stored cProfile dump, or None if the id is malformed or unknown."""
+    if not PROFILE_ID_PATTERN.match(profile_id or ""):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+    return path if os.path.exists(path) else None
+
+
+def prune_profile_dumps():
+    """Keeps only the newest keep_dumps cProfile files."""
+    keep = PROFILING_SETTINGS.get("keep_dumps", 20)
+    dumps = sorted(
+        (os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith(".prof")),
+        key=os.path.getmtime
+    )
+    for path in dumps[:-keep]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,200 @@
+"""
+Road geometry for planned routes.
+
+Each leg's encoded polyline is fetched from OSRM /route once and cached per
+coordinate pair in route_leg_geometries, so legs shared between routes or days
+are never routed twice. A route stores its list of leg polylines in
+routes.geometry together with a key of its stop coordinates; when the stops
+are resequenced or edited the key no longer matches and the legs are looked
+up again (usually straight from the pair cache).
+
+A leg OSRM cannot route is cached too, as a row without a polyline and a
+retry_after time, so it is not asked for again on every request. The OSRM
+calls made for one request share a time budget (osrm_budget_seconds); legs
+left over when it runs out stay null for now. A route with null legs is still
+stored, with the time its geometry is worth rebuilding, and is served as
+stored until then.
+"""
+import time
+import hashlib
+import json
+import psycopg2
+import requests
+from psycopg2.extras import execute_values
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+from scripts.matrix_cache import coord_key, profile_server, DEFAULT_PROFILE
+
+DB_PARAMS = get_db_params()
+GEOMETRY_SETTINGS = CONFIG.get("route_geometry", {})
+
+
+def geometry_key(locations):
+    """Short digest of a route's coordinate sequence."""
+    raw = ";".join(f"{lat},{lng}" for lat, lng in locations)
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def fetch_leg_geometry(origin, destination, session=None, timeout=10):
+    """
+    Fetches one leg from OSRM /route, waiting at most timeout seconds.
+    Returns: (encoded polyline, distance in metres, duration in seconds) or None
+    """
+    server = profile_server(DEFAULT_PROFILE)
+    if server is None:
+        return None
+    osrm_host, osrm_port, osrm_profile = server
+    coords = f"{origin[1]},{origin[0]};{destination[1]},{destination[0]}"
+    url = f"http://{osrm_host}:{osrm_port}/route/v1/{osrm_profile}/{coords}?overview=full&geometries=polyline"
+    try:
+        response = (session or requests).get(url, timeout=timeout)
+        data = response.json()
+        if data['code'] != 'Ok' or not data.get('routes'):
+            logger.error(f"OSRM Route Error: {data.get('message', 'No route')}")
+            return None
+        route = data['routes'][0]
+        return route['geometry'], route['distance'], route['duration']
+    except Exception as e:
+        logger.error(f"Failed to fetch OSRM route geometry: {e}")
+        return None
+
+
+def get_leg_geometries(cur, legs):
+    """
+    Encoded polylines for (origin, destination) legs, from the pair cache or OSRM.
+    Newly fetched legs, and legs OSRM failed on, are written back to route_leg_geometries.
+    Returns: ({(origin key, destination key): (polyline, distance_m) or None for a failed leg},
+              epoch seconds after which the legs missing from it are worth asking for again, or None)
+    """
+    keys = list(dict.fromkeys((coord_key(*a), coord_key(*b)) for a, b in legs))
+    # Consecutive stops at one address need no routing
+    cached = {k: ("", 0.0) for k in keys if k[0] == k[1]}
+    keys = [k for k in keys if k[0] != k[1]]
+    if not keys:
+        return cached, None
+
+    retry_minutes = GEOMETRY_SETTINGS.get("failed_leg_retry_minutes", 60)
+    rows = execute_values(cur, """
+        SELECT g.from_lat, g.from_lng, g.to_lat, g.to_lng, g.polyline, g.distance_m,
+               EXTRACT(EPOCH FROM g.retry_after)
+        FROM route_leg_geometries g
+        JOIN (VALUES %s) AS v(from_lat, from_lng, to_lat, to_lng)
+          ON g.from_lat = v.from_lat AND g.from_lng = v.from_lng
+         AND g.to_lat = v.to_lat AND g.to_lng = v.to_lng
+        WHERE g.polyline IS NOT NULL OR g.retry_after > NOW()
+    """, [(a[0], a[1], b[0], b[1]) for a, b in keys], template="(%s::float, %s::float, %s::float, %s::float)", fetch=True)
+    retry_at = None
+    for r in rows:
+        key = ((r[0], r[1]), (r[2], r[3]))
+        if r[4] is None:
+            cached[key] = None
+            retry_at = min(retry_at or float(r[6]), float(r[6]))
+        else:
+            cached[key] = (r[4], r[5])
+
+    missing = [k for k in keys if k not in cached]
+    fetched, failed = [], []
+    if missing:
+        deadline = time.monotonic() + GEOMETRY_SETTINGS.get("osrm_budget_seconds", 15)
+        leg_timeout = GEOMETRY_SETTINGS.get("leg_timeout_seconds", 5)
+        with requests.Session() as session:
+            for a, b in missing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                leg = fetch_leg_geometry(a, b, session, timeout=min(leg_timeout, remaining))
+                if leg is None:
+                    cached[(a, b)] = None
+                    failed.append((a[0], a[1], b[0], b[1]))
+                    continue
+                cached[(a, b)] = (leg[0], leg[1])
+                fetched.append((a[0], a[1], b[0], b[1], leg[0], leg[1], leg[2]))
+        if len(fetched) + len(failed) < len(missing):
+            # Out of budget: the legs not tried yet are due on the next request
+            retry_at = time.time()
+            logger.warning(f"OSRM budget spent; {len(missing) - len(fetched) - len(failed)} legs left for later.")
+    if failed:
+        retry_at = min(retry_at or float("inf"), time.time() + retry_minutes * 60)
+        execute_values(cur, """
+            INSERT INTO route_leg_geometries (from_lat, from_lng, to_lat, to_lng, retry_after)
+            VALUES %s
+            ON CONFLICT (from_lat, from_lng, to_lat, to_lng) DO UPDATE
+            SET retry_after = EXCLUDED.retry_after
+            WHERE route_leg_geometries.polyline IS NULL
+        """, failed, template=f"(%s, %s, %s, %s, NOW() + INTERVAL '{int(retry_minutes)} minutes')")
+    if fetched:
+        execute_values(cur, """
+            INSERT INTO route_leg_geometries (from_lat, from_lng, to_lat, to_lng, polyline, distance_m, duration_s)
+            VALUES %s
+            ON CONFLICT (from_lat, from_lng, to_lat, to_lng) DO UPDATE
+            SET polyline = EXCLUDED.polyline, distance_m = EXCLUDED.distance_m,
+                duration_s = EXCLUDED.duration_s, retry_after = NULL
+        """, fetched)
+    if missing:
+        logger.info(
+            f"Fetched {len(fetched)} new leg geometries, {len(failed)} failed "
+            f"({len(keys) - len(missing)} cached)."
+        )
+    return cached, retry_at
+
+
+def attach_route_geometries(routes):
+    """
+    Adds a "geometry" list of encoded leg polylines (depot -> stop 1 -> ...) to
+    each route dict in place. Routes whose stored geometry still matches their
+    stops are served as stored; the rest are rebuilt and saved with the route.
+    A leg OSRM cannot route is left as null so the map can draw it straight;
+    such a partial geometry is stored as well and served until its retry_after.
+    """
+    if not routes:
+        return routes
+    conn = psycopg2.connect(**DB_PARAMS)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT lat, lng FROM warehouse WHERE is_default = TRUE LIMIT 1")
+        depot = cur.fetchone() or (1.2897, 103.8501)
+
+        route_ids = [str(r['route_id']) for r in routes]
+        cur.execute("SELECT id::text, geometry FROM routes WHERE id = ANY(%s::uuid[])", (route_ids,))
+        stored = dict(cur.fetchall())
+
+        stale = []
+        for route in routes:
+            locations = [tuple(depot)] + [(s['lat'], s['lng']) for s in route['stops']]
+            key = geometry_key(locations)
+            current = stored.get(str(route['route_id']))
+            if current and current.get('key') == key and current.get('retry_after', float("inf")) > time.time():
+                route['geometry'] = current['legs']
+            else:
+                stale.append((route, locations, key))
+
+        if stale:
+            legs = [leg for _, locations, _ in stale for leg in zip(locations, locations[1:])]
+            geometries, retry_at = get_leg_geometries(cur, legs)
+            updates = []
+            for route, locations, key in stale:
+                parts = [
+                    geometries.get((coord_key(*a), coord_key(*b))) for a, b in zip(locations, locations[1:])
+                ]
+                route['geometry'] = [p[0] if p else None for p in parts]
+                stored_geometry = {"key": key, "legs": route['geometry']}
+                distance_km = None
+                if all(parts):
+                    distance_km = sum(p[1] for p in parts) / 1000
+                else:
+                    stored_geometry["retry_after"] = retry_at if retry_at is not None else time.time()
+                updates.append((str(route['route_id']), json.dumps(stored_geometry), distance_km))
+            if updates:
+                execute_values(cur, """
+                    UPDATE routes AS r
+                    SET geometry = v.geometry,
+                        total_estimated_distance = COALESCE(v.distance, r.total_estimated_distance)
+                    FROM (VALUES %s) AS v(id, geometry, distance)
+                    WHERE r.id = v.id
+                """, updates, template="(%s::uuid, %s::jsonb, %s::float)")
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return routes
@@ -0,0 +1,222 @@
+"""
+Fast re-optimization of a single driver's remaining stops.
+
+Used when stops on a live route are cancelled or skipped. Every stop still to
+be served (ASSIGNED, PICKED_UP, or any other open status) is re-sequenced, as
+an open TSP with time windows that starts from the driver's current position,
+solved against cached matrix rows.
+"""
+import time
+from datetime import datetime, timedelta
+import psycopg2
+from psycopg2.extras import execute_values
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+from scripts.matrix_cache import MATRIX_CACHE, vehicle_profile
+from scripts.travel_profiles import get_slice_multipliers, departure_profile_matrix, route_arrivals
+
+DB_PARAMS = get_db_params()
+
+ROUTING_SETTINGS = CONFIG.get("routing", {})
+SERVICE_TIME = 10
+LATE_PENALTY = 1000  # per minute past time_window_end
+DONE_STATUSES = ('DELIVERED', 'FAILED')
+
+
+def get_start_location(cur, driver_lat, driver_lng):
+    """Driver's last known position, falling back to the default warehouse."""
+    if driver_lat is not None and driver_lng is not None:
+        return (driver_lat, driver_lng)
+    cur.execute("SELECT lat, lng FROM warehouse WHERE is_default = TRUE LIMIT 1")
+    row = cur.fetchone()
+    if row:
+        return (row[0], row[1])
+    return (1.2897, 103.8501)
+
+
+def solve_sequence(matrix, time_windows, time_limit_ms):
+    """
+    Solves an open TSP with soft time windows from node 0.
+    matrix: square travel-minute matrix, node 0 is the start position
+    time_windows: (start_min, end_min) per node, relative to the start time
+    Returns: (visit order of nodes 1..n-1, arrival minute per node)
+    """
+    manager = pywrapcp.RoutingIndexManager(len(matrix), 1, 0)
+    routing = pywrapcp.RoutingModel(manager)
+
+    def time_callback(from_index, to_index):
+        from_node = manager.IndexToNode(from_index)
+        to_node = manager.IndexToNode(to_index)
+        if to_node == 0:
+            return 0  # open route, no return leg
+        if from_node == 0:
+            return int(matrix[from_node][to_node])
+        return int(matrix[from_node][to_node] + SERVICE_TIME)
+
+    transit_callback_index = routing.RegisterTransitCallback(time_callback)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    routing.AddDimension(transit_callback_index, 1440, 2880, True, 'Time')
+    time_dimension = routing.GetDimensionOrDie('Time')
+
+    for node in range(1, len(matrix)):
+        start_min, end_min = time_windows[node]
+        index = manager.NodeToIndex(node)
+        time_dimension.CumulVar(index).SetMin(max(0, int(start_min)))
+        # Late arrival is penalized rather than forbidden: the driver may already be behind
+        time_dimension.SetCumulVarSoftUpperBound(index, max(0, int(end_min)), LATE_PENALTY)
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+    search_parameters.time_limit.FromMilliseconds(time_limit_ms)
+
+    solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return None, None
+
+    order, arrivals = [], {}
+    index = solution.Value(routing.NextVar(routing.Start(0)))
+    while not routing.IsEnd(index):
+        node = manager.IndexToNode(index)
+        order.append(node)
+        arrivals[node] = solution.Min(time_dimension.CumulVar(index))
+        index = solution.Value(routing.NextVar(index))
+    return order, arrivals
+
+
+def resequence_route(route_id, start_location=None):
+    """
+    Re-sequences the remaining stops of one route and rewrites
+    sequence_number / estimated_arrival_time for that route only.
+    Finished stops keep their order at the head, cancelled stops move to the tail;
+    every other stop is remaining work, so each stop on the route gets a new number.
+    """
+    started = time.perf_counter()
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+
+        cur.execute("""
+            SELECT r.planned_date, d.last_known_lat, d.last_known_lng, v.type
+            FROM routes r
+            JOIN drivers d ON r.driver_id = d.id
+            LEFT JOIN vehicles v ON v.id = COALESCE(r.vehicle_id, d.assigned_vehicle_id)
+            WHERE r.id = %s
+        """, (route_id,))
+        route = cur.fetchone()
+        if not route:
+            cur.close()
+            conn.close()
+            return {"status": "error", "message": "Route not found"}
+        planned_date, driver_lat, driver_lng, vehicle_type = route
+
+        if start_location is None:
+            start_location = get_start_location(cur, driver_lat, driver_lng)
+
+        cur.execute("""
+            SELECT rs.id, rs.status, o.lat, o.lng, o.time_window_start, o.time_window_end
+            FROM route_stops rs
+            JOIN orders o ON rs.order_id = o.id
+            WHERE rs.route_id = %s
+            ORDER BY rs.sequence_number
+        """, (route_id,))
+        stops = cur.fetchall()
+
+        done = [s for s in stops if s[1] in DONE_STATUSES]
+        cancelled = [s for s in stops if s[1] == 'CANCELLED']
+        pending = [s for s in stops if s[1] not in DONE_STATUSES and s[1] != 'CANCELLED']
+
+        base_time = max(
+            datetime.now().replace(second=0, microsecond=0),
+            datetime.combine(planned_date, datetime.min.time()).replace(hour=8)
+        )
+
+        time_windows = [(0, 1440)]
+        for stop in pending:
+            try:
+                start_min = int((stop[4].replace(tzinfo=None) - base_time).total_seconds() / 60)
+                end_min = int((stop[5].replace(tzinfo=None) - base_time).total_seconds() / 60)
+            except (AttributeError, TypeError):
+                start_min, end_min = 0, 1440
+            time_windows.append((start_min, end_min))
+
+        order, arrivals = list(range(1, len(pending) + 1)), {}
+        solve_ms = 0.0
+        if pending:
+            stop_locations = [(s[2], s[3]) for s in pending]
+            rows = MATRIX_CACHE.get_matrix(
+                [start_location] + stop_locations, stop_locations, profile=vehicle_profile(vehicle_type)
+            )
+            if rows is None:
+                cur.close()
+                conn.close()
+                return {"status": "error", "message": "Travel time matrix unavailable"}
+            # Column 0 (back to the start position) is never used by an open route
+            base_matrix = [[0] + row for row in rows]
+            day_start_minute = base_time.hour * 60 + base_time.minute
+            multipliers = get_slice_multipliers()
+            departures = [day_start_minute] + [
+                day_start_minute + max(0, (start + end) // 2) + SERVICE_TIME for start, end in time_windows[1:]
+            ]
+            matrix = departure_profile_matrix(base_matrix, departures, multipliers)
+
+            solve_started = time.perf_counter()
+            time_limit_ms = ROUTING_SETTINGS.get("resequence_time_limit_ms", 200)
+            order, _ = solve_sequence(matrix, time_windows, time_limit_ms)
+            solve_ms = (time.perf_counter() - solve_started) * 1000
+            if order is None:
+                cur.close()
+                conn.close()
+                return {"status": "error", "message": "No solution found"}
+            etas = route_arrivals(
+                [0] + order, base_matrix, time_windows, 0, day_start_minute, SERVICE_TIME, multipliers
+            )
+            arrivals = dict(zip(order, etas))
+
+        updates = []
+        seq = 1
+        for stop in done:
+            updates.append((stop[0], seq, None))
+            seq += 1
+        for node in order:
+            stop = pending[node - 1]
+            updates.append((stop[0], seq, base_time + timedelta(minutes=arrivals[node])))
+            seq += 1
+        for stop in cancelled:
+            updates.append((stop[0], seq, None))
+            seq += 1
+
+        if updates:
+            # Move sequence numbers out of the way first so UNIQUE(route_id, sequence_number) holds mid-update
+            cur.execute(
+                "UPDATE route_stops SET sequence_number = -sequence_number - 1 WHERE route_id = %s",
+                (route_id,)
+            )
+            execute_values(cur, """
+                UPDATE route_stops AS rs
+                SET sequence_number = v.seq,
+                    estimated_arrival_time = COALESCE(v.eta, rs.estimated_arrival_time)
+                FROM (VALUES %s) AS v(id, seq, eta)
+                WHERE rs.id = v.id
+            """, updates, template="(%s::uuid, %s, %s::timestamptz)")
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Resequenced {len(pending)} remaining stops on route {route_id} in {elapsed_ms:.1f} ms.")
+        return {
+            "status": "success",
+            "route_id": route_id,
+            "planned_date": str(planned_date),
+            "stops_resequenced": len(pending),
+            "solve_ms": round(solve_ms, 1),
+            "elapsed_ms": round(elapsed_ms, 1)
+        }
+    except Exception as e:
+        logger.error(f"Resequence Error for route {route_id}: {e}")
+        return {"status": "error", "message": str(e)}
@@ -0,0 +1,210 @@
+"""
+What-if scenario runs over a shared data model.
+
+The day's orders, roster and depot are read once, every scenario applies its
+overrides (extra vehicles, drivers off, capacities, depot, order subset) to a
+copy, and all scenarios are solved in parallel worker processes. The matrix
+cache is warmed once with the union of every scenario's locations, and nothing
+is written to `routes`.
+
+Added vehicles without explicit capacities get those of their vehicle_type in
+the fleet (the largest vehicle of that type). The solve time limit is capped
+at scenario_max_time_limit_seconds.
+"""
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+import psycopg2
+from api.logger_config import logger
+from api.config_loader import CONFIG
+from api.db_config import get_db_params
+from scripts.matrix_cache import MATRIX_CACHE, DEFAULT_PROFILE, vehicle_profile
+from scripts.optimizer_prototype import (
+    get_data_from_db, create_data_model, build_routing_model, solve_routing_model, summarize_solution
+)
+
+DB_PARAMS = get_db_params()
+
+ROUTING_SETTINGS = CONFIG.get("routing", {})
+
+_pool = None
+
+
+def get_scenario_pool():
+    # OR-Tools holds the GIL while solving, so scenarios need processes rather than threads.
+    # spawn avoids forking a process that already runs server threads.
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=ROUTING_SETTINGS.get("scenario_workers", 4),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def fleet_capacities():
+    """{vehicle type: (capacity_weight, capacity_volume)} of the largest vehicle of each type."""
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT type::text, MAX(capacity_weight), MAX(capacity_volume)
+            FROM vehicles
+            WHERE is_active = TRUE
+            GROUP BY type
+        """)
+        capacities = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+        cur.close()
+    finally:
+        conn.close()
+    return capacities
+
+
+def apply_overrides(orders, drivers, depot_location, scenario, type_capacities=None):
+    """
+    Returns (orders, drivers, depot) for a scenario without touching the shared inputs.
+    type_capacities: fleet_capacities(), used for added vehicles that give no capacities
+    Raises ValueError for an added vehicle type with no capacities given or known.
+    """
+    orders = orders.copy()
+    drivers = drivers.copy()
+
+    if scenario.get("order_ids"):
+        wanted = {str(o) for o in scenario["order_ids"]}
+        orders = orders[orders['id'].astype(str).isin(wanted)]
+
+    if scenario.get("remove_drivers"):
+        removed = {str(d) for d in scenario["remove_drivers"]}
+        drivers = drivers[~(drivers['id'].astype(str).isin(removed) | drivers['full_name'].isin(removed))]
+
+    for key, caps in (scenario.get("capacity_overrides") or {}).items():
+        match = (drivers['id'].astype(str) == str(key)) | (drivers['full_name'] == key)
+        for column in ('capacity_weight', 'capacity_volume'):
+            if caps.get(column) is not None:
+                drivers.loc[match, column] = caps[column]
+
+    extra_rows = []
+    for group in scenario.get("add_vehicles") or []:
+        label = group.get("label", "Extra Vehicle")
+        vehicle_type = str(group.get("vehicle_type", "VAN")).upper()
+        capacity_weight, capacity_volume = group.get("capacity_weight"), group.get("capacity_volume")
+        if capacity_weight is None or capacity_volume is None:
+            if vehicle_type not in (type_capacities or {}):
+                raise ValueError(
+                    f"No {vehicle_type} in the fleet to take capacities from; "
+                    f"give capacity_weight and capacity_volume for {label!r}"
+                )
+            fleet_weight, fleet_volume = type_capacities[vehicle_type]
+            capacity_weight = fleet_weight if capacity_weight is None else capacity_weight
+            capacity_volume = fleet_volume if capacity_volume is None else capacity_volume
+        for i in range(int(group.get("count", 1))):
+            extra_rows.append({
+                'id': f"scenario-{label}-{i + 1}",
+                'full_name': f"{label} {i + 1}",
+                'max_jobs_per_day': group.get("max_jobs_per_day", 20),
+                'capacity_weight': capacity_weight,
+                'capacity_volume': capacity_volume,
+                'vehicle_type': vehicle_type,
+            })
+    if extra_rows:
+        drivers = pd.concat([drivers, pd.DataFrame(extra_rows)], ignore_index=True)
+
+    depot = scenario.get("depot")
+    if depot:
+        depot_location = (float(depot["lat"]), float(depot["lng"]))
+
+    return orders.reset_index(drop=True), drivers.reset_index(drop=True), depot_location
+
+
+def solve_scenario(data, time_limit_seconds):
+    """Worker entry point: builds and solves one scenario's model, returns its KPIs."""
+    manager, routing = build_routing_model(data)
+    solution = solve_routing_model(routing, time_limit_seconds)
+    if not solution:
+        return None
+    return summarize_solution(data, manager, routing, solution)
+
+
+def run_scenarios(planned_date, scenarios, time_limit_seconds=None):
+    """
+    Solves a baseline plus each scenario in parallel and returns KPIs side by side.
+    scenarios: list of dicts with a name and any of order_ids, remove_drivers,
+               capacity_overrides, add_vehicles, depot
+    """
+    started = time.perf_counter()
+    try:
+        if planned_date is None:
+            planned_date = datetime.now().date()
+        elif isinstance(planned_date, str):
+            planned_date = datetime.strptime(planned_date, "%Y-%m-%d").date()
+        if time_limit_seconds is None:
+            time_limit_seconds = ROUTING_SETTINGS.get("scenario_time_limit_seconds", 5)
+        # Every scenario holds a worker process for the whole limit
+        time_limit_seconds = min(max(1, int(time_limit_seconds)), ROUTING_SETTINGS.get("scenario_max_time_limit_seconds", 30))
+
+        orders, drivers, depot_location = get_data_from_db(planned_date=planned_date)
+        runs = [{"name": "baseline"}] + list(scenarios)
+        type_capacities = fleet_capacities() if any(s.get("add_vehicles") for s in scenarios) else {}
+        inputs = [apply_overrides(orders, drivers, depot_location, s, type_capacities) for s in runs]
+
+        # Warm the cache once with every location any scenario can touch,
+        # unless previews run on approximate cell-cache matrices
+        approximate = ROUTING_SETTINGS.get("scenario_approximate_matrix", False)
+        all_locations = list(dict.fromkeys(
+            [depot for _, _, depot in inputs] + list(zip(orders['lat'], orders['lng']))
+        ))
+        profiles = {
+            vehicle_profile(t) for _, s_drivers, _ in inputs for t in s_drivers.get('vehicle_type', [])
+        } or {DEFAULT_PROFILE}
+        if len(all_locations) > 1 and not approximate:
+            for profile in profiles:
+                MATRIX_CACHE.get_matrix(all_locations, profile=profile)
+
+        pool = get_scenario_pool()
+        futures = []
+        for run, (s_orders, s_drivers, s_depot) in zip(runs, inputs):
+            if s_orders.empty or s_drivers.empty:
+                futures.append(None)
+                continue
+            data = create_data_model(s_orders, s_drivers, s_depot, approximate=approximate)
+            futures.append(pool.submit(solve_scenario, data, time_limit_seconds))
+
+        results = []
+        for run, future in zip(runs, futures):
+            entry = {"name": run.get("name", f"scenario {len(results)}")}
+            if future is None:
+                entry.update({"status": "error", "message": "No orders or drivers in scenario"})
+            else:
+                try:
+                    kpis = future.result()
+                    if kpis is None:
+                        entry.update({"status": "error", "message": "No solution found"})
+                    else:
+                        entry.update({"status": "success", "kpis": kpis})
+                except Exception as e:
+                    entry.update({"status": "error", "message": str(e)})
+            results.append(entry)
+
+        baseline = results[0].get("kpis")
+        if baseline:
+            for entry in results[1:]:
+                if "kpis" in entry:
+                    entry["delta_vs_baseline"] = {
+                        k: entry["kpis"][k] - baseline[k] for k in baseline
+                    }
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Solved {len(runs)} scenarios for {planned_date} in {elapsed_ms:.0f} ms.")
+        return {
+            "status": "success",
+            "date": str(planned_date),
+            "scenarios": results,
+            "approximate_matrix": approximate,
+            "time_limit_seconds": time_limit_seconds,
+            "elapsed_ms": round(elapsed_ms, 1)
+        }
+    except Exception as e:
+        logger.error(f"Scenario run failed: {e}")
+        return {"status": "error", "message": str(e)}
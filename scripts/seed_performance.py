@@ -48,7 +48,12 @@ def seed_performance():
                 cur.execute(
                     """INSERT INTO performance_metrics 
                        (driver_id, date, total_orders_completed, average_service_time, total_delay_minutes, efficiency_score) 
-                       VALUES (%s, %s, %s, %s, %s, %s)""",
+                       VALUES (%s, %s, %s, %s, %s, %s)
+                       ON CONFLICT (driver_id, date) DO UPDATE SET
+                           total_orders_completed = EXCLUDED.total_orders_completed,
+                           average_service_time = EXCLUDED.average_service_time,
+                           total_delay_minutes = EXCLUDED.total_delay_minutes,
+                           efficiency_score = EXCLUDED.efficiency_score""",
                     (driver_id, date, orders, avg_service, delay, efficiency)
                 )
 
@@ -0,0 +1,176 @@
+"""
+Offline travel-time estimator used when OSRM is unreachable.
+
+Durations are modelled as intercept + minutes_per_km * great-circle km, where
+minutes_per_km folds together road circuity and average speed. Both terms are
+fitted per area (a lat/lng grid cell around the origin) from the OSRM rows the
+matrix cache already holds, with a city-wide fit and the configured circuity
+and speed as fallbacks. Matrices are built with NumPy broadcasting in row
+chunks, so a 10k x 10k estimate stays within a few seconds.
+
+approximate_matrix() layers the geohash-cell cache on top: cell pairs OSRM has
+already answered use their mean duration, everything else the estimate.
+"""
+import threading
+import numpy as np
+from api.logger_config import logger
+from api.config_loader import CONFIG
+from scripts.matrix_cache import MATRIX_CACHE, DEFAULT_PROFILE, profile_server, profile_fallback
+from scripts.travel_profiles import haversine_km
+from scripts.cell_cache import CELL_CACHE, geohash_cells
+
+ESTIMATOR_SETTINGS = CONFIG.get("travel_estimator", {})
+UNREACHABLE_MINUTES = 9999 // 60
+
+
+def default_params():
+    """(intercept minutes, minutes per km) from the configured circuity and speed."""
+    circuity = ESTIMATOR_SETTINGS.get("default_circuity", 1.35)
+    speed_kmh = ESTIMATOR_SETTINGS.get("default_speed_kmh", 30.0)
+    return float(ESTIMATOR_SETTINGS.get("default_intercept_minutes", 2.0)), 60.0 * circuity / speed_kmh
+
+
+def area_keys(lat, lng):
+    """Grid cell of each coordinate; works element-wise on NumPy arrays."""
+    cell = ESTIMATOR_SETTINGS.get("area_cell_degrees", 0.1)
+    return np.floor(np.asarray(lat) / cell).astype(np.int64), np.floor(np.asarray(lng) / cell).astype(np.int64)
+
+
+def _fit_line(km, minutes):
+    """Least-squares intercept and slope, clipped to physically sensible values."""
+    slope, intercept = np.polyfit(km, minutes, 1)
+    return float(np.clip(intercept, 0.0, 15.0)), float(np.clip(slope, 0.5, 10.0))
+
+
+def fit_travel_model(profile=DEFAULT_PROFILE):
+    """
+    Fits per-area and city-wide (intercept, minutes_per_km) from cached OSRM durations.
+    Returns: {"global": params, "areas": {(lat cell, lng cell): params}, "samples": n}
+    """
+    min_samples = ESTIMATOR_SETTINGS.get("min_samples", 50)
+    origins, destinations, minutes = MATRIX_CACHE.samples(
+        profile, ESTIMATOR_SETTINGS.get("max_fit_samples", 200000)
+    )
+    model = {"global": default_params(), "areas": {}, "samples": 0}
+    if len(minutes) < min_samples:
+        return model
+
+    o = np.asarray(origins, dtype=np.float64)
+    d = np.asarray(destinations, dtype=np.float64)
+    minutes = np.asarray(minutes, dtype=np.float64)
+    km = haversine_km(o[:, 0], o[:, 1], d[:, 0], d[:, 1])
+    usable = (km > 0.2) & (minutes < UNREACHABLE_MINUTES)
+    if usable.sum() < min_samples:
+        return model
+
+    o, km, minutes = o[usable], km[usable], minutes[usable]
+    model["global"] = _fit_line(km, minutes)
+    model["samples"] = int(usable.sum())
+
+    lat_cells, lng_cells = area_keys(o[:, 0], o[:, 1])
+    cells = np.stack([lat_cells, lng_cells], axis=1)
+    unique, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    for n, cell in enumerate(unique):
+        members = inverse == n
+        if members.sum() >= min_samples and np.ptp(km[members]) > 1.0:
+            model["areas"][(int(cell[0]), int(cell[1]))] = _fit_line(km[members], minutes[members])
+    return model
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_travel_model(profile=DEFAULT_PROFILE):
+    """Fitted model for a profile, refitted whenever the matrix cache has gained rows."""
+    rows = MATRIX_CACHE.cached_row_count(profile)
+    with _models_lock:
+        cached = _models.get(profile)
+        if cached is not None and cached[0] == rows:
+            return cached[1]
+
+    model = fit_travel_model(profile)
+    logger.info(
+        f"Travel estimator ({profile}): {model['samples']} samples, {len(model['areas'])} areas, "
+        f"global {model['global'][1]:.2f} min/km + {model['global'][0]:.1f} min."
+    )
+    with _models_lock:
+        _models[profile] = (rows, model)
+    return model
+
+
+def served_profile(profile):
+    """
+    (profile, factor) whose OSRM durations stand in for a profile. Profiles without
+    their own server resolve to their fallback, like the matrix cache does.
+    """
+    factor = 1.0
+    while profile != DEFAULT_PROFILE and profile_server(profile) is None:
+        fallback, fallback_factor = profile_fallback(profile)
+        if fallback is None or fallback == profile:
+            break
+        profile, factor = fallback, factor * fallback_factor
+    return profile, factor
+
+
+def estimate_matrix(locations, profile=DEFAULT_PROFILE):
+    """
+    Estimated travel minutes between all locations.
+    locations: List of (lat, lng) tuples
+    Returns: len(locations) x len(locations) int32 NumPy array, zero diagonal
+    """
+    profile, factor = served_profile(profile)
+    model = get_travel_model(profile)
+    # float32 is plenty for minute-resolution estimates and halves the memory traffic
+    coords = np.asarray(locations, dtype=np.float32).reshape(-1, 2)
+    lat, lng = coords[:, 0], coords[:, 1]
+
+    intercept = np.full(len(coords), model["global"][0], dtype=np.float32)
+    per_km = np.full(len(coords), model["global"][1], dtype=np.float32)
+    if model["areas"]:
+        lat_cells, lng_cells = area_keys(lat, lng)
+        for n, cell in enumerate(zip(lat_cells.tolist(), lng_cells.tolist())):
+            params = model["areas"].get(cell)
+            if params is not None:
+                intercept[n], per_km[n] = params
+    intercept *= factor
+    per_km *= factor
+
+    matrix = np.empty((len(coords), len(coords)), dtype=np.int32)
+    chunk = ESTIMATOR_SETTINGS.get("chunk_rows", 1000)
+    for start in range(0, len(coords), chunk):
+        stop = min(start + chunk, len(coords))
+        km = haversine_km(lat[start:stop, None], lng[start:stop, None], lat[None, :], lng[None, :])
+        block = intercept[start:stop, None] + per_km[start:stop, None] * km
+        np.rint(block, out=block)
+        matrix[start:stop] = block
+    np.fill_diagonal(matrix, 0)
+    return matrix
+
+
+def approximate_matrix(locations, profile=DEFAULT_PROFILE):
+    """
+    Travel minutes served from the geohash-cell cache without calling OSRM.
+    Pairs inside one cell, or between cells OSRM has never been asked about,
+    come from the fitted estimator instead.
+    Returns: len(locations) x len(locations) int32 NumPy array, zero diagonal
+    """
+    served, factor = served_profile(profile)
+    matrix = estimate_matrix(locations, profile)
+    coords = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+    cells = geohash_cells(coords[:, 0], coords[:, 1])
+
+    hits = 0
+    chunk = ESTIMATOR_SETTINGS.get("chunk_rows", 1000)
+    for start in range(0, len(coords), chunk):
+        stop = min(start + chunk, len(coords))
+        means, found = CELL_CACHE.lookup(cells[start:stop, None], cells[None, :], served)
+        found &= cells[start:stop, None] != cells[None, :]
+        block = matrix[start:stop]
+        block[found] = np.rint(means[found] * factor)
+        hits += int(found.sum())
+
+    total = max(1, len(coords) * (len(coords) - 1))
+    logger.info(f"Approximate {profile} matrix: {hits / total:.0%} of arcs from the cell cache.")
+    return matrix
@@ -0,0 +1,165 @@
+"""
+Hour-of-day travel time profiles.
+
+The day is split into a few time slices, each with a multiplier on the static
+OSRM durations (configured in global_config.json, or learned from
+actual_arrival_time history and cached). A slice's matrix is the base matrix
+times its multiplier; the solver gets a single matrix where every arc is
+scaled by the slice of its estimated departure, so the transit callback stays
+a plain lookup. ETAs are then recomputed along each fixed route with the
+slice of every actual departure.
+"""
+import time
+import bisect
+import threading
+import numpy as np
+import psycopg2
+from api.logger_config import logger
+from api.db_config import get_db_params
+from api.config_loader import CONFIG
+
+DB_PARAMS = get_db_params()
+
+PROFILE_SETTINGS = CONFIG.get("travel_time_profiles", {})
+DEFAULT_SLICES = [
+    {"start": "00:00", "multiplier": 1.0},
+    {"start": "07:00", "multiplier": 1.3},
+    {"start": "10:00", "multiplier": 1.0},
+    {"start": "17:00", "multiplier": 1.3},
+    {"start": "20:00", "multiplier": 1.0},
+]
+
+
+def _to_minutes(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+SLICES = sorted(PROFILE_SETTINGS.get("slices", DEFAULT_SLICES), key=lambda s: _to_minutes(s["start"]))
+SLICE_STARTS = [_to_minutes(s["start"]) for s in SLICES]
+
+
+def slice_index(minute_of_day):
+    """Index of the time slice containing a minute of the day (wraps past midnight)."""
+    return max(0, bisect.bisect_right(SLICE_STARTS, int(minute_of_day) % 1440) - 1)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km; works element-wise on NumPy arrays."""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * np.arcsin(np.sqrt(a))
+
+
+def learn_slice_multipliers(configured):
+    """
+    Fits one multiplier per slice from completed stops. Each leg's pace is its actual
+    travel time (previous departure to arrival) per great-circle km; a slice's
+    multiplier is its median pace over the fastest slice's, which stands in for the
+    free-flow OSRM durations. Slices without enough samples keep their configured value.
+    """
+    history_days = PROFILE_SETTINGS.get("history_days", 28)
+    min_samples = PROFILE_SETTINGS.get("min_samples", 30)
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    cur = conn.cursor()
+    cur.execute("""
+        WITH legs AS (
+            SELECT rs.actual_arrival_time, o.lat, o.lng,
+                   LAG(COALESCE(rs.actual_departure_time, rs.actual_arrival_time)) OVER w AS prev_departure,
+                   LAG(o.lat) OVER w AS prev_lat,
+                   LAG(o.lng) OVER w AS prev_lng
+            FROM route_stops rs
+            JOIN routes r ON rs.route_id = r.id
+            JOIN orders o ON rs.order_id = o.id
+            WHERE r.planned_date >= CURRENT_DATE - %s
+            AND rs.actual_arrival_time IS NOT NULL
+            WINDOW w AS (PARTITION BY rs.route_id ORDER BY rs.sequence_number)
+        )
+        SELECT (EXTRACT(HOUR FROM prev_departure) * 60 + EXTRACT(MINUTE FROM prev_departure))::int,
+               EXTRACT(EPOCH FROM actual_arrival_time - prev_departure) / 60,
+               prev_lat, prev_lng, lat, lng
+        FROM legs
+        WHERE prev_departure IS NOT NULL
+    """, (history_days,))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    if not rows:
+        return list(configured)
+
+    legs = np.asarray(rows, dtype=np.float64)
+    km = haversine_km(legs[:, 2], legs[:, 3], legs[:, 4], legs[:, 5])
+    usable = (km > 0.2) & (legs[:, 1] > 0)
+    pace = legs[usable, 1] / km[usable]
+    slices = np.searchsorted(SLICE_STARTS, legs[usable, 0] % 1440, side='right') - 1
+
+    medians = {}
+    for s in range(len(SLICES)):
+        sample = pace[slices == s]
+        if len(sample) >= min_samples:
+            medians[s] = float(np.median(sample))
+    if len(medians) < 2:
+        return list(configured)
+
+    reference = min(medians.values())
+    learned = list(configured)
+    for s, median in medians.items():
+        learned[s] = float(np.clip(median / reference, 1.0, 3.0))
+    return learned
+
+
+_cached = {"multipliers": None, "expires": 0.0}
+_cache_lock = threading.Lock()
+
+
+def get_slice_multipliers():
+    """Per-slice multipliers, learned from history at most once per refresh interval."""
+    configured = [float(s.get("multiplier", 1.0)) for s in SLICES]
+    if not PROFILE_SETTINGS.get("enabled", True):
+        return [1.0] * len(SLICES)
+    if not PROFILE_SETTINGS.get("learn_from_history", True):
+        return configured
+
+    with _cache_lock:
+        if _cached["multipliers"] is not None and time.monotonic() < _cached["expires"]:
+            return _cached["multipliers"]
+
+    try:
+        multipliers = learn_slice_multipliers(configured)
+        logger.info(f"Travel time slice multipliers: {[round(m, 2) for m in multipliers]}")
+    except Exception as e:
+        logger.warning(f"Could not learn travel time profiles, using configured values: {e}")
+        multipliers = configured
+
+    with _cache_lock:
+        _cached["multipliers"] = multipliers
+        _cached["expires"] = time.monotonic() + PROFILE_SETTINGS.get("refresh_hours", 24) * 3600
+    return multipliers
+
+
+def departure_profile_matrix(base_matrix, departure_minutes, multipliers):
+    """
+    Scales each row i of the base matrix by the multiplier of the slice that
+    departure_minutes[i] (minute of day) falls into. Returns a list-of-lists matrix.
+    """
+    base = np.asarray(base_matrix, dtype=np.float64)
+    slices = np.searchsorted(SLICE_STARTS, np.asarray(departure_minutes) % 1440, side='right') - 1
+    row_factors = np.asarray(multipliers, dtype=np.float64)[np.maximum(slices, 0)]
+    return np.rint(base * row_factors[:, None]).astype(np.int64).tolist()
+
+
+def route_arrivals(nodes, base_matrix, time_windows, start_min, day_start_minute, service_time, multipliers):
+    """
+    Time-dependent arrival minutes along a fixed node sequence (nodes[0] is the start).
+    Each leg uses the slice of its actual departure; waiting for a window start is included.
+    """
+    arrivals = []
+    departure = start_min
+    for prev, node in zip(nodes, nodes[1:]):
+        travel = base_matrix[prev][node] * multipliers[slice_index(day_start_minute + departure)]
+        arrival = max(departure + travel, time_windows[node][0])
+        arrivals.append(int(round(arrival)))
+        departure = arrival + service_time
+    return arrivals
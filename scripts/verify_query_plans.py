@@ -0,0 +1,258 @@
+"""
+Query plan regression check for the hot API and optimizer queries.
+
+Seeds a production-sized synthetic dataset (about 200k orders, 60 days of
+routes for 500 drivers) inside a transaction, runs ANALYZE, then EXPLAINs
+every hot query. A query fails the check when its plan
+  - sequentially scans one of the large tables it is not expected to scan, or
+  - costs more than TOLERANCE times its recorded baseline.
+Nothing is executed beyond EXPLAIN and the transaction is always rolled back,
+so the check is safe to point at a development database that already has data.
+
+Usage:
+    python -m scripts.verify_query_plans                    # check against the baseline
+    python -m scripts.verify_query_plans --update-baseline  # record current costs
+    python -m scripts.verify_query_plans --no-seed          # plan against existing data only
+
+The baseline (query_plan_baseline.json) is committed next to this script. A
+check without one fails; record it with --update-baseline first.
+"""
+import os
+import sys
+import json
+import argparse
+from datetime import date, timedelta
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from api.db_config import get_db_params
+from api.async_db import HOT_QUERIES
+from api.risk_monitor import OPEN_STOPS_SQL
+from api.config_loader import CONFIG
+from api.queries import ORDERS_PAGE_SQL, ROUTES_WITH_STOPS_SQL, FLEET_ROLLUPS_SQL, DRIVER_ROLLUPS_SQL
+from scripts.optimizer_prototype import PENDING_ORDERS_SQL, PERIOD_LOOKUP_SQL, run_limits
+from scripts.data_model_loop import build_update_query
+from scripts.performance_metrics import rebuild_rollups
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "query_plan_baseline.json")
+LARGE_TABLES = {"orders", "routes", "route_stops", "performance_metrics"}
+TOLERANCE = 2.0
+
+SEED_DRIVERS = 500
+SEED_ORDERS = 200000
+SEED_DAYS = 60
+STOPS_PER_ROUTE = 6
+
+
+def seed(cur):
+    """Synthetic fleet: ~2% of orders PENDING, the rest spread over finished statuses."""
+    cur.execute("SELECT setseed(0.46)")
+    cur.execute("""
+        INSERT INTO vehicles (plate_number, type, capacity_weight, capacity_volume)
+        SELECT 'PLANCHECK-' || g, (ARRAY['BIKE', 'VAN', 'TRUCK'])[1 + g % 3]::vehicle_type, 500, 10
+        FROM generate_series(1, %s) g
+    """, (SEED_DRIVERS,))
+    cur.execute("""
+        INSERT INTO drivers (full_name, username, password_hash, assigned_vehicle_id)
+        SELECT 'Plan Check ' || g, 'plancheck_' || g, 'x',
+               (SELECT id FROM vehicles WHERE plate_number = 'PLANCHECK-' || g)
+        FROM generate_series(1, %s) g
+    """, (SEED_DRIVERS,))
+    cur.execute("""
+        INSERT INTO orders (external_order_id, delivery_address, lat, lng, weight, volume,
+                            time_window_start, time_window_end, status, created_at)
+        SELECT 'PLANCHECK-' || g, 'Synthetic address ' || g,
+               1.28 + random() * 0.15, 103.7 + random() * 0.25, random() * 20, random(),
+               ts, ts + INTERVAL '2 hours',
+               CASE WHEN random() < 0.02 THEN 'PENDING'
+                    ELSE (ARRAY['DELIVERED', 'DELIVERED', 'DELIVERED', 'FAILED', 'CANCELLED'])[1 + g % 5]
+               END::order_status,
+               ts - INTERVAL '1 day'
+        FROM (
+            SELECT g, CURRENT_DATE - (random() * %s)::int * INTERVAL '1 day' + INTERVAL '8 hours'
+                      + (random() * 600)::int * INTERVAL '1 minute' AS ts
+            FROM generate_series(1, %s) g
+        ) s
+    """, (SEED_DAYS, SEED_ORDERS))
+    cur.execute("""
+        INSERT INTO routes (driver_id, vehicle_id, planned_date, status)
+        SELECT d.id, d.assigned_vehicle_id, CURRENT_DATE - day, 'COMPLETED'
+        FROM drivers d CROSS JOIN generate_series(0, %s) day
+        WHERE d.username LIKE 'plancheck\\_%%'
+    """, (SEED_DAYS - 1,))
+    cur.execute("""
+        WITH r AS (
+            SELECT r.id, row_number() OVER (ORDER BY r.id) AS rn
+            FROM routes r JOIN drivers d ON d.id = r.driver_id
+            WHERE d.username LIKE 'plancheck\\_%%'
+        ),
+        o AS (
+            SELECT id, row_number() OVER (ORDER BY id) AS rn
+            FROM orders WHERE external_order_id LIKE 'PLANCHECK-%%'
+        )
+        INSERT INTO route_stops (route_id, order_id, sequence_number, estimated_arrival_time, status)
+        SELECT r.id, o.id, seq, CURRENT_DATE + INTERVAL '8 hours' + seq * INTERVAL '20 minutes',
+               CASE WHEN random() < 0.1 THEN 'ASSIGNED' ELSE 'DELIVERED' END::order_status
+        FROM r CROSS JOIN generate_series(1, %s) seq
+        JOIN o ON o.rn = (r.rn * %s + seq) %% %s + 1
+    """, (STOPS_PER_ROUTE, STOPS_PER_ROUTE, SEED_ORDERS))
+    cur.execute("""
+        INSERT INTO performance_metrics (driver_id, date, total_orders_completed,
+                                         average_service_time, total_delay_minutes, efficiency_score)
+        SELECT d.id, CURRENT_DATE - day, 10 + (random() * 20)::int, 5 + (random() * 10)::int,
+               (random() * 60)::int, 0.5 + random() * 0.5
+        FROM drivers d CROSS JOIN generate_series(1, %s) day
+        WHERE d.username LIKE 'plancheck\\_%%'
+        ON CONFLICT (driver_id, date) DO NOTHING
+    """, (SEED_DAYS,))
+    rebuild_rollups(cur)
+    cur.execute("""
+        ANALYZE vehicles, drivers, orders, routes, route_stops, performance_metrics, periods,
+                driver_performance_rollups, fleet_performance_rollups
+    """)
+
+
+def sample_ids(cur):
+    """Real ids to bind, so plans are made for values that exist."""
+    cur.execute("""
+        SELECT d.id AS driver_id, d.username, r.id AS route_id, rs.id AS stop_id, rs.order_id,
+               o.created_at AS order_created_at
+        FROM route_stops rs
+        JOIN orders o ON rs.order_id = o.id
+        JOIN routes r ON rs.route_id = r.id
+        JOIN drivers d ON r.driver_id = d.id
+        ORDER BY r.planned_date DESC
+        LIMIT 1
+    """)
+    return cur.fetchone()
+
+
+def hot_queries(ids):
+    """(name, sql, params, tables allowed to be seq scanned). $n queries are PREPAREd first."""
+    update_sql, update_params = build_update_query()
+    today = date.today()
+    # GET /orders asks for one row more than the page to know whether another follows
+    page_rows = CONFIG.get("order_pages", {}).get("default_limit", 500) + 1
+    return [
+        ("orders_by_status",
+         ORDERS_PAGE_SQL.format(columns="*", where="WHERE status = %s"), ("PENDING", page_rows), set()),
+        ("orders_by_status_next_page",
+         ORDERS_PAGE_SQL.format(columns="*", where="WHERE status = %s AND (created_at, id) < (%s, %s::uuid)"),
+         ("DELIVERED", ids["order_created_at"], ids["order_id"], page_rows), set()),
+        ("orders_next_page",
+         ORDERS_PAGE_SQL.format(columns="*", where="WHERE (created_at, id) < (%s, %s::uuid)"),
+         (ids["order_created_at"], ids["order_id"], page_rows), set()),
+        ("optimizer_pending_orders", PENDING_ORDERS_SQL, (run_limits()[0],), set()),
+        ("optimizer_period_lookup", PERIOD_LOOKUP_SQL, (today,), set()),
+        ("routes_with_stops",
+         ROUTES_WITH_STOPS_SQL.format(where="r.planned_date = %s"), (today,), set()),
+        ("order_on_route", "SELECT 1 FROM route_stops WHERE order_id = %s LIMIT 1", (ids["order_id"],), set()),
+        ("risk_monitor_open_stops", OPEN_STOPS_SQL, (), set()),
+        ("analytics_summary", FLEET_ROLLUPS_SQL,
+         {"granularity": "day", "start": today - timedelta(days=29), "end": today}, set()),
+        ("driver_analytics", DRIVER_ROLLUPS_SQL,
+         {"driver_id": ids["driver_id"], "granularity": "week", "start": today - timedelta(weeks=11), "end": today}, set()),
+        # A week out of SEED_DAYS is a large enough slice that a scan may legitimately win
+        ("data_model_update", update_sql, tuple(update_params), {"performance_metrics"}),
+        ("login_user", HOT_QUERIES["login_user"], (ids["username"],), set()),
+        ("touch_driver", HOT_QUERIES["touch_driver"], (ids["driver_id"],), set()),
+        ("todays_route", HOT_QUERIES["todays_route"], (ids["driver_id"], today), set()),
+        ("route_stops", HOT_QUERIES["route_stops"], (ids["route_id"],), set()),
+        ("update_stop_status", HOT_QUERIES["update_stop_status"],
+         ("DELIVERED", None, ids["stop_id"], ids["driver_id"]), set()),
+        ("update_location", HOT_QUERIES["update_location"], (1.3, 103.8, ids["driver_id"]), set()),
+    ]
+
+
+def explain(cur, name, sql, params):
+    """Returns the top plan node of EXPLAIN (FORMAT JSON)."""
+    if "$1" in sql:
+        cur.execute(f"PREPARE plan_check_{name} AS {sql}")
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXPLAIN (FORMAT JSON) EXECUTE plan_check_{name}({placeholders})", params)
+    else:
+        cur.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+    plan = cur.fetchone()["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def seq_scans(node):
+    """Relations sequentially scanned anywhere in the plan tree."""
+    found = set()
+    if node.get("Node Type") == "Seq Scan":
+        found.add(node.get("Relation Name"))
+    for child in node.get("Plans", []):
+        found |= seq_scans(child)
+    return found
+
+
+def load_baseline():
+    """Recorded costs by query name, or None if no baseline has been recorded."""
+    if not os.path.exists(BASELINE_PATH):
+        return None
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def verify_query_plans(update_baseline=False, seed_data=True):
+    baseline = {} if update_baseline else load_baseline()
+    if baseline is None:
+        print(f"❌ No baseline at {BASELINE_PATH}; record one with --update-baseline")
+        return False
+    conn = psycopg2.connect(**get_db_params())
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    costs = {}
+    failures = 0
+    try:
+        if seed_data:
+            print("Seeding synthetic dataset (rolled back afterwards)...")
+            seed(cur)
+        ids = sample_ids(cur)
+        if ids is None:
+            print("❌ No route stops to plan against; run without --no-seed")
+            return False
+
+        for name, sql, params, allowed in hot_queries(ids):
+            plan = explain(cur, name, sql, params)
+            cost = plan["Total Cost"]
+            costs[name] = cost
+            problems = []
+
+            scanned = (seq_scans(plan) & LARGE_TABLES) - allowed
+            if scanned:
+                problems.append(f"seq scan on {', '.join(sorted(scanned))}")
+            if not update_baseline and name not in baseline:
+                problems.append("missing from the baseline")
+            elif not update_baseline and cost > baseline[name] * TOLERANCE:
+                problems.append(f"cost {cost:.0f} > {TOLERANCE:g}x baseline {baseline[name]:.0f}")
+
+            if problems:
+                failures += 1
+                print(f"❌ {name}: {'; '.join(problems)}")
+            else:
+                print(f"✅ {name} (cost {cost:.0f})")
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+    if update_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({k: round(v, 2) for k, v in sorted(costs.items())}, f, indent=2)
+            f.write("\n")
+        print(f"✅ Baseline written to {BASELINE_PATH}")
+
+    if failures:
+        print(f"❌ {failures} query plan(s) regressed")
+        return False
+    print("✅ All query plans use their indexes")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN-based regression check for hot queries")
+    parser.add_argument("--update-baseline", action="store_true", help="record current plan costs")
+    parser.add_argument("--no-seed", action="store_true", help="plan against existing data without seeding")
+    args = parser.parse_args()
+    sys.exit(0 if verify_query_plans(args.update_baseline, not args.no_seed) else 1)